@@ -0,0 +1,352 @@
+"""
+Bulk ingestion of a directory of reports, without going through the HTTP API.
+
+    python -m backend.api.ingest utils/sample_reports --out results.jsonl
+    python -m backend.api.ingest archive/ --out results.csv --workers 8
+    python -m backend.api.ingest archive/ --out results.jsonl --resume   # after an interruption
+
+Images and PDFs are OCR'd with ocr_service, text files are read as they
+are; values are extracted and analyzed (range comparison, risk and disease
+prediction) in a pool of worker processes. Each result is appended to the
+output as soon as its file is done, so the output doubles as the
+checkpoint: --resume skips every file already processed successfully and
+retries the ones that failed (their new record is appended after the old
+one, so the last record of a path is its current one). Throughput and
+per-file timings are printed at the end.
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"}
+TEXT_SUFFIXES = {".txt"}
+SUFFIXES = IMAGE_SUFFIXES | TEXT_SUFFIXES | {".pdf"}
+# Files submitted to the pool ahead of the ones running, per worker
+PREFETCH = 2
+
+
+def discover(root: Path, suffixes: set = SUFFIXES) -> list:
+    """Report files under `root` (recursively), as sorted paths relative to it."""
+    return sorted(p.relative_to(root) for p in root.rglob("*") if p.is_file() and p.suffix.lower() in suffixes)
+
+
+def _quiet_services():
+    # The services log every file at INFO
+    logging.getLogger("backend.api.services").setLevel(logging.WARNING)
+
+
+def _init_worker(log_level: int, page_workers: int):
+    # Ctrl-C is handled by the parent, which lets running files finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level)
+    _quiet_services()
+    from .services import capabilities, ocr_service
+    # Sized for this run's --workers, not the server's OCR_WORKERS
+    ocr_service.OCR_PAGE_WORKERS = page_workers
+    capabilities.probe()
+
+
+def process_file(root: str, rel: str, params=None, include_text: bool = False) -> dict:
+    """
+    OCR (or read), extract and analyze one file; never raises.
+
+    Returns the result record written to the output: path, sha256, status
+    ("ok" or "error"), timings in seconds, extracted values and analysis.
+    A PDF with pages that failed to OCR is an "error" with its partial values.
+    """
+    from .services import analysis_service, extract_service, ocr_service
+    from .services.hot_reload import file_digest
+    path = os.path.join(root, rel)
+    record = {"path": rel, "status": "ok"}
+    start = time.perf_counter()
+    try:
+        record["sha256"] = file_digest(Path(path))
+        if Path(rel).suffix.lower() in TEXT_SUFFIXES:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        else:
+            until = extract_service.StreamingExtractor(params) if params else None
+            text = ocr_service.image_to_text(path, None, until)
+        record["ocr_seconds"] = round(time.perf_counter() - start, 4)
+        if text.startswith("Error"):
+            record.update(status="error", error=text)
+        else:
+            values = extract_service.extract_key_values(text)
+            record["values"] = values
+            record["analysis"] = analysis_service.analyze(values)
+            if not ocr_service.is_complete(text):
+                # Values of the pages that were read are kept, but the file counts as failed and is retried
+                record.update(status="error", error="Some PDF pages failed to OCR; values are partial")
+        if include_text:
+            record["text"] = text
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {str(e)}")
+    record["seconds"] = round(time.perf_counter() - start, 4)
+    return record
+
+
+class JSONLWriter:
+    """One JSON record per line."""
+
+    def __init__(self, path: Path, append: bool):
+        self.f = open(path, "a" if append else "w", encoding="utf-8")
+
+    @staticmethod
+    def done(path: Path) -> set:
+        """Paths processed successfully in an earlier run's output; failed ones are retried."""
+        done = set()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and record.get("status") == "ok" and "path" in record:
+                    done.add(record["path"])
+        return done
+
+    def write(self, record: dict):
+        self.f.write(json.dumps(record) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class CSVWriter:
+    """One row per file: values and statuses per parameter, risk and top diseases."""
+
+    def __init__(self, path: Path, append: bool, params: list):
+        self.params = params
+        self.columns = (["path", "sha256", "status", "error", "seconds", "ocr_seconds"]
+                        + [c for p in params for c in (p, f"{p}_status")]
+                        + ["overall_risk", "risks", "diseases"])
+        new = not append or path.stat().st_size == 0
+        self.f = open(path, "a" if append else "w", encoding="utf-8", newline="")
+        self.writer = csv.DictWriter(self.f, fieldnames=self.columns, extrasaction="ignore")
+        if new:
+            self.writer.writeheader()
+
+    @staticmethod
+    def done(path: Path) -> set:
+        with open(path, encoding="utf-8", newline="") as f:
+            return {row["path"] for row in csv.DictReader(f) if row.get("path") and row.get("status") == "ok"}
+
+    def write(self, record: dict):
+        row = {k: record.get(k) for k in ("path", "sha256", "status", "error", "seconds", "ocr_seconds")}
+        analysis = record.get("analysis") or {}
+        comparison = analysis.get("comparison", {})
+        for p in self.params:
+            row[p] = record.get("values", {}).get(p)
+            row[f"{p}_status"] = comparison.get(p, {}).get("status")
+        prediction = analysis.get("prediction", {})
+        row["overall_risk"] = prediction.get("overall_risk")
+        row["risks"] = ";".join(prediction.get("risks", []))
+        diseases = analysis.get("diseases", {}).get("possible_diseases", {})
+        row["diseases"] = ";".join(f"{name}:{d['confidence']}" for name, d in diseases.items())
+        self.writer.writerow(row)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def _drop_partial_line(path: Path, block: int = 64 * 1024):
+    """Cut a line left half-written by an interrupted run, so appends start on a fresh line."""
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        # Scan back from the end for the last newline
+        while pos > 0:
+            start = max(0, pos - block)
+            f.seek(start)
+            chunk = f.read(pos - start)
+            i = chunk.rfind(b"\n")
+            if i != -1:
+                if start + i + 1 < end:
+                    f.truncate(start + i + 1)
+                return
+            pos = start
+        f.truncate(0)
+
+
+def summarize(records: list, wall: float, skipped: int) -> dict:
+    """Throughput and per-file timing figures of a run."""
+    times = sorted(r["seconds"] for r in records)
+
+    def pct(p):
+        return times[min(len(times) - 1, int(p / 100 * len(times)))] if times else None
+
+    return {
+        "processed": len(records),
+        "errors": sum(1 for r in records if r["status"] != "ok"),
+        "skipped": skipped,
+        "wall_seconds": round(wall, 2),
+        "files_per_second": round(len(records) / wall, 2) if wall > 0 else None,
+        "mean_seconds": round(statistics.fmean(times), 4) if times else None,
+        "p50_seconds": pct(50),
+        "p95_seconds": pct(95),
+        "max_seconds": times[-1] if times else None,
+        "slowest": [(r["path"], r["seconds"]) for r in sorted(records, key=lambda r: -r["seconds"])[:5]],
+    }
+
+
+def run(root: Path, files: list, writer, records: list, workers: int, executor: str = "process", params=None,
+        include_text: bool = False, progress_every: int = 50, stop: threading.Event = None):
+    """
+    Process `files` on a pool of `workers`, writing each record as it completes.
+
+    Records are also appended to `records`. Once `stop` is set, nothing new
+    is started: queued files are dropped, running ones are finished and
+    written, and run() returns False (True when every file was processed).
+    """
+    from .services import ocr_service
+    # Each worker process OCRs PDF pages on its own thread pool; keep
+    # workers x page threads within the cores
+    page_workers = ocr_service.page_workers_for(workers, executor)
+    if executor == "thread":
+        ocr_service.OCR_PAGE_WORKERS = page_workers
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(logging.getLogger().level, page_workers))
+    stop = stop or threading.Event()
+    pending = set()
+    todo = iter(files)
+    start = time.perf_counter()
+    try:
+        while True:
+            # Keep the pool busy without queuing the whole archive up front
+            while not stop.is_set() and len(pending) < workers * PREFETCH:
+                rel = next(todo, None)
+                if rel is None:
+                    break
+                pending.add(pool.submit(process_file, str(root), str(rel), params, include_text))
+            if stop.is_set():
+                for future in pending:
+                    future.cancel()
+                pending = {f for f in pending if not f.cancelled()}
+            if not pending:
+                break
+            # Time out now and then to notice `stop`
+            finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                if stop.is_set() and record["status"] != "ok":
+                    # Possibly caused by the interruption; leave it to --resume
+                    continue
+                writer.write(record)
+                records.append(record)
+                if record["status"] != "ok":
+                    logger.warning(f"{record['path']}: {record.get('error')}")
+                if len(records) % progress_every == 0:
+                    elapsed = time.perf_counter() - start
+                    logger.info(f"{len(records)}/{len(files)} files, {len(records) / elapsed:.2f} files/s")
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return not stop.is_set()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m backend.api.ingest",
+                                     description="OCR, extract and analyze a directory of blood reports")
+    parser.add_argument("root", type=Path, help="directory of images, PDFs and .txt reports (searched recursively)")
+    parser.add_argument("--out", type=Path, required=True, help="output file, .jsonl or .csv")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="output format (default: from --out suffix)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="files processed in parallel")
+    parser.add_argument("--executor", choices=("process", "thread"), default="process",
+                        help="worker processes (default) or threads")
+    parser.add_argument("--resume", action="store_true",
+                        help="append to --out, skipping files already done there and retrying failed ones")
+    parser.add_argument("--params", help="parameters needed, comma separated; multi-page PDFs stop once they "
+                                         "are found (default: read every page)")
+    parser.add_argument("--text", action="store_true", help="include the OCR text in JSONL records")
+    parser.add_argument("--report", type=Path, help="also write the run summary to this JSON file")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO)
+    _quiet_services()
+    if not args.root.is_dir():
+        parser.error(f"{args.root} is not a directory")
+    fmt = args.format or ("csv" if args.out.suffix.lower() == ".csv" else "jsonl")
+    if args.out.exists() and args.out.stat().st_size and not args.resume:
+        parser.error(f"{args.out} exists; pass --resume to continue it or remove it")
+
+    from .services import ml_service, ocr_backend, report_service
+    try:
+        ocr_backend.check_executor(ocr_backend.OCR_BACKEND, args.executor)
+        params = report_service.parse_params(args.params)
+    except (ValueError, report_service.ParamsUnavailable) as e:
+        parser.error(str(e))
+
+    files = discover(args.root)
+    skipped = 0
+    append = args.resume and args.out.exists()
+    writer_cls = CSVWriter if fmt == "csv" else JSONLWriter
+    if append:
+        _drop_partial_line(args.out)
+        done = writer_cls.done(args.out)
+        remaining = [f for f in files if str(f) not in done]
+        skipped = len(files) - len(remaining)
+        files = remaining
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "csv":
+        writer = CSVWriter(args.out, append, ml_service.RANGES.get().params)
+    else:
+        writer = JSONLWriter(args.out, append)
+    logger.info(f"{len(files)} files to process ({skipped} already done) with {args.workers} {args.executor} workers")
+
+    start = time.perf_counter()
+    records = []
+    stop = threading.Event()
+
+    def on_interrupt(signum, frame):
+        # A second Ctrl-C aborts without waiting for running files
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        logger.warning("Interrupted, finishing the files in progress (Ctrl-C again to abort)")
+        stop.set()
+
+    previous = signal.signal(signal.SIGINT, on_interrupt)
+    interrupted = False
+    try:
+        interrupted = not run(args.root, files, writer, records, max(1, args.workers), args.executor, params,
+                              args.text, stop=stop)
+    except KeyboardInterrupt:
+        interrupted = True
+    finally:
+        signal.signal(signal.SIGINT, previous)
+        writer.close()
+    summary = summarize(records, time.perf_counter() - start, skipped)
+
+    print(f"\n{'Interrupted' if interrupted else 'Done'}: {summary['processed']} files "
+          f"({summary['errors']} errors, {summary['skipped']} skipped) in {summary['wall_seconds']} s, "
+          f"{summary['files_per_second']} files/s")
+    if summary["processed"]:
+        print(f"Per file: mean {summary['mean_seconds']} s, p50 {summary['p50_seconds']} s, "
+              f"p95 {summary['p95_seconds']} s, max {summary['max_seconds']} s")
+        for path, seconds in summary["slowest"]:
+            print(f"  {seconds:>8.3f} s  {path}")
+    if interrupted:
+        print(f"Resume with: --resume --out {args.out}")
+    elif summary["errors"]:
+        print(f"Retry the failed files with: --resume --out {args.out}")
+    if args.report:
+        args.report.write_text(json.dumps(summary, indent=2))
+    return 130 if interrupted else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
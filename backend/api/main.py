@@ -1,9 +1,23 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pathlib import Path
-from .services import ocr_service, extract_service, ml_service
-from .services.disease_service import predict_diseases
+from typing import Optional
+from contextlib import asynccontextmanager
+from datetime import date
+from .services import ocr_service, ml_service, batch_service, disease_service, ocr_backend
+from .services.ocr_pool import OCR_POOL, OCRQueueFull, OCRTimeout
+from .services.ocr_cache import OCR_CACHE
+from .services.job_service import JOB_MANAGER, JobQueueFull
+from .services import upload_service, report_service, capabilities, metrics
+from .services import analysis_service, catalog_service, encoding
+from .services.history_service import HISTORY, ReportExists
+from .services.admission import ADMISSION, PRIORITY_BACKGROUND, Overloaded
+from .services.upload_service import UploadTooLarge, UploadSizeLimitMiddleware
+import os
+import json
+import sqlite3
 import uvicorn
 import logging
 
@@ -11,7 +25,33 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Blood Report Analyzer API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and warm up the risk model once per process instead of per request
+    if ml_service.MODEL_REGISTRY.load() is None:
+        ml_service.PICKLE_MODEL_REGISTRY.load()
+    ml_service.RANGES.load()
+    disease_service.RULES.load()
+    logger.info(f"Risk model: {ml_service.model_info()}")
+    # Fail at startup, not on the first upload, if OCR_PREPROCESS/OCR_BACKEND are invalid
+    ocr_service.get_preset()
+    ocr_service.get_backend(ocr_service.TESSERACT_CONFIG)
+    ocr_backend.check_executor(ocr_backend.OCR_BACKEND, OCR_POOL.kind)
+    # One-time probe of Tesseract/poppler/PyPDF2; subprocesses only, no imports
+    await run_in_threadpool(capabilities.probe)
+    OCR_POOL.start()
+    await JOB_MANAGER.start(run_report_job)
+    yield
+    await JOB_MANAGER.shutdown()
+    OCR_POOL.shutdown(wait=True)
+
+app = FastAPI(title="Blood Report Analyzer API", lifespan=lifespan)
+
+# Refuse oversized uploads before the multipart body is parsed
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/upload-report"])
+
+# Request latency histograms and a Server-Timing header with per-stage durations
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,38 +61,369 @@ app.add_middleware(
 )
 
 @app.post("/upload-report")
-async def upload_report(file: UploadFile = File(...)):
+async def upload_report(file: UploadFile = File(...), params: Optional[str] = None):
+    """
+    OCR a report and extract its values.
+
+    Every page is read by default. `params`, a comma separated list of the
+    parameters needed, opts in to early exit: multi-page PDFs stop being
+    read once they are all found. `params=all` is the same as leaving it out.
+    When the OCR backlog is too long to finish within ADMISSION_MAX_WAIT,
+    the upload is refused at once with 503 and a Retry-After header.
+    """
+    try:
+        wanted = report_service.parse_params(params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except report_service.ParamsUnavailable as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     try:
         logger.info(f"Processing file: {file.filename}")
-        content = await file.read()
-        logger.info(f"File size: {len(content)} bytes")
-        text = ocr_service.image_to_text(content)
-        logger.info(f"OCR extraction complete, text length: {len(text)}")
-        values = extract_service.extract_key_values(text)
-        logger.info(f"Extracted {len(values)} parameters")
-        return JSONResponse({"text": text, "values": values})
+        # Stream the upload to disk in chunks (hashing it on the way) instead of
+        # reading it into memory; OCR workers get the path, not the bytes
+        path, size, digest = await run_in_threadpool(
+            upload_service.spool_upload, file.file, Path(file.filename or "").suffix
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in upload_report: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    try:
+        logger.info(f"File size: {size} bytes")
+        # OCR runs on the pool (so the event loop keeps serving other requests),
+        # and re-uploads with the same OCR settings are served from cache
+        result, cache_status = await report_service.process_report(path, digest, params=wanted)
+        return JSONResponse(result, headers={"X-OCR-Cache": cache_status})
+    except ocr_service.ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Overloaded as e:
+        logger.warning(f"Shedding upload: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except OCRQueueFull as e:
+        logger.warning(f"Rejecting upload: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except OCRTimeout as e:
+        logger.error(f"Error in upload_report: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error in upload_report: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        os.unlink(path)
+
+async def run_report_job(job: dict, context: dict, emit):
+    """Job handler: OCR + extraction for an upload queued through POST /jobs."""
+    emit({"stage": "ocr"})
+    # Already accepted, so jobs wait for OCR capacity behind interactive uploads instead of being refused
+    result, cache_status = await report_service.process_report(context["path"], job["digest"], on_progress=emit,
+                                                               params=context["params"],
+                                                               priority=PRIORITY_BACKGROUND)
+    emit({"stage": "extracted", "values": len(result["values"]), "cache": cache_status})
+    return result
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile = File(...), params: Optional[str] = None):
+    """Queue a report for processing and return its job id right away; `params` as for /upload-report."""
+    try:
+        wanted = report_service.parse_params(params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except report_service.ParamsUnavailable as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
+    try:
+        path, size, digest = await run_in_threadpool(
+            upload_service.spool_upload, file.file, Path(file.filename or "").suffix
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in create_job: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    try:
+        job = await JOB_MANAGER.submit(
+            {"filename": file.filename, "size": size, "digest": digest},
+            context={"path": path, "params": wanted},
+            cleanup=lambda: os.unlink(path),
+        )
+    except JobQueueFull as e:
+        os.unlink(path)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    logger.info(f"Queued job {job['id']} for {file.filename} ({size} bytes)")
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events",
+    }
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status of a job, with its result once done."""
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-Sent Events stream of a job's progress; ends when the job is done or failed."""
+    if await run_in_threadpool(JOB_MANAGER.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    last_id = request.headers.get("last-event-id", "0")
+    after = int(last_id) if last_id.isdigit() else 0
+
+    async def stream():
+        nonlocal after
+        JOB_MANAGER.subscribe(job_id)
+        try:
+            while True:
+                if await request.is_disconnected():
+                    return
+                events = await JOB_MANAGER.wait_for_events(job_id, after)
+                if not events:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                for seq, event in events:
+                    after = seq
+                    yield f"id: {seq}\nevent: {event.get('stage', 'progress')}\ndata: {json.dumps(event)}\n\n"
+                    if event.get("stage") in ("done", "failed"):
+                        return
+        finally:
+            # Also when the client goes away mid-stream, whichever process runs the job
+            JOB_MANAGER.unsubscribe(job_id)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def _parse_analysis_query(view: Optional[str], fields: Optional[str]):
+    try:
+        return analysis_service.parse_view(view), analysis_service.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _require_ranges():
+    if ml_service.RANGES.get() is None:
+        logger.error("Analysis unavailable: normal ranges are not loaded")
+        raise HTTPException(status_code=503, detail="Analysis unavailable: normal ranges are not loaded")
+
+def _negotiate(request: Request) -> str:
+    try:
+        return encoding.negotiate(request.headers.get("accept"))
+    except encoding.NotAcceptable as e:
+        raise HTTPException(status_code=406, detail=str(e))
 
 @app.post("/analyze")
-async def analyze(values: dict):
+async def analyze(values: dict, request: Request, sex: Optional[str] = None, age: Optional[float] = None,
+                  view: Optional[str] = None, fields: Optional[str] = None, patient_id: Optional[str] = None,
+                  report_date: Optional[str] = None, replace: bool = False):
+    """
+    Compare values with their normal ranges and predict risks and diseases.
+
+    `view=compact` returns computed fields only: each parameter's status,
+    and each disease's confidence and matched indicator ids. The ranges,
+    units and disease text they refer to are served by GET /catalog, whose
+    version is sent in the X-Catalog-Version header. `fields` (comma
+    separated: comparison, prediction, diseases) computes only those.
+    Send `Accept: application/msgpack` for a MessagePack body.
+    With `patient_id`, the values are also stored in the patient's history
+    for `report_date` (default today) with this analysis (every field, in
+    the requested view), and the stored report's id is sent in the
+    X-Report-Id header. As for POST /patients/{patient_id}/reports, a
+    second report on the same date is a 409 unless `replace=true`; 503
+    when the history database cannot be written.
+    """
+    compact, wanted = _parse_analysis_query(view, fields)
+    media_type = _negotiate(request)
+    _require_ranges()
     try:
-        if not isinstance(values, dict):
-            raise HTTPException(status_code=400, detail="values must be a dict")
         logger.info(f"Analyzing {len(values)} values")
-        comparison = ml_service.compare_with_ranges(values)
-        prediction = ml_service.predict_risk(values)
-        diseases = predict_diseases(values)
-        logger.info(f"Analysis complete: {prediction}")
-        return JSONResponse({
-            "comparison": comparison, 
-            "prediction": prediction,
-            "diseases": diseases
-        })
+        # A stored report keeps its whole analysis, so every field is computed
+        # once and the response is cut down to the ones asked for
+        computed = analysis_service.FIELDS if patient_id else wanted
+        analysis = analysis_service.analyze(values, sex=sex, age=age, compact=compact, fields=computed)
+        result = {f: analysis[f] for f in wanted}
+        logger.info(f"Analysis complete: {result.get('prediction')}")
     except Exception as e:
         logger.error(f"Error in analyze: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    headers = {"X-Catalog-Version": catalog_service.catalog_version()} if compact else {}
+    if patient_id:
+        try:
+            stored = await run_in_threadpool(HISTORY.add_report, patient_id, report_date or date.today(), values,
+                                             sex, age, replace, analysis)
+        except ReportExists as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except (sqlite3.Error, OSError) as e:
+            raise _history_unavailable(patient_id, e)
+        headers["X-Report-Id"] = str(stored["report_id"])
+    return encoding.encoded_response(result, media_type, headers)
+
+@app.post("/analyze-batch")
+async def analyze_batch(payload: dict, view: Optional[str] = None, fields: Optional[str] = None):
+    """
+    Analyze many reports in one call, streamed back as NDJSON (one line per report).
+
+    Body: {"reports": [{...}, ...]} or {"columns": {"Hemoglobin": [...], ...}},
+    with optional "sex" and "age" given once or as one entry per report.
+    `view` and `fields` work as for /analyze.
+    """
+    compact, wanted = _parse_analysis_query(view, fields)
+    reports = payload.get("reports")
+    columns = payload.get("columns")
+    if reports is None and columns is None:
+        raise HTTPException(status_code=400, detail="body must contain 'reports' or 'columns'")
+    if reports is not None and not (isinstance(reports, list) and all(isinstance(r, dict) for r in reports)):
+        raise HTTPException(status_code=400, detail="reports must be a list of dicts")
+    if columns is not None and not (isinstance(columns, dict) and all(isinstance(c, list) for c in columns.values())):
+        raise HTTPException(status_code=400, detail="columns must be a dict of lists")
+
+    _require_ranges()
+    try:
+        # Validate the whole batch and build its matrix up front, so bad input
+        # anywhere gives a 400 instead of a stream cut off after the 200
+        prepared = await run_in_threadpool(batch_service.prepare_batch, reports, columns,
+                                           payload.get("sex"), payload.get("age"))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"Streaming batch analysis of {len(prepared[0])} reports")
+    body = batch_service.batch_ndjson(prepared, compact=compact, fields=wanted)
+
+    headers = {"X-Catalog-Version": catalog_service.catalog_version()} if compact else None
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+
+@app.get("/catalog")
+def catalog(request: Request, v: Optional[str] = None):
+    """
+    Disease descriptions, symptoms and indicators, risk levels and normal ranges.
+
+    Everything compact /analyze responses leave out, in one cacheable
+    document. Clients revalidate with If-None-Match (304 when unchanged);
+    /catalog?v=<version> is immutable and cached for a year, and 404s once
+    that version has been replaced. JSON, or MessagePack when accepted.
+    """
+    media_type = _negotiate(request)
+    version, body = catalog_service.get_catalog(media_type)
+    if v is not None and v != version:
+        raise HTTPException(status_code=404, detail=f"Catalog version {v} is not available; current is {version}")
+    etag = catalog_service.etag(version, media_type)
+    max_age = catalog_service.IMMUTABLE_MAX_AGE if v else catalog_service.CATALOG_MAX_AGE
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}" + (", immutable" if v else ""),
+        "Vary": "Accept",
+        "X-Catalog-Version": version,
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+def _history_unavailable(patient_id: str, e: Exception) -> HTTPException:
+    logger.error(f"Patient history of {patient_id} unavailable: {str(e)}")
+    return HTTPException(status_code=503, detail=f"Patient history unavailable: {str(e)}",
+                         headers={"Retry-After": "5"})
+
+@app.post("/patients/{patient_id}/reports", status_code=201)
+def add_patient_report(patient_id: str, payload: dict, replace: bool = False):
+    """
+    Store a report in the patient's history and return its analysis and updated trends.
+
+    Body: {"date": "YYYY-MM-DD", "values": {...}, "sex": ..., "age": ...};
+    "date" defaults to today, as for /analyze. A second report on the same
+    date is a 409 unless `replace=true`.
+    """
+    values = payload.get("values")
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=400, detail="values must be a dict")
+    age = payload.get("age")
+    if age is not None and (isinstance(age, bool) or not isinstance(age, (int, float))):
+        raise HTTPException(status_code=400, detail=f"age must be a number, got {age!r}")
+    try:
+        return HISTORY.add_report(patient_id, payload.get("date") or date.today(), values, sex=payload.get("sex"),
+                                  age=age, replace=replace)
+    except ReportExists as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (sqlite3.Error, OSError) as e:
+        raise _history_unavailable(patient_id, e)
+
+@app.get("/patients/{patient_id}/reports")
+def patient_reports(patient_id: str, start: Optional[str] = None, end: Optional[str] = None, limit: int = 100):
+    """A patient's stored reports between two dates (inclusive), newest first."""
+    try:
+        return HISTORY.reports(patient_id, start, end, min(max(limit, 1), 1000))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (sqlite3.Error, OSError) as e:
+        raise _history_unavailable(patient_id, e)
+
+@app.get("/patients/{patient_id}/trends")
+def patient_trends(patient_id: str, params: Optional[str] = None):
+    """
+    Per-parameter latest/previous value, min/max, mean and slope, with "changed since last report" flags.
+
+    Read from aggregates kept up to date on every insert, so the cost does
+    not grow with the length of the history.
+    """
+    wanted = [p.strip() for p in params.split(",") if p.strip()] if params else None
+    try:
+        return HISTORY.trends(patient_id, wanted)
+    except (sqlite3.Error, OSError) as e:
+        raise _history_unavailable(patient_id, e)
+
+@app.get("/patients/{patient_id}/series/{param}")
+def patient_series(patient_id: str, param: str, start: Optional[str] = None, end: Optional[str] = None):
+    """One parameter's values between two dates (inclusive), oldest first."""
+    try:
+        return HISTORY.series(patient_id, param, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (sqlite3.Error, OSError) as e:
+        raise _history_unavailable(patient_id, e)
+
+@app.get("/ocr-pool")
+def ocr_pool():
+    """Load of the OCR worker pool."""
+    return OCR_POOL.stats()
+
+@app.get("/admission")
+def admission():
+    """OCR admission control: capacity in cost units, units in use, waiting requests and decisions."""
+    return ADMISSION.stats()
+
+@app.get("/ocr-cache")
+def ocr_cache():
+    """Hit/miss counters and size of the OCR result cache."""
+    return OCR_CACHE.stats()
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Stage/request latency histograms and counters in Prometheus text format."""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health")
+def health():
+    """Capabilities probed at startup, model status and which heavy modules are loaded."""
+    caps = capabilities.probe()
+    return {
+        "status": "ok",
+        "capabilities": {**caps, "model": ml_service.model_info(),
+                         "ocr_backend": ocr_service.get_backend(ocr_service.TESSERACT_CONFIG).name},
+        "imports": capabilities.import_report(),
+    }
+
+@app.get("/model")
+def model():
+    """Version and load time of the risk model currently being served."""
+    return ml_service.model_info()
 
 @app.get("/")
 def root():
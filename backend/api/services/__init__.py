@@ -1,3 +1,3 @@
-from . import ocr_service, extract_service, ml_service
+from . import ocr_service, extract_service, ml_service, batch_service
 
-__all__ = ['ocr_service', 'extract_service', 'ml_service']
+__all__ = ['ocr_service', 'extract_service', 'ml_service', 'batch_service']
@@ -0,0 +1,275 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from . import ocr_service, metrics
+from .ocr_pool import OCR_POOL
+
+logger = logging.getLogger(__name__)
+
+# OCR work admitted at once, in cost units; one unit is about one page of
+# Tesseract, so the default lets every OCR worker run one page-sized job
+ADMISSION_CAPACITY = float(os.environ.get("ADMISSION_CAPACITY", str(OCR_POOL.workers)))
+# Longest an upload may wait for capacity; if the predicted wait is longer
+# it is refused right away with 503 and a Retry-After
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", "15"))
+# Seconds one cost unit takes before any has been measured
+ADMISSION_UNIT_SECONDS = float(os.environ.get("ADMISSION_UNIT_SECONDS", "2"))
+# Cost of a PDF page read from its text layer; images cost one unit (they
+# are shrunk to OCR_MAX_WIDTH before OCR), more once decoding them
+# outweighs that: one unit per this many megapixels
+TEXT_PAGE_COST = 0.05
+IMAGE_UNIT_MEGAPIXELS = 25
+# Weight of the latest job in the decayed totals of seconds and units served
+SERVICE_TIME_ALPHA = 0.2
+# Jobs that fit the free capacity may start before a waiting job too big to
+# fit, until that job has waited this many seconds; from then on nothing
+# overtakes it, so big jobs are not starved
+ADMISSION_BACKFILL_AGE = float(os.environ.get("ADMISSION_BACKFILL_AGE", "2"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class Overloaded(Exception):
+    """Raised when OCR work cannot be admitted within the wait bound; `retry_after` is in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Page tree levels walked up looking for inherited page attributes
+MAX_PAGE_TREE_DEPTH = 32
+
+
+def _inherited(page, key: str):
+    """A page attribute, from the page itself or the nearest /Pages ancestor that sets it."""
+    node = page
+    for _ in range(MAX_PAGE_TREE_DEPTH):
+        if key in node:
+            return node[key]
+        if "/Parent" not in node:
+            return None
+        node = node["/Parent"]
+    return None
+
+
+def _pdf_cost(path: str) -> float:
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    pages = len(reader.pages)
+    if pages == 0:
+        return TEXT_PAGE_COST
+    resources = _inherited(reader.pages[0], "/Resources") or {}
+    xobjects = resources["/XObject"] if "/XObject" in resources else {}
+    scanned = "/Font" not in resources and any(
+        xobjects[name].get("/Subtype") == "/Image" for name in xobjects)
+    if not scanned:
+        # Has a text layer, or nothing shows it is a scan: PyPDF2 reads it
+        # without rasterizing (at most 10 pages)
+        return min(pages, 10) * TEXT_PAGE_COST
+    return min(pages, ocr_service.OCR_MAX_PDF_PAGES)
+
+
+def _image_cost(path: str) -> float:
+    # Only the header is read; the size is the one it will be decoded at
+    with ocr_service.open_image(path) as img:
+        width, height = img.size
+    return max(1.0, width * height / 1e6 / IMAGE_UNIT_MEGAPIXELS)
+
+
+def estimate_cost(path: str) -> float:
+    """
+    Estimated OCR cost of an uploaded file, in units of one Tesseract page.
+
+    PDFs with a text layer cost a fraction of a unit per page, scanned PDFs
+    (first page resources, inherited ones included, with images and no
+    fonts) one unit per page OCR'd, images one unit (more for very large ones).
+    Files that cannot be inspected cost one unit.
+    """
+    try:
+        with open(path, "rb") as f:
+            is_pdf = f.read(4) == b"%PDF"
+        return _pdf_cost(path) if is_pdf else _image_cost(path)
+    except Exception as e:
+        logger.debug(f"Could not estimate the cost of {path}: {str(e)}")
+        return 1.0
+
+
+class AdmissionController:
+    """
+    Weighted admission of OCR work, so overload is refused instead of slowing everyone down.
+
+    Jobs hold their estimated cost while they run, and at most `capacity`
+    units run at once. The rest wait in priority order (interactive uploads
+    before background jobs, then first come first served). When the first
+    waiting job does not fit the free capacity, later jobs that do fit
+    (text-layer PDFs behind a scanned one, say) start ahead of it, but
+    only until it has waited `backfill_age` seconds. An interactive
+    request whose predicted wait exceeds `max_wait` is refused immediately,
+    with a Retry-After for when the backlog should have drained; background
+    jobs were already accepted, so they wait as long as it takes. The
+    prediction uses the measured service time per cost unit.
+
+    Requests that do no OCR (/analyze, cache hits) never come through here:
+    that is their priority lane. They are never queued or shed, and the OCR
+    they would compete with runs in worker processes niced by
+    OCR_WORKER_NICE, so the OS schedules them first.
+    Used from the event loop only.
+    """
+
+    def __init__(self, capacity: float = ADMISSION_CAPACITY, max_wait: float = ADMISSION_MAX_WAIT,
+                 unit_seconds: float = ADMISSION_UNIT_SECONDS, backfill_age: float = ADMISSION_BACKFILL_AGE):
+        self.capacity = max(capacity, 0.1)
+        self.max_wait = max_wait
+        self.backfill_age = backfill_age
+        # Decayed totals, seeded with one unit taking `unit_seconds`
+        self._served_seconds = unit_seconds
+        self._served_units = 1.0
+        self._in_use = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        # Guards the counters read by stats() from other threads
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    @property
+    def unit_seconds(self) -> float:
+        """Measured seconds per cost unit (time over cost, so cheap jobs' fixed overhead is not magnified)."""
+        return self._served_seconds / self._served_units
+
+    def predicted_wait(self, cost: float, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Seconds a new job of `cost` would wait, given what runs and waits ahead of it."""
+        ahead = sum(w[2] for w in self._waiters if w[0] <= priority and not w[3].done())
+        excess = self._in_use + ahead + cost - self.capacity
+        return max(0.0, excess * self.unit_seconds / self.capacity)
+
+    async def acquire(self, cost: float, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        Wait until `cost` units can run; returns the cost held (capped at capacity).
+
+        Raises:
+            Overloaded: for interactive work that would wait more than max_wait.
+        """
+        # A job bigger than the whole capacity still runs, alone
+        cost = round(min(cost, self.capacity), 3)
+        bounded = priority == PRIORITY_INTERACTIVE
+        if self._in_use + cost <= self.capacity and self._may_overtake():
+            self._in_use = round(self._in_use + cost, 6)
+            with self._lock:
+                self._admitted += 1
+            metrics.ADMISSIONS.inc(result="admitted")
+            return cost
+
+        wait = self.predicted_wait(cost, priority)
+        if bounded and wait > self.max_wait:
+            with self._lock:
+                self._rejected += 1
+            metrics.ADMISSIONS.inc(result="rejected")
+            raise Overloaded(f"Server busy: about {wait:.0f} s of OCR work queued ahead",
+                             self._retry_after(wait))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), cost, future, time.monotonic())
+        heapq.heappush(self._waiters, entry)
+        with self._lock:
+            self._queued += 1
+        metrics.ADMISSIONS.inc(result="queued")
+        # Entries left by cancelled waiters may be all that blocked the fast path
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait if bounded else None)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Admitted just as we gave up; hand the units back
+                self.release(cost)
+            else:
+                future.cancel()
+                self._wake()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            with self._lock:
+                self._timed_out += 1
+            metrics.ADMISSIONS.inc(result="timeout")
+            raise Overloaded(f"Server busy: no OCR capacity within {self.max_wait:.0f} s",
+                             self._retry_after(self.predicted_wait(cost, priority)))
+        with self._lock:
+            self._admitted += 1
+        return cost
+
+    def release(self, cost: float, seconds: float = None):
+        """Return `cost` units; `seconds` (how long the job ran) updates the service time estimate."""
+        # Rounded so repeated fractional costs do not leave units stuck
+        self._in_use = max(0.0, round(self._in_use - cost, 6))
+        if seconds is not None and cost > 0:
+            self._served_seconds += SERVICE_TIME_ALPHA * (seconds - self._served_seconds)
+            self._served_units += SERVICE_TIME_ALPHA * (cost - self._served_units)
+        self._wake()
+
+    def _may_overtake(self) -> bool:
+        """Whether a job that fits the free capacity may start before the first waiting one."""
+        while self._waiters and self._waiters[0][3].done():
+            heapq.heappop(self._waiters)
+        return not self._waiters or time.monotonic() - self._waiters[0][4] < self.backfill_age
+
+    def _wake(self):
+        while self._waiters:
+            cost, future = self._waiters[0][2:4]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self._in_use + cost > self.capacity:
+                break
+            heapq.heappop(self._waiters)
+            self._in_use = round(self._in_use + cost, 6)
+            future.set_result(None)
+        if not self._may_overtake():
+            return
+        # The first waiter does not fit yet; start the later ones that do, in
+        # order. Admitted entries stay in the heap, done, until they reach the top
+        for _, _, cost, future, _ in sorted(self._waiters)[1:]:
+            if not future.done() and self._in_use + cost <= self.capacity:
+                self._in_use = round(self._in_use + cost, 6)
+                future.set_result(None)
+
+    def _retry_after(self, wait: float) -> int:
+        # When the backlog should have drained enough for a new request to get in
+        return max(1, math.ceil(wait - self.max_wait))
+
+    @asynccontextmanager
+    async def slot(self, cost: float, priority: int = PRIORITY_INTERACTIVE):
+        """Hold `cost` units for the enclosed block (see acquire)."""
+        with metrics.span("admission"):
+            held = await self.acquire(cost, priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(held, time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "max_wait": self.max_wait,
+                "in_use": round(self._in_use, 3),
+                "waiting": sum(1 for w in list(self._waiters) if not w[3].done()),
+                "unit_seconds": round(self.unit_seconds, 3),
+                "backfill_age": self.backfill_age,
+                "admitted": self._admitted,
+                "queued": self._queued,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+            }
+
+
+ADMISSION = AdmissionController()
@@ -0,0 +1,44 @@
+from . import ml_service, disease_service
+
+# "compact" leaves out everything /catalog serves (ranges, units, descriptions, ...)
+VIEWS = ("full", "compact")
+# Top-level fields of an analysis; stages whose field is not requested are skipped
+FIELDS = ("comparison", "prediction", "diseases")
+
+
+def parse_view(view: str = None) -> bool:
+    """True for the compact view. Raises ValueError for unknown views."""
+    view = (view or "full").strip().lower()
+    if view not in VIEWS:
+        raise ValueError(f"Unknown view {view!r}; choose from {', '.join(VIEWS)}")
+    return view == "compact"
+
+
+def parse_fields(value: str = None) -> tuple:
+    """
+    Fields to compute, from a comma separated query value (default: all).
+
+    Raises:
+        ValueError: for unknown or no fields.
+    """
+    if value is None:
+        return FIELDS
+    wanted = {f.strip() for f in value.split(",") if f.strip()}
+    unknown = sorted(wanted - set(FIELDS))
+    if unknown or not wanted:
+        raise ValueError(f"Unknown field(s) {', '.join(unknown) or repr(value)}; "
+                         f"choose from {', '.join(FIELDS)}")
+    # Response order stays the same whatever order they were asked in
+    return tuple(f for f in FIELDS if f in wanted)
+
+
+def analyze(values: dict, sex=None, age=None, compact: bool = False, fields: tuple = FIELDS) -> dict:
+    """Range comparison, risk prediction and disease prediction for one report."""
+    result = {}
+    if "comparison" in fields:
+        result["comparison"] = ml_service.compare_with_ranges(values, sex=sex, age=age, compact=compact)
+    if "prediction" in fields:
+        result["prediction"] = ml_service.predict_risk(values)
+    if "diseases" in fields:
+        result["diseases"] = disease_service.predict_diseases(values, compact=compact)
+    return result
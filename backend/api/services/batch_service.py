@@ -0,0 +1,136 @@
+import json
+import logging
+import numpy as np
+from . import ml_service, disease_service
+from .analysis_service import FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Reports scored per vectorized pass; bounds memory while streaming results
+CHUNK_SIZE = 2048
+
+
+def _per_report(value, n: int, name: str) -> list:
+    """Broadcast a scalar (or None) to n entries, or validate a per-report list."""
+    if isinstance(value, (list, tuple)):
+        if len(value) != n:
+            raise ValueError(f"{name} must have one entry per report ({n}), got {len(value)}")
+        return list(value)
+    return [value] * n
+
+
+def _reports_from_columns(columns: dict) -> list:
+    """Turn columnar input {"Hemoglobin": [...], ...} into per-report dicts."""
+    lengths = {len(v) for v in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("all columns must have the same length")
+    n = lengths.pop() if lengths else 0
+    names = list(columns)
+    return [
+        {k: columns[k][i] for k in names if columns[k][i] is not None}
+        for i in range(n)
+    ]
+
+
+def _matrix(reports: list, columns: list):
+    """(n_reports, len(columns)) float matrix, NaN where a report lacks a value."""
+    return np.array([[r.get(c) for c in columns] for r in reports], dtype=float).reshape(len(reports), len(columns))
+
+
+def _age(value, i: int):
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise ValueError(f"age of report {i} must be a number, got {value!r}")
+    return value
+
+
+def prepare_batch(reports: list = None, columns: dict = None, sex=None, age=None) -> tuple:
+    """
+    Validate a whole batch and build its value matrix before anything is scored.
+
+    Every report's values, sex and age are checked here, so a bad entry
+    anywhere in the batch raises before a response is started.
+
+    Args:
+        reports: List of {parameter: value} dicts, or
+        columns: Columnar input {parameter: [value per report]}
+        sex: One value for every report, or a list with one per report
+        age: Same as sex
+
+    Returns:
+        (reports, X, matrix_columns, buckets): the per-report dicts, the
+        (n_reports, len(matrix_columns)) float matrix with NaN for missing
+        values, its column names, and each report's range-table row
+
+    Raises:
+        ValueError, TypeError: for values that are not numbers or lists of the wrong length
+    """
+    if reports is None:
+        reports = _reports_from_columns(columns or {})
+    n = len(reports)
+    sexes = _per_report(sex, n, "sex")
+    ages = _per_report(age, n, "age")
+    buckets = np.array([ml_service.bucket_index(s, _age(a, i)) for i, (s, a) in enumerate(zip(sexes, ages))],
+                       dtype=np.intp)
+
+    # One matrix over every parameter any stage looks at; the model features
+    # come first so they are a plain column slice
+    rules = disease_service.RULES.get()
+    matrix_columns = list(dict.fromkeys(
+        ml_service.FEATURES + ml_service.RANGES.get().params + (rules.params if rules else [])
+    ))
+    return reports, _matrix(reports, matrix_columns), matrix_columns, buckets
+
+
+def score_batch(prepared: tuple, chunk_size: int = CHUNK_SIZE, compact: bool = False, fields: tuple = FIELDS):
+    """
+    Range comparison, model and rule scoring of a prepared batch, one chunk at a time.
+
+    Args:
+        prepared: Result of prepare_batch
+        chunk_size: Reports scored per vectorized pass
+        compact: Compact view, as for /analyze
+        fields: Fields to compute, as for /analyze
+
+    Yields:
+        One dict per report, in input order, with the same `fields` as
+        /analyze plus its "index"
+    """
+    reports, X_all, matrix_columns, buckets_all = prepared
+    n = len(reports)
+    n_features = len(ml_service.FEATURES)
+    for start in range(0, n, chunk_size):
+        chunk = reports[start:start + chunk_size]
+        X = X_all[start:start + chunk_size]
+        buckets = buckets_all[start:start + chunk_size]
+        stages = {}
+        if "comparison" in fields:
+            stages["comparison"] = ml_service.compare_batch(X, matrix_columns, chunk, buckets, compact=compact)
+        if "prediction" in fields:
+            stages["prediction"] = ml_service.predict_risk_batch(X[:, :n_features])
+        if "diseases" in fields:
+            stages["diseases"] = disease_service.predict_diseases_batch(X, matrix_columns, chunk, compact=compact)
+
+        for i in range(len(chunk)):
+            result = {"index": start + i}
+            for name, rows in stages.items():
+                result[name] = rows[i]
+            yield result
+        logger.info(f"Batch analysis: scored reports {start}-{start + len(chunk) - 1} of {n}")
+
+
+def analyze_batch(reports: list = None, columns: dict = None, sex=None, age=None, chunk_size: int = CHUNK_SIZE,
+                  compact: bool = False, fields: tuple = FIELDS):
+    """
+    Analyze many reports with whole-matrix range comparison, model and rule scoring.
+
+    prepare_batch followed by score_batch; see those for the arguments.
+    The whole batch is validated before the first report is yielded.
+    """
+    prepared = prepare_batch(reports, columns, sex, age)
+    yield from score_batch(prepared, chunk_size=chunk_size, compact=compact, fields=fields)
+
+
+def batch_ndjson(prepared: tuple, **kwargs):
+    """score_batch serialized as newline-delimited JSON, one line per report."""
+    for result in score_batch(prepared, **kwargs):
+        yield json.dumps(result) + "\n"
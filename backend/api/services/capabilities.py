@@ -0,0 +1,115 @@
+import importlib
+import importlib.util
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Configure Tesseract path for Windows
+TESSERACT_PATH = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+TESSERACT_CMD = TESSERACT_PATH if os.path.exists(TESSERACT_PATH) else "tesseract"
+
+# Modules worth reporting on in the import-time report
+HEAVY_MODULES = ("numpy", "joblib", "sklearn", "PIL", "pytesseract", "pandas", "PyPDF2", "pdf2image")
+
+# First-import durations of modules loaded through lazy_import, in ms
+IMPORT_TIMES = {}
+_import_lock = threading.Lock()
+
+_capabilities = None
+_probe_lock = threading.Lock()
+
+
+def lazy_import(name: str):
+    """Import a module on first use and record how long the import took."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with _import_lock:
+        already_loaded = name in sys.modules
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        if not already_loaded:
+            IMPORT_TIMES[name] = round((time.perf_counter() - start) * 1000, 2)
+            logger.info(f"Imported {name} in {IMPORT_TIMES[name]} ms")
+    return module
+
+
+def import_report() -> dict:
+    """Which heavy modules this process has loaded, and what lazy imports cost."""
+    return {
+        "lazy_import_ms": dict(IMPORT_TIMES),
+        "loaded": [m for m in HEAVY_MODULES if m in sys.modules],
+        "not_loaded": [m for m in HEAVY_MODULES if m not in sys.modules],
+    }
+
+
+def _run_version(cmd: list):
+    """First line of `cmd`'s output, or None if the tool is missing or fails."""
+    if shutil.which(cmd[0]) is None and not os.path.exists(cmd[0]):
+        return None
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    text = (out.stdout or out.stderr).strip()
+    return text.splitlines()[0] if text else ""
+
+
+def _probe_tesseract() -> dict:
+    version = _run_version([TESSERACT_CMD, "--version"])
+    return {"available": version is not None, "version": version, "cmd": TESSERACT_CMD}
+
+
+def _probe_poppler() -> dict:
+    version = _run_version(["pdfinfo", "-v"])
+    return {"available": version is not None, "version": version}
+
+
+def _probe_module(name: str) -> dict:
+    # find_spec locates the package without importing it
+    return {"available": importlib.util.find_spec(name) is not None}
+
+
+def probe() -> dict:
+    """
+    Probe external tools and optional libraries once, without importing them.
+
+    Runs `tesseract --version` and `pdfinfo -v` and checks that PyPDF2,
+    pdf2image and msgpack are installed. The result is cached for the life
+    of the process; call again with `refresh()` after installing something.
+    """
+    global _capabilities
+    with _probe_lock:
+        if _capabilities is None:
+            start = time.perf_counter()
+            caps = {
+                "tesseract": _probe_tesseract(),
+                "poppler": _probe_poppler(),
+                "pypdf2": _probe_module("PyPDF2"),
+                "pdf2image": _probe_module("pdf2image"),
+                "msgpack": _probe_module("msgpack"),
+            }
+            caps["probe_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            caps["probed_at"] = time.time()
+            _capabilities = caps
+            logger.info(f"Capabilities: tesseract={caps['tesseract']['available']} "
+                        f"poppler={caps['poppler']['available']} pypdf2={caps['pypdf2']['available']}")
+    return _capabilities
+
+
+def refresh() -> dict:
+    global _capabilities
+    with _probe_lock:
+        _capabilities = None
+    return probe()
+
+
+def has(name: str) -> bool:
+    """True if the named capability ("tesseract", "poppler", ...) is available."""
+    return probe().get(name, {}).get("available", False)
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import threading
+from . import disease_service, ml_service, encoding
+
+# Cache lifetime of GET /catalog; versioned URLs (?v=<version>) never change
+CATALOG_MAX_AGE = int(os.environ.get("CATALOG_MAX_AGE", "3600"))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Bumped when the shape of the catalog changes, so clients refetch it
+CATALOG_SCHEMA = 1
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def catalog_version() -> str:
+    """Version of the current catalog: changes whenever disease_rules.json or normal_ranges.json does."""
+    disease_service.RULES.get()
+    ml_service.RANGES.get()
+    rules = disease_service.RULES.info().get("sha256", "")
+    ranges = ml_service.RANGES.info().get("sha256", "")
+    return hashlib.sha256(f"{CATALOG_SCHEMA}:{rules}:{ranges}".encode()).hexdigest()[:12]
+
+
+def build_catalog() -> dict:
+    """
+    Static metadata that compact /analyze responses leave out.
+
+    Disease descriptions, symptoms and indicators (with the ids compact
+    results refer to), the risk level and recommendation for each
+    confidence band, and the normal ranges and units of every parameter.
+    """
+    rules = disease_service.RULES.get()
+    return {
+        "version": catalog_version(),
+        "diseases": rules.catalog() if rules else {},
+        "min_confidence": disease_service.MIN_CONFIDENCE,
+        "risk_levels": [
+            {"min_confidence": low, "risk_level": level, "recommendation": recommendation}
+            for low, level, recommendation in disease_service.RISK_LEVELS
+        ],
+        "ranges": ml_service.RANGES.get().spec,
+    }
+
+
+def get_catalog(media_type: str = encoding.JSON_TYPE) -> tuple:
+    """
+    (version, body) of the current catalog, serialized as `media_type`.
+
+    Bodies are built once per catalog version and media type, so repeated
+    requests cost a dict lookup.
+    """
+    version = catalog_version()
+    key = (version, media_type)
+    body = _cache.get(key)
+    if body is None:
+        with _lock:
+            body = _cache.get(key)
+            if body is None:
+                # Old versions are never served again
+                for stale in [k for k in _cache if k[0] != version]:
+                    del _cache[stale]
+                body = _cache[key] = encoding.ENCODERS[media_type](build_catalog())
+    return version, body
+
+
+def etag(version: str, media_type: str = encoding.JSON_TYPE) -> str:
+    """Strong ETag of one catalog version in one encoding."""
+    return f'"catalog-{version}-{media_type.rsplit("/", 1)[-1]}"'
@@ -1,166 +1,250 @@
 import json
+import logging
 from pathlib import Path
+import numpy as np
+from .hot_reload import WatchedFile
+from . import metrics
 
-HERE = Path(__file__).parent.parent
+logger = logging.getLogger(__name__)
 
+HERE = Path(__file__).parent.parent
 # Disease diagnosis rules based on blood parameters
-DISEASE_RULES = {
-    "Anemia": {
-        "description": "Low red blood cell count or hemoglobin levels",
-        "indicators": [
-            {"param": "Hemoglobin", "operator": "<", "value": 11, "weight": 0.9},
-            {"param": "WBC", "operator": "<", "value": 4000, "weight": 0.3},
-        ],
-        "symptoms": ["Fatigue", "Shortness of breath", "Weakness", "Pale skin"]
-    },
-    "Kidney Disease": {
-        "description": "Impaired kidney function",
-        "indicators": [
-            {"param": "Creatinine", "operator": ">", "value": 1.3, "weight": 0.85},
-            {"param": "Bilirubin", "operator": ">", "value": 1.5, "weight": 0.2},
-        ],
-        "symptoms": ["Fatigue", "Swelling in legs", "Difficulty urinating", "Blood in urine"]
-    },
-    "Liver Disease": {
-        "description": "Impaired liver function",
-        "indicators": [
-            {"param": "SGPT", "operator": ">", "value": 56, "weight": 0.8},
-            {"param": "SGOT", "operator": ">", "value": 40, "weight": 0.8},
-            {"param": "Bilirubin", "operator": ">", "value": 1.2, "weight": 0.7},
-        ],
-        "symptoms": ["Jaundice", "Fatigue", "Abdominal pain", "Dark urine"]
-    },
-    "Infection/Leukemia": {
-        "description": "Bacterial or viral infection, possible blood disorder",
-        "indicators": [
-            {"param": "WBC", "operator": ">", "value": 11000, "weight": 0.75},
-            {"param": "Platelets", "operator": "<", "value": 150000, "weight": 0.6},
-        ],
-        "symptoms": ["Fever", "Chills", "Easy bruising", "Frequent infections"]
-    },
-    "Hemolytic Anemia": {
-        "description": "Destruction of red blood cells",
-        "indicators": [
-            {"param": "Hemoglobin", "operator": "<", "value": 10, "weight": 0.85},
-            {"param": "Bilirubin", "operator": ">", "value": 2.0, "weight": 0.8},
-            {"param": "WBC", "operator": ">", "value": 8000, "weight": 0.4},
-        ],
-        "symptoms": ["Dark urine", "Yellowing of skin", "Shortness of breath", "Headache"]
-    },
-    "Thrombocytopenia": {
-        "description": "Low platelet count",
-        "indicators": [
-            {"param": "Platelets", "operator": "<", "value": 150000, "weight": 0.95},
-            {"param": "Hemoglobin", "operator": "<", "value": 12, "weight": 0.3},
-        ],
-        "symptoms": ["Easy bruising", "Petechiae (small red spots)", "Bleeding gums", "Nosebleeds"]
-    },
-    "Polycythemia": {
-        "description": "High red blood cell count",
-        "indicators": [
-            {"param": "Hemoglobin", "operator": ">", "value": 18, "weight": 0.85},
-            {"param": "WBC", "operator": ">", "value": 9000, "weight": 0.4},
-        ],
-        "symptoms": ["Headache", "Dizziness", "Shortness of breath", "Itching"]
-    }
-}
-
-
-def predict_diseases(values: dict):
+RULES_PATH = HERE / "utils" / "disease_rules.json"
+
+# Diseases below this confidence (%) are left out of the results
+MIN_CONFIDENCE = 30
+# (minimum confidence, risk level, recommendation), highest first
+RISK_LEVELS = (
+    (80, "High Risk", "⚠️ Immediate medical consultation strongly recommended"),
+    (60, "Moderate Risk", "⚠️ Medical consultation recommended within a few days"),
+    (40, "Medium Risk", "ℹ️ Consider consulting a healthcare professional"),
+    (0, "Low Risk", "ℹ️ Monitor and consult doctor if symptoms appear"),
+)
+
+
+@metrics.timed("predict_diseases")
+def predict_diseases(values: dict, compact: bool = False):
     """
     Predict possible diseases based on blood report parameters.
     
     Args:
         values: Dictionary of blood test parameters and their values
+        compact: Return only confidences and matched indicator ids (see
+            CompiledRules.build_compact_result)
     
     Returns:
         Dictionary with disease predictions and their confidence scores
     """
-    disease_predictions = {}
-    
-    for disease_name, disease_info in DISEASE_RULES.items():
-        confidence_score = 0.0
-        matched_indicators = []
-        
-        for indicator in disease_info["indicators"]:
-            param = indicator["param"]
-            operator = indicator["operator"]
-            threshold = indicator["value"]
-            weight = indicator["weight"]
-            
-            if param not in values:
+    rules = RULES.get()
+    if rules is None:
+        return _no_rules_result(compact)
+    row = np.array([[values.get(p) for p in rules.params]], dtype=float)
+    confidence, match = rules.score(row)
+    if compact:
+        return rules.build_compact_result(confidence[0], match[0])
+    return rules.build_result(values, confidence[0], match[0])
+
+
+class CompiledRules:
+    """
+    Disease rules compiled into indicator arrays for whole-matrix scoring.
+
+    Indicators are flattened to K columns (parameter index, threshold,
+    operator mask); `weights` is a (diseases x K) matrix, so the confidence of
+    every disease for every report is one comparison and one matrix product.
+    A disease may have several indicators on the same parameter. Each
+    indicator has a stable id, "<disease>.<position in its list>", used by
+    compact results and the /catalog endpoint.
+    """
+
+    def __init__(self, rules: dict):
+        self.rules = rules
+        self.diseases = list(rules)
+        self.params = []
+        ind_param, ind_thr, ind_lt, ind_disease, ind_weight = [], [], [], [], []
+        self.indicators = []
+        self.indicator_ids = []
+        for d, name in enumerate(self.diseases):
+            for i, ind in enumerate(rules[name]["indicators"]):
+                if ind["param"] not in self.params:
+                    self.params.append(ind["param"])
+                ind_param.append(self.params.index(ind["param"]))
+                ind_thr.append(ind["value"])
+                ind_lt.append(ind["operator"] == "<")
+                ind_disease.append(d)
+                ind_weight.append(ind["weight"])
+                self.indicators.append(ind)
+                self.indicator_ids.append(f"{name}.{i}")
+        self.index = {p: i for i, p in enumerate(self.params)}
+        self.ind_param = np.array(ind_param, dtype=np.intp)
+        self.ind_thr = np.array(ind_thr, dtype=float)
+        self.ind_lt = np.array(ind_lt, dtype=bool)
+        self.ind_gt = np.array([ind["operator"] == ">" for ind in self.indicators], dtype=bool)
+        self.ind_disease = np.array(ind_disease, dtype=np.intp)
+        self.weights = np.zeros((len(self.diseases), len(self.indicators)))
+        self.weights[self.ind_disease, np.arange(len(self.indicators))] = ind_weight
+        self.max_weight = self.weights.sum(axis=1)
+        self.safe_max_weight = np.where(self.max_weight > 0, self.max_weight, np.inf)
+        self.disease_indicators = [np.flatnonzero(self.ind_disease == d).tolist() for d in range(len(self.diseases))]
+
+    def score(self, X):
+        """
+        Score a (n_reports, len(params)) matrix; NaN marks a missing value.
+
+        Returns (confidence percentages of shape (n, diseases), indicator
+        match mask of shape (n, K)).
+        """
+        V = np.asarray(X, dtype=float)[:, self.ind_param]
+        with np.errstate(invalid="ignore"):
+            match = (self.ind_lt & (V < self.ind_thr)) | (self.ind_gt & (V > self.ind_thr))
+        raw = match.astype(float) @ self.weights.T
+        # Diseases without weight divide by inf and score 0
+        confidence = np.minimum(raw / self.safe_max_weight * 100, 100)
+        return confidence, match
+
+    def build_result(self, values: dict, confidence, match):
+        """Turn one report's row of `score` output into the predict_diseases response."""
+        disease_predictions = {}
+        confidence = confidence.tolist()
+        match = match.tolist()
+        for d, conf in enumerate(confidence):
+            if conf < MIN_CONFIDENCE:
                 continue
-            
-            param_value = values[param]
-            is_match = False
-            
-            if operator == "<" and param_value < threshold:
-                is_match = True
-            elif operator == ">" and param_value > threshold:
-                is_match = True
-            
-            if is_match:
-                confidence_score += weight
+            name = self.diseases[d]
+            disease_info = self.rules[name]
+            matched_indicators = []
+            for k in self.disease_indicators[d]:
+                if not match[k]:
+                    continue
+                ind = self.indicators[k]
                 matched_indicators.append({
-                    "parameter": param,
-                    "value": param_value,
-                    "threshold": threshold,
-                    "condition": f"{param} {operator} {threshold}"
+                    "parameter": ind["param"],
+                    "value": values[ind["param"]],
+                    "threshold": ind["value"],
+                    "condition": f"{ind['param']} {ind['operator']} {ind['value']}"
                 })
-        
-        # Normalize confidence score (max possible depends on number of indicators)
-        max_weight = sum([ind["weight"] for ind in disease_info["indicators"]])
-        if max_weight > 0:
-            confidence_percentage = min((confidence_score / max_weight) * 100, 100)
-        else:
-            confidence_percentage = 0
-        
-        # Only include diseases with at least 30% confidence
-        if confidence_percentage >= 30:
-            disease_predictions[disease_name] = {
-                "confidence": round(confidence_percentage, 1),
-                "risk_level": get_risk_level(confidence_percentage),
+            disease_predictions[name] = {
+                "confidence": round(conf, 1),
+                "risk_level": get_risk_level(conf),
                 "description": disease_info["description"],
                 "matched_indicators": matched_indicators,
                 "symptoms": disease_info["symptoms"],
-                "recommendation": get_recommendation(confidence_percentage)
+                "recommendation": get_recommendation(conf)
             }
-    
-    # Sort by confidence score
-    sorted_diseases = dict(sorted(
-        disease_predictions.items(),
-        key=lambda x: x[1]["confidence"],
-        reverse=True
-    ))
-    
-    return {
-        "possible_diseases": sorted_diseases,
-        "summary": generate_summary(sorted_diseases)
-    }
+
+        sorted_diseases = dict(sorted(
+            disease_predictions.items(),
+            key=lambda x: x[1]["confidence"],
+            reverse=True
+        ))
+        return {
+            "possible_diseases": sorted_diseases,
+            "summary": generate_summary(sorted_diseases)
+        }
+
+    def build_compact_result(self, confidence, match):
+        """
+        Computed fields only: {"possible_diseases": {name: {"confidence", "indicators"}}}.
+
+        "indicators" lists the ids of the matched indicators; descriptions,
+        symptoms, thresholds and risk levels are served once by /catalog.
+        """
+        confidence = confidence.tolist()
+        match = match.tolist()
+        diseases = [
+            (self.diseases[d], {
+                "confidence": round(conf, 1),
+                "indicators": [self.indicator_ids[k] for k in self.disease_indicators[d] if match[k]],
+            })
+            for d, conf in enumerate(confidence) if conf >= MIN_CONFIDENCE
+        ]
+        diseases.sort(key=lambda x: x[1]["confidence"], reverse=True)
+        return {"possible_diseases": dict(diseases)}
+
+    def catalog(self) -> dict:
+        """Static per-disease metadata, with indicator ids, for /catalog."""
+        return {
+            name: {
+                "description": self.rules[name]["description"],
+                "symptoms": self.rules[name]["symptoms"],
+                "indicators": [
+                    {"id": self.indicator_ids[k], "param": self.indicators[k]["param"],
+                     "operator": self.indicators[k]["operator"], "value": self.indicators[k]["value"],
+                     "weight": self.indicators[k]["weight"]}
+                    for k in self.disease_indicators[d]
+                ],
+            }
+            for d, name in enumerate(self.diseases)
+        }
+
+
+def _compile_rules(path: Path):
+    with open(path) as f:
+        rules = json.load(f)
+    for name, info in rules.items():
+        for ind in info["indicators"]:
+            if ind["operator"] not in ("<", ">"):
+                raise ValueError(f"{name}: unsupported operator {ind['operator']!r}")
+    return CompiledRules(rules)
+
+
+# Compiled once, recompiled when disease_rules.json changes
+RULES = WatchedFile(RULES_PATH, _compile_rules, name="disease-rules")
+
+
+def _no_rules_result(compact: bool) -> dict:
+    # disease_rules.json is missing or invalid (hot_reload logged why); the
+    # rest of the analysis still works, so report no diseases instead of a 500
+    logger.error(f"Disease rules not loaded from {RULES.path}; returning no disease predictions")
+    if compact:
+        return {"possible_diseases": {}}
+    return {"possible_diseases": {}, "summary": "Disease rules are unavailable; no disease prediction was made."}
+
+
+@metrics.timed("predict_diseases")
+def predict_diseases_batch(X, columns: list, reports: list, compact: bool = False):
+    """
+    Predict diseases for many reports at once.
+
+    Args:
+        X: (n_reports, len(columns)) float matrix, NaN for missing values
+        columns: Parameter name of each column of X
+        reports: Per-report dicts of the original values (used in the output)
+        compact: As for predict_diseases
+
+    Returns:
+        List with one predict_diseases-style result per report
+    """
+    rules = RULES.get()
+    if rules is None:
+        empty = _no_rules_result(compact)
+        return [dict(empty) for _ in range(len(X))]
+    X = np.asarray(X, dtype=float)
+    aligned = np.full((X.shape[0], len(rules.params)), np.nan)
+    for j, p in enumerate(rules.params):
+        if p in columns:
+            aligned[:, j] = X[:, columns.index(p)]
+    confidence, match = rules.score(aligned)
+    if compact:
+        return [rules.build_compact_result(confidence[i], match[i]) for i in range(X.shape[0])]
+    return [rules.build_result(reports[i], confidence[i], match[i]) for i in range(X.shape[0])]
+
+
+def _risk_band(confidence: float) -> tuple:
+    for band in RISK_LEVELS:
+        if confidence >= band[0]:
+            return band
+    return RISK_LEVELS[-1]
 
 
 def get_risk_level(confidence: float) -> str:
     """Determine risk level based on confidence score."""
-    if confidence >= 80:
-        return "High Risk"
-    elif confidence >= 60:
-        return "Moderate Risk"
-    elif confidence >= 40:
-        return "Medium Risk"
-    else:
-        return "Low Risk"
+    return _risk_band(confidence)[1]
 
 
 def get_recommendation(confidence: float) -> str:
     """Get medical recommendation based on confidence score."""
-    if confidence >= 80:
-        return "⚠️ Immediate medical consultation strongly recommended"
-    elif confidence >= 60:
-        return "⚠️ Medical consultation recommended within a few days"
-    elif confidence >= 40:
-        return "ℹ️ Consider consulting a healthcare professional"
-    else:
-        return "ℹ️ Monitor and consult doctor if symptoms appear"
+    return _risk_band(confidence)[2]
 
 
 def generate_summary(diseases: dict) -> str:
@@ -0,0 +1,81 @@
+import json
+from starlette.responses import Response
+from . import capabilities
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+# Media types clients use for MessagePack
+MSGPACK_ALIASES = (MSGPACK_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+
+
+class NotAcceptable(ValueError):
+    """The client accepts only encodings this server cannot produce."""
+
+
+def _accepted(accept: str) -> dict:
+    """Media ranges of an Accept header with their q values."""
+    ranges = {}
+    for part in (accept or "").split(","):
+        media, *params = [p.strip() for p in part.split(";")]
+        if not media:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    pass
+        ranges[media.lower()] = q
+    return ranges
+
+
+def _quality(ranges: dict, types: tuple) -> float:
+    """q value of the most specific media range in `ranges` matching any of `types`."""
+    exact = [ranges[t] for t in types if t in ranges]
+    if exact:
+        return max(exact)
+    for wildcard in ("application/*", "*/*"):
+        if wildcard in ranges:
+            return ranges[wildcard]
+    return 0.0
+
+
+def negotiate(accept: str) -> str:
+    """
+    Response media type for an Accept header: whichever of JSON and MessagePack has the higher q.
+
+    Ties, and a missing or empty header, go to JSON. MessagePack counts as
+    not acceptable when msgpack is not installed.
+
+    Raises:
+        NotAcceptable: if neither JSON nor MessagePack is acceptable.
+    """
+    ranges = _accepted(accept)
+    if not ranges:
+        return JSON_TYPE
+    json_q = _quality(ranges, (JSON_TYPE,))
+    msgpack_q = _quality(ranges, MSGPACK_ALIASES) if capabilities.has("msgpack") else 0.0
+    if json_q <= 0 and msgpack_q <= 0:
+        if _quality(ranges, MSGPACK_ALIASES) > 0:
+            raise NotAcceptable("MessagePack responses need the msgpack package; accept application/json instead")
+        raise NotAcceptable(f"Responses are {JSON_TYPE} or {MSGPACK_TYPE}")
+    return MSGPACK_TYPE if msgpack_q > json_q else JSON_TYPE
+
+
+def encode_json(content) -> bytes:
+    # Same output as JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def encode_msgpack(content) -> bytes:
+    return capabilities.lazy_import("msgpack").packb(content)
+
+
+ENCODERS = {JSON_TYPE: encode_json, MSGPACK_TYPE: encode_msgpack}
+
+
+def encoded_response(content, media_type: str = JSON_TYPE, headers: dict = None) -> Response:
+    """`content` serialized as `media_type` (see negotiate)."""
+    return Response(ENCODERS[media_type](content), media_type=media_type,
+                    headers={"Vary": "Accept", **(headers or {})})
@@ -1,43 +1,127 @@
 import re, json
 from pathlib import Path
+from . import metrics
 HERE = Path(__file__).parent
 with open(HERE.parent / "utils" / "mapping.json") as f:
     MAPPING = json.load(f)
 
+# Map to proper key names that match normal_ranges.json
+KEY_NAMES = {
+    'hemoglobin': 'Hemoglobin',
+    'wbc': 'WBC',
+    'platelets': 'Platelets',
+    'creatinine': 'Creatinine',
+    'sgpt': 'SGPT',
+    'sgot': 'SGOT',
+    'bilirubin': 'Bilirubin'
+}
+
+# One character of a parameter name: a letter in any script, or one of " -()/"
+_KEY_CHAR = r"(?:[^\W\d_]|[ \-\(\)/])"
+# "<name>[: ]<number>" in one stripped line; the leftmost match wins. A name
+# starts where a run of name characters starts and takes the whole run at
+# once (lookahead + backreference, i.e. no backtracking into it), so lines
+# that do not match cost linear time. The separator may be the run's own
+# trailing space.
+LINE_RE = re.compile(
+    rf"(?<!{_KEY_CHAR})(?=(?P<key>{_KEY_CHAR}+))(?P=key)"
+    rf"(?:(?<={_KEY_CHAR} )|[:\s])[:\s]*(?P<val>[0-9]+(?:\.[0-9]+)?)"
+)
+_NON_KEY_RE = re.compile(r'[^\w ]+|_')
+
+
+def _normalize(k: str) -> str:
+    return _NON_KEY_RE.sub('', k.casefold())
+
+
+class ParameterMatcher:
+    """
+    Compiled matcher from mapping.json synonyms to standard parameter names.
+
+    Variants are normalized once into a hash table; a name is matched by
+    probing its substrings of each distinct variant length, so lookup cost
+    does not grow with the number of synonyms. A name maps to the first
+    parameter in mapping order with a variant occurring anywhere in it.
+    Results are cached per raw name, since reports repeat the same few names.
+    """
+
+    def __init__(self, mapping: dict, cache_size: int = 4096):
+        self.priority = {}
+        for rank, (std, names) in enumerate(mapping.items()):
+            for v in names:
+                v = _normalize(v)
+                if v and v not in self.priority:
+                    self.priority[v] = (rank, KEY_NAMES.get(std, std.capitalize()))
+        self.lengths = sorted({len(v) for v in self.priority})
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def normalize_key(self, k: str):
+        key = self._cache.get(k, False)
+        if key is not False:
+            return key
+        k_norm = _normalize(k)
+        n = len(k_norm)
+        best = None
+        for i in range(n):
+            for length in self.lengths:
+                if i + length > n:
+                    break
+                p = self.priority.get(k_norm[i:i + length])
+                if p is not None and (best is None or p < best):
+                    best = p
+        key = best[1] if best else None
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[k] = key
+        return key
+
+    def extract(self, text: str) -> dict:
+        """Find every "<parameter>: <value>" line of the text; later lines override earlier ones."""
+        data = {}
+        search = LINE_RE.search
+        for line in text.splitlines():
+            m = search(line.strip())
+            if m:
+                key = self.normalize_key(m.group('key').strip())
+                if key:
+                    data[key] = float(m.group('val'))
+        return data
+
+
+MATCHER = ParameterMatcher(MAPPING)
+
+
 def normalize_key(k: str):
-    k = re.sub(r'[^a-z0-9 ]+','',k.lower())
-    for std, variants in MAPPING.items():
-        for v in variants:
-            if v in k:
-                # Map to proper key names that match normal_ranges.json
-                key_map = {
-                    'hemoglobin': 'Hemoglobin',
-                    'wbc': 'WBC',
-                    'platelets': 'Platelets',
-                    'creatinine': 'Creatinine',
-                    'sgpt': 'SGPT',
-                    'sgot': 'SGOT',
-                    'bilirubin': 'Bilirubin'
-                }
-                return key_map.get(std, std.capitalize())
-    return None
+    return MATCHER.normalize_key(k)
+
 
+@metrics.timed("extract")
 def extract_key_values(text: str):
-    data = {}
-    lines = text.splitlines()
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        m = re.search(r'([A-Za-z \-\(\)/]+)[:\s]+([0-9]+(?:\.[0-9]+)?)', line)
-        if m:
-            raw_key = m.group(1).strip()
-            raw_val = m.group(2)
-            key = normalize_key(raw_key)
-            try:
-                val = float(raw_val)
-            except:
-                continue
-            if key:
-                data[key] = val
-    return data
+    return MATCHER.extract(text)
+
+
+class StreamingExtractor:
+    """
+    Page-by-page extraction that tells the reader when it can stop.
+
+    Passed as the `until` hook of ocr_service.image_to_text: called with
+    each page's text as it is read, it returns True once every parameter
+    in `params` has a value, so the remaining pages are not parsed or OCR'd.
+    Picklable, so it can be sent to OCR worker processes. A value repeated
+    on a skipped page can no longer override the one already found.
+    """
+
+    def __init__(self, params):
+        self.params = frozenset(params)
+        self.values = {}
+
+    def feed(self, text: str) -> bool:
+        self.values.update(MATCHER.extract(text))
+        return self.done
+
+    __call__ = feed
+
+    @property
+    def done(self) -> bool:
+        return self.params.issubset(self.values)
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+
+# 2: arrays in a versioned subdirectory named by meta.json; 1: next to meta.json
+FORMAT_VERSION = 2
+READABLE_FORMATS = (1, 2)
+ARRAYS = ("feature", "threshold", "left", "right", "value", "roots")
+
+
+def export_forest(clf, out_dir, feature_names: list):
+    """
+    Write a fitted scikit-learn forest classifier as flat, memory-mappable arrays.
+
+    All trees' nodes are concatenated into one set of arrays: split feature,
+    threshold, left/right child (global node ids) and per-node class
+    probabilities, plus each tree's root id. Leaves point to themselves with
+    an infinite threshold, so a fixed number of traversal steps always ends
+    on a leaf.
+
+    The arrays go to a new subdirectory named after their hash and are
+    never rewritten in place, since running servers may have the previous
+    ones memory-mapped. meta.json, which names the subdirectory, is swapped
+    in last; its appearance marks a complete export. The previous export
+    is kept for readers that are still loading it, older ones are removed.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for est in clf.estimators_:
+        tree = est.tree_
+        n = tree.node_count
+        ids = np.arange(n)
+        leaf = tree.children_left == -1
+        features.append(np.where(leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(np.where(leaf, np.inf, tree.threshold).astype(np.float64))
+        lefts.append((np.where(leaf, ids, tree.children_left) + offset).astype(np.int32))
+        rights.append((np.where(leaf, ids, tree.children_right) + offset).astype(np.int32))
+        value = tree.value[:, 0, :].astype(np.float64)
+        totals = value.sum(axis=1, keepdims=True)
+        values.append(value / np.where(totals > 0, totals, 1.0))
+        roots.append(offset)
+        max_depth = max(max_depth, tree.max_depth)
+        offset += n
+
+    arrays = {
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts),
+        "right": np.concatenate(rights),
+        "value": np.concatenate(values),
+        "roots": np.array(roots, dtype=np.int32),
+    }
+    digest = hashlib.sha256()
+    for arr in arrays.values():
+        digest.update(arr.tobytes())
+    arrays_dir = f"arrays-{digest.hexdigest()[:12]}"
+    if not (out_dir / arrays_dir).is_dir():
+        tmp_dir = Path(tempfile.mkdtemp(prefix=".arrays-", dir=out_dir))
+        try:
+            for name, arr in arrays.items():
+                np.save(tmp_dir / f"{name}.npy", arr)
+            os.rename(tmp_dir, out_dir / arrays_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            # Another export of the same arrays got there first
+            if not (out_dir / arrays_dir).is_dir():
+                raise
+
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "features": list(feature_names),
+        "classes": [c.item() if hasattr(c, "item") else c for c in clf.classes_],
+        "n_trees": len(roots),
+        "n_nodes": offset,
+        "max_depth": int(max_depth),
+        # Changes whenever the arrays do, so watching meta.json catches every re-export
+        "arrays_sha256": digest.hexdigest(),
+        "arrays_dir": arrays_dir,
+    }
+    previous = _arrays_dir(out_dir)
+    tmp = out_dir / "meta.json.tmp"
+    tmp.write_text(json.dumps(meta, indent=2))
+    os.replace(tmp, out_dir / "meta.json")
+    _remove_old_arrays(out_dir, keep={arrays_dir, previous})
+    return meta
+
+
+def _arrays_dir(out_dir: Path):
+    """Subdirectory holding the arrays of the export in `out_dir` ("" for format 1), or None."""
+    try:
+        return json.loads((out_dir / "meta.json").read_text()).get("arrays_dir", "")
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_old_arrays(out_dir: Path, keep: set):
+    # Unlinking is safe for processes that still map the files: the data
+    # stays until they unmap it
+    for path in out_dir.glob("arrays-*"):
+        if path.name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+    if "" not in keep:
+        for name in ARRAYS:
+            (out_dir / f"{name}.npy").unlink(missing_ok=True)
+
+
+class CompactForest:
+    """
+    NumPy inference for a forest exported by `export_forest`.
+
+    Needs neither scikit-learn nor unpickling. All trees of all rows advance
+    one level per vectorized step (at most `max_depth` steps), and one
+    traversal yields both the class and its probability. Rows must not
+    contain NaN.
+    """
+
+    def __init__(self, meta: dict, arrays: dict):
+        self.meta = meta
+        self.features = meta["features"]
+        self.classes_ = np.array(meta["classes"])
+        self.max_depth = meta["max_depth"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+
+    @classmethod
+    def load(cls, directory, mmap: bool = True):
+        directory = Path(directory)
+        meta = json.loads((directory / "meta.json").read_text())
+        if meta.get("format_version") not in READABLE_FORMATS:
+            raise ValueError(f"Unsupported forest format {meta.get('format_version')}")
+        mode = "r" if mmap else None
+        arrays_dir = directory / meta.get("arrays_dir", "")
+        arrays = {name: np.load(arrays_dir / f"{name}.npy", mmap_mode=mode) for name in ARRAYS}
+        return cls(meta, arrays)
+
+    def apply(self, X):
+        """Leaf node id reached in every tree: shape (n_rows, n_trees)."""
+        # scikit-learn compares float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        node = np.tile(self.roots, n_rows)
+        row_base = np.repeat(np.arange(n_rows) * n_features, len(self.roots))
+        # Only (row, tree) pairs still on an internal node advance each step;
+        # most paths end well before max_depth
+        active = np.arange(node.size)
+        current, base = node, row_base
+        while active.size:
+            go_left = flat.take(base + self.feature.take(current)) <= self.threshold.take(current)
+            nxt = np.where(go_left, self.left.take(current), self.right.take(current))
+            moving = nxt != current
+            node[active] = nxt
+            active, current, base = active[moving], nxt[moving], base[moving]
+        return node.reshape(n_rows, -1)
+
+    def predict_proba(self, X):
+        return self.value[self.apply(X)].mean(axis=1)
+
+    def predict_with_proba(self, X):
+        """(predicted classes, probability of each predicted class) from one traversal."""
+        proba = self.predict_proba(X)
+        best = proba.argmax(axis=1)
+        return self.classes_[best], proba[np.arange(len(best)), best]
+
+    def predict(self, X):
+        return self.predict_with_proba(X)[0]
@@ -0,0 +1,281 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from . import analysis_service
+from .storage import data_path, ensure_private_file
+
+logger = logging.getLogger(__name__)
+
+# Patient data: kept in the private APP_DATA_DIR and created 0600
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", data_path("history.sqlite3"))
+# Relative change between the last two reports flagged as "changed" even if the status did not change
+HISTORY_CHANGE_THRESHOLD = float(os.environ.get("HISTORY_CHANGE_THRESHOLD", "0.1"))
+
+# Running aggregates of one (patient, parameter) series, in column order of the trends table.
+# Dates are stored as ISO strings; t is days since the series' first report date (t0), so the
+# least-squares sums stay small.
+TREND_FIELDS = ("n", "t0", "latest_date", "latest_value", "latest_status", "prev_date", "prev_value",
+                "prev_status", "min_value", "max_value", "sum_t", "sum_v", "sum_tt", "sum_tv")
+
+
+class ReportExists(Exception):
+    """Raised when a patient already has a report on that date (and replace was not asked for)."""
+
+
+def parse_date(value) -> str:
+    """ISO date string (YYYY-MM-DD) from a date or string. Raises ValueError otherwise."""
+    if isinstance(value, date):
+        return value.isoformat()
+    return date.fromisoformat(str(value)).isoformat()
+
+
+def update_trend(trend: dict, report_date: str, value: float, status: str) -> dict:
+    """
+    Fold one measurement into a series' running aggregates.
+
+    Constant time whatever the length of the history: latest/previous are
+    kept by date (so back-filled older reports land in the right place),
+    min/max directly, and the slope through its least-squares sums.
+    """
+    day = date.fromisoformat(report_date).toordinal()
+    if trend is None:
+        trend = {"n": 0, "t0": day, "latest_date": None, "latest_value": None, "latest_status": None,
+                 "prev_date": None, "prev_value": None, "prev_status": None, "min_value": value,
+                 "max_value": value, "sum_t": 0.0, "sum_v": 0.0, "sum_tt": 0.0, "sum_tv": 0.0}
+    else:
+        trend = dict(trend)
+    if trend["latest_date"] is None or report_date >= trend["latest_date"]:
+        trend["prev_date"], trend["prev_value"], trend["prev_status"] = (
+            trend["latest_date"], trend["latest_value"], trend["latest_status"])
+        trend["latest_date"], trend["latest_value"], trend["latest_status"] = report_date, value, status
+    elif trend["prev_date"] is None or report_date >= trend["prev_date"]:
+        trend["prev_date"], trend["prev_value"], trend["prev_status"] = report_date, value, status
+    t = day - trend["t0"]
+    trend["n"] += 1
+    trend["min_value"] = min(trend["min_value"], value)
+    trend["max_value"] = max(trend["max_value"], value)
+    trend["sum_t"] += t
+    trend["sum_v"] += value
+    trend["sum_tt"] += t * t
+    trend["sum_tv"] += t * value
+    return trend
+
+
+def summarize_trend(trend: dict, threshold: float = HISTORY_CHANGE_THRESHOLD) -> dict:
+    """Trend response for one series: latest/previous values, range, slope and change flags."""
+    n = trend["n"]
+    denom = n * trend["sum_tt"] - trend["sum_t"] ** 2
+    # Least-squares slope in units per day; undefined with fewer than two distinct dates
+    slope = (n * trend["sum_tv"] - trend["sum_t"] * trend["sum_v"]) / denom if n > 1 and denom > 0 else None
+    result = {
+        "reports": n,
+        "latest": {"date": trend["latest_date"], "value": trend["latest_value"], "status": trend["latest_status"]},
+        "previous": None,
+        "min": trend["min_value"],
+        "max": trend["max_value"],
+        "mean": round(trend["sum_v"] / n, 4),
+        "slope_per_day": round(slope, 6) if slope is not None else None,
+        "changed": False,
+    }
+    if trend["prev_date"] is not None:
+        prev, latest = trend["prev_value"], trend["latest_value"]
+        delta = latest - prev
+        relative = abs(delta) / abs(prev) if prev else (0.0 if delta == 0 else float("inf"))
+        status_changed = trend["prev_status"] != trend["latest_status"]
+        result["previous"] = {"date": trend["prev_date"], "value": prev, "status": trend["prev_status"]}
+        result["delta"] = round(delta, 4)
+        result["relative_change"] = round(relative, 4) if relative != float("inf") else None
+        result["status_changed"] = status_changed
+        result["changed"] = status_changed or relative >= threshold
+    return result
+
+
+def _statuses(comparison: dict) -> dict:
+    """Status string of each parameter, from a compact or full comparison."""
+    return {k: c if isinstance(c, str) else c.get("status") for k, c in comparison.items()}
+
+
+class PatientHistory:
+    """
+    Per-patient report history in a SQLite file, with running trend aggregates.
+
+    Every report stores its values and compact analysis; each value is also
+    a row of `measurements`, indexed by (patient, parameter, date) for
+    time-range queries. Inserting a report updates the `trends` row of
+    each of its parameters in place (see update_trend), so trend and
+    "changed since last report" queries read one row per parameter instead
+    of scanning the history. Replacing a report is the one slow path: the
+    series it touched are rebuilt from their measurements.
+    """
+
+    def __init__(self, path: str = HISTORY_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            ensure_private_file(self.path)
+            db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            with db:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS reports (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "patient_id TEXT NOT NULL, report_date TEXT NOT NULL, created REAL NOT NULL, "
+                    "report_values TEXT NOT NULL, analysis TEXT, UNIQUE (patient_id, report_date))"
+                )
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS measurements (report_id INTEGER NOT NULL, patient_id TEXT NOT NULL, "
+                    "param TEXT NOT NULL, report_date TEXT NOT NULL, value REAL NOT NULL, status TEXT)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS measurements_series "
+                           "ON measurements (patient_id, param, report_date)")
+                db.execute("CREATE INDEX IF NOT EXISTS measurements_report ON measurements (report_id)")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS trends (patient_id TEXT NOT NULL, param TEXT NOT NULL, "
+                    "n INTEGER NOT NULL, t0 INTEGER NOT NULL, latest_date TEXT, latest_value REAL, "
+                    "latest_status TEXT, prev_date TEXT, prev_value REAL, prev_status TEXT, min_value REAL, "
+                    "max_value REAL, sum_t REAL, sum_v REAL, sum_tt REAL, sum_tv REAL, "
+                    "PRIMARY KEY (patient_id, param))"
+                )
+            self._db = db
+        return self._db
+
+    def add_report(self, patient_id: str, report_date, values: dict, sex=None, age=None,
+                   replace: bool = False, analysis: dict = None) -> dict:
+        """
+        Store a report and fold its values into the patient's trends.
+
+        Numeric values are analyzed (compact view) and stored with their
+        status. A caller that has already analyzed the values (as /analyze
+        has) passes that result as `analysis`, compact or full, and it is
+        stored instead of analyzing them again. Returns {"report_id",
+        "date", "analysis", "trends"} where "trends" covers the parameters
+        of this report.
+
+        Raises:
+            ReportExists: if the patient has a report on that date and not `replace`.
+            ValueError: for an invalid date.
+            sqlite3.Error: if the database cannot be written (locked, disk full, ...).
+            OSError: if the database file or its directory cannot be created.
+        """
+        report_date = parse_date(report_date)
+        values = {k: float(v) for k, v in values.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        if analysis is None or "comparison" not in analysis:
+            analysis = analysis_service.analyze(values, sex=sex, age=age, compact=True)
+        statuses = _statuses(analysis["comparison"])
+        with self._lock:
+            db = self._connect()
+            with db:
+                old = db.execute("SELECT id FROM reports WHERE patient_id = ? AND report_date = ?",
+                                 (patient_id, report_date)).fetchone()
+                rebuild = set()
+                if old is not None:
+                    if not replace:
+                        raise ReportExists(f"Patient {patient_id} already has a report on {report_date}")
+                    rebuild = {row[0] for row in db.execute(
+                        "SELECT param FROM measurements WHERE report_id = ?", (old[0],))}
+                    db.execute("DELETE FROM measurements WHERE report_id = ?", (old[0],))
+                    db.execute("DELETE FROM reports WHERE id = ?", (old[0],))
+                report_id = db.execute(
+                    "INSERT INTO reports (patient_id, report_date, created, report_values, analysis) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (patient_id, report_date, time.time(), json.dumps(values), json.dumps(analysis)),
+                ).lastrowid
+                db.executemany(
+                    "INSERT INTO measurements (report_id, patient_id, param, report_date, value, status) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(report_id, patient_id, k, report_date, v, statuses.get(k)) for k, v in values.items()],
+                )
+                trends = {}
+                for param in rebuild:
+                    trends[param] = self._rebuild_trend(db, patient_id, param)
+                for param, value in values.items():
+                    if param in rebuild:
+                        continue
+                    trend = update_trend(self._trend(db, patient_id, param), report_date, value,
+                                         statuses.get(param))
+                    self._save_trend(db, patient_id, param, trend)
+                    trends[param] = trend
+        logger.info(f"Stored report {report_id} for patient {patient_id} on {report_date} "
+                    f"({len(values)} values{', replaced' if old is not None else ''})")
+        return {
+            "report_id": report_id,
+            "date": report_date,
+            "analysis": analysis,
+            "trends": {p: summarize_trend(trends[p]) for p in values if trends.get(p)},
+        }
+
+    def reports(self, patient_id: str, start=None, end=None, limit: int = 100) -> list:
+        """A patient's reports between two dates (inclusive), newest first."""
+        query = "SELECT id, report_date, report_values, analysis FROM reports WHERE patient_id = ?"
+        args = [patient_id]
+        if start is not None:
+            query += " AND report_date >= ?"
+            args.append(parse_date(start))
+        if end is not None:
+            query += " AND report_date <= ?"
+            args.append(parse_date(end))
+        query += " ORDER BY report_date DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._connect().execute(query, args).fetchall()
+        return [{"report_id": i, "date": d, "values": json.loads(v), "analysis": json.loads(a) if a else None}
+                for i, d, v, a in rows]
+
+    def series(self, patient_id: str, param: str, start=None, end=None) -> list:
+        """(date, value, status) points of one parameter between two dates, oldest first."""
+        query = "SELECT report_date, value, status FROM measurements WHERE patient_id = ? AND param = ?"
+        args = [patient_id, param]
+        if start is not None:
+            query += " AND report_date >= ?"
+            args.append(parse_date(start))
+        if end is not None:
+            query += " AND report_date <= ?"
+            args.append(parse_date(end))
+        with self._lock:
+            rows = self._connect().execute(query + " ORDER BY report_date", args).fetchall()
+        return [{"date": d, "value": v, "status": s} for d, v, s in rows]
+
+    def trends(self, patient_id: str, params: list = None) -> dict:
+        """Trend summary (see summarize_trend) of each parameter the patient has values for."""
+        query = f"SELECT param, {', '.join(TREND_FIELDS)} FROM trends WHERE patient_id = ?"
+        args = [patient_id]
+        if params:
+            query += f" AND param IN ({', '.join('?' * len(params))})"
+            args.extend(params)
+        with self._lock:
+            rows = self._connect().execute(query + " ORDER BY param", args).fetchall()
+        return {row[0]: summarize_trend(dict(zip(TREND_FIELDS, row[1:]))) for row in rows}
+
+    def _trend(self, db, patient_id: str, param: str):
+        row = db.execute(f"SELECT {', '.join(TREND_FIELDS)} FROM trends WHERE patient_id = ? AND param = ?",
+                         (patient_id, param)).fetchone()
+        return dict(zip(TREND_FIELDS, row)) if row else None
+
+    def _save_trend(self, db, patient_id: str, param: str, trend: dict):
+        db.execute(
+            f"INSERT OR REPLACE INTO trends (patient_id, param, {', '.join(TREND_FIELDS)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(TREND_FIELDS))})",
+            (patient_id, param, *(trend[f] for f in TREND_FIELDS)),
+        )
+
+    def _rebuild_trend(self, db, patient_id: str, param: str):
+        """Recompute a series' aggregates from its measurements (after a report was replaced)."""
+        trend = None
+        for d, value, status in db.execute(
+                "SELECT report_date, value, status FROM measurements WHERE patient_id = ? AND param = ? "
+                "ORDER BY report_date, report_id", (patient_id, param)):
+            trend = update_trend(trend, d, value, status)
+        if trend is None:
+            db.execute("DELETE FROM trends WHERE patient_id = ? AND param = ?", (patient_id, param))
+        else:
+            self._save_trend(db, patient_id, param, trend)
+        return trend
+
+
+HISTORY = PatientHistory()
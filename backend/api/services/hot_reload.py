@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between two stat() calls on a watched file
+CHECK_INTERVAL = float(os.environ.get("HOT_RELOAD_CHECK_INTERVAL", "2.0"))
+
+
+def file_digest(path: Path) -> str:
+    """Return the sha256 hex digest of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class WatchedFile:
+    """
+    Process-wide holder for an object built from a file on disk.
+
+    The object is built once by `loader(path)` and shared by every request and
+    thread. `get()` re-checks the file's mtime at most every `check_interval`
+    seconds; when the mtime changes and the content hash differs, the object is
+    rebuilt and swapped in with a single reference assignment, so readers never
+    see a half-loaded state. A failed reload keeps serving the previous object.
+    """
+
+    def __init__(self, path: Path, loader, name: str = None, check_interval: float = None):
+        self.path = Path(path)
+        self.loader = loader
+        self.name = name or self.path.name
+        self.check_interval = CHECK_INTERVAL if check_interval is None else check_interval
+        self._lock = threading.Lock()
+        # (value, info) replaced as a whole on every (re)load
+        self._state = (None, {"loaded": False, "path": str(self.path)})
+        self._mtime = None
+        self._last_check = 0.0
+
+    def load(self):
+        """Build the object now, regardless of the mtime check interval."""
+        with self._lock:
+            self._reload()
+        return self._state[0]
+
+    def get(self):
+        """Return the current object, reloading it first if the file changed."""
+        now = time.monotonic()
+        if self._mtime is None or now - self._last_check >= self.check_interval:
+            with self._lock:
+                if self._mtime is None or now - self._last_check >= self.check_interval:
+                    self._last_check = now
+                    if self._current_mtime() != self._mtime:
+                        self._reload()
+        return self._state[0]
+
+    def info(self) -> dict:
+        """Metadata about the currently loaded object (version, load time, ...)."""
+        return dict(self._state[1])
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return -1
+
+    def _reload(self):
+        self._last_check = time.monotonic()
+        mtime = self._current_mtime()
+        if mtime == -1:
+            if self._mtime != -1:
+                logger.warning(f"{self.name}: {self.path} not found")
+            self._mtime = -1
+            self._state = (None, {"loaded": False, "path": str(self.path)})
+            return
+
+        try:
+            digest = file_digest(self.path)
+        except OSError as e:
+            logger.error(f"{self.name}: could not read {self.path}: {str(e)}")
+            return
+        old_value, old_info = self._state
+        if old_info.get("sha256") == digest:
+            # Touched but unchanged: keep the loaded object
+            self._mtime = mtime
+            return
+
+        start = time.perf_counter()
+        try:
+            value = self.loader(self.path)
+        except Exception as e:
+            logger.error(f"{self.name}: failed to load {self.path}: {str(e)}")
+            self._mtime = mtime
+            if old_value is None:
+                self._state = (None, {"loaded": False, "path": str(self.path), "error": str(e)})
+            return
+        load_ms = (time.perf_counter() - start) * 1000
+
+        self._mtime = mtime
+        self._state = (value, {
+            "loaded": value is not None,
+            "path": str(self.path),
+            "version": digest[:12],
+            "sha256": digest,
+            "mtime": mtime / 1e9,
+            "load_time_ms": round(load_ms, 2),
+            "loaded_at": time.time(),
+            "reloads": old_info.get("reloads", -1) + 1,
+        })
+        logger.info(f"{self.name}: loaded {self.path.name} version {digest[:12]} in {load_ms:.1f} ms")
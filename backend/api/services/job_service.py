@@ -0,0 +1,405 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .storage import data_path, ensure_private_file
+
+logger = logging.getLogger(__name__)
+
+# "memory" (default) or "sqlite" to keep jobs and results across restarts
+JOB_STORE = os.environ.get("JOB_STORE", "memory")
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", data_path("jobs.sqlite3"))
+# Jobs processed concurrently, and queued jobs accepted before POST /jobs answers 503
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", os.cpu_count() or 1))
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", "100"))
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", str(24 * 3600)))
+# Each server process sharing a job store records a heartbeat this often; the
+# unfinished jobs of a process silent for JOB_OWNER_TIMEOUT are marked failed
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", "10"))
+JOB_OWNER_TIMEOUT = float(os.environ.get("JOB_OWNER_TIMEOUT", "60"))
+
+FINAL_STATUSES = ("done", "failed")
+
+
+class JobQueueFull(Exception):
+    """Raised when JOB_MAX_PENDING jobs are already waiting."""
+
+
+class InMemoryJobStore:
+    """Jobs and their progress events kept in process memory."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: dict, owner: str = None):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+            self._events[job["id"]] = []
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def add_event(self, job_id: str, event: dict) -> int:
+        with self._lock:
+            events = self._events.setdefault(job_id, [])
+            events.append(event)
+            return len(events)
+
+    def events(self, job_id: str, after: int = 0) -> list:
+        """(seq, event) pairs with seq > after; seq numbers start at 1."""
+        with self._lock:
+            events = self._events.get(job_id, [])
+            return list(enumerate(events[after:], start=after + 1))
+
+    def prune(self, older_than: float):
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items()
+                           if job["status"] in FINAL_STATUSES and job["updated"] < older_than]:
+                del self._jobs[job_id]
+                self._events.pop(job_id, None)
+
+    def heartbeat(self, owner: str):
+        pass
+
+    def recover(self, owner: str, stale_before: float) -> list:
+        # Jobs kept in memory die with their process; there is nothing to recover
+        return []
+
+
+class SQLiteJobStore:
+    """Jobs and progress events persisted in a SQLite file."""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        ensure_private_file(path)
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                "status TEXT NOT NULL, updated REAL NOT NULL, owner TEXT)"
+            )
+            # Stores created before jobs had owners
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+            if "owner" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS job_events (job_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+                "data TEXT NOT NULL, PRIMARY KEY (job_id, seq))"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS job_owners (owner TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+
+    def create(self, job: dict, owner: str = None):
+        """Store a new job; `owner` identifies the process that will run it."""
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO jobs (id, data, status, updated, owner) VALUES (?, ?, ?, ?, ?)",
+                             (job["id"], json.dumps(job), job["status"], job["updated"], owner))
+
+    def update(self, job_id: str, **fields):
+        with self._lock, self._db:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            job = json.loads(row[0])
+            job.update(fields)
+            self._db.execute("UPDATE jobs SET data = ?, status = ?, updated = ? WHERE id = ?",
+                             (json.dumps(job), job["status"], job["updated"], job_id))
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_event(self, job_id: str, event: dict) -> int:
+        with self._lock, self._db:
+            seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?",
+                                   (job_id,)).fetchone()[0]
+            self._db.execute("INSERT INTO job_events (job_id, seq, data) VALUES (?, ?, ?)",
+                             (job_id, seq, json.dumps(event)))
+            return seq
+
+    def events(self, job_id: str, after: int = 0) -> list:
+        with self._lock:
+            rows = self._db.execute("SELECT seq, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                                    (job_id, after)).fetchall()
+        return [(seq, json.loads(data)) for seq, data in rows]
+
+    def prune(self, older_than: float):
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE status IN (?, ?) AND updated < ?)",
+                (*FINAL_STATUSES, older_than))
+            self._db.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?", (*FINAL_STATUSES, older_than))
+
+    def heartbeat(self, owner: str):
+        """Record that the process `owner` is alive."""
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO job_owners (owner, heartbeat) VALUES (?, ?)",
+                             (owner, time.time()))
+
+    def recover(self, owner: str, stale_before: float) -> list:
+        """
+        Fail the unfinished jobs of processes other than `owner` that are gone.
+
+        A process is gone if its last heartbeat is older than `stale_before`
+        (or it never recorded one); its jobs' uploads went with it. Each job
+        gets a final "failed" event, so event streams on it end. Returns the
+        ids of the jobs failed.
+        """
+        now = time.time()
+        failed = []
+        with self._lock, self._db:
+            # One process recovers a given job; the others wait here, then see it failed
+            self._db.execute("BEGIN IMMEDIATE")
+            rows = self._db.execute(
+                "SELECT id, data FROM jobs WHERE status NOT IN (?, ?) AND (owner IS NULL OR (owner != ? AND "
+                "owner NOT IN (SELECT owner FROM job_owners WHERE heartbeat >= ?)))",
+                (*FINAL_STATUSES, owner, stale_before)).fetchall()
+            for job_id, data in rows:
+                job = json.loads(data)
+                job.update(status="failed", error="Interrupted: the server process running it stopped", updated=now)
+                self._db.execute("UPDATE jobs SET data = ?, status = ?, updated = ? WHERE id = ?",
+                                 (json.dumps(job), "failed", now, job_id))
+                seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?",
+                                       (job_id,)).fetchone()[0]
+                event = {"stage": "failed", "status": "failed", "error": job["error"], "time": now}
+                self._db.execute("INSERT INTO job_events (job_id, seq, data) VALUES (?, ?, ?)",
+                                 (job_id, seq, json.dumps(event)))
+                failed.append(job_id)
+            self._db.execute("DELETE FROM job_owners WHERE heartbeat < ? AND owner != ?", (stale_before, owner))
+        return failed
+
+
+def make_store(kind: str = JOB_STORE):
+    if kind == "sqlite":
+        return SQLiteJobStore()
+    return InMemoryJobStore()
+
+
+class JobManager:
+    """
+    In-process queue running report-processing jobs in the background.
+
+    `submit` returns immediately with a job id; JOB_WORKERS asyncio tasks
+    take jobs off the queue and run `handler(job, context, emit)`, where
+    `context` holds data that is not stored with the job (e.g. the upload's
+    temp path) and `emit(event)` records a progress event. Event streams
+    `subscribe` to a job, are woken by `wait_for_events` on every event
+    this process records, and `unsubscribe` when they end.
+
+    Store calls run on one dedicated thread, never on the event loop; a
+    single thread keeps them in the order they were made, so a job's
+    events are numbered in the order they were emitted.
+
+    Several server processes may share one persistent store. Jobs record
+    the process (`owner`) that runs them, each process heartbeats, and a
+    process only fails the unfinished jobs of processes whose heartbeat
+    stopped, never those of live ones.
+    """
+
+    def __init__(self, store=None, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 retention: float = JOB_RETENTION, heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL,
+                 owner_timeout: float = JOB_OWNER_TIMEOUT):
+        self.store = store
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.retention = retention
+        self.heartbeat_interval = heartbeat_interval
+        self.owner_timeout = max(owner_timeout, 2 * heartbeat_interval)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handler = None
+        self._queue = None
+        self._tasks = []
+        self._monitor = None
+        self._store_executor = None
+        # job id -> [asyncio.Event, number of subscribed streams]
+        self._changed = {}
+
+    async def start(self, handler):
+        """Start the worker tasks; must be called from the running event loop."""
+        self._store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        if self.store is None:
+            self.store = await self._call(make_store)
+        await self._call(self.store.heartbeat, self.owner)
+        await self._recover()
+        self.handler = handler
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._monitor = asyncio.create_task(self._heartbeat())
+        logger.info(f"Job manager started: {self.workers} workers, {type(self.store).__name__}, owner {self.owner}")
+
+    async def shutdown(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Jobs that never started
+        while self._queue is not None and not self._queue.empty():
+            job, _context, cleanup = self._queue.get_nowait()
+            await self._fail(job["id"], "Server shutting down")
+            self._cleanup(job["id"], cleanup)
+        if self._store_executor is not None:
+            self._store_executor.shutdown(wait=True)
+            self._store_executor = None
+
+    def _call(self, fn, *args, **kwargs):
+        """Run a store call on the store thread; returns an awaitable future."""
+        return asyncio.get_running_loop().run_in_executor(self._store_executor,
+                                                          functools.partial(fn, *args, **kwargs))
+
+    def _notify(self, job_id: str):
+        entry = self._changed.get(job_id)
+        if entry is not None:
+            entry[0].set()
+
+    async def _recover(self):
+        failed = await self._call(self.store.recover, self.owner, time.time() - self.owner_timeout)
+        if failed:
+            logger.warning(f"Marked {len(failed)} jobs of stopped server processes as failed")
+        for job_id in failed:
+            self._notify(job_id)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._call(self.store.heartbeat, self.owner)
+                await self._recover()
+            except Exception as e:
+                logger.error(f"Job store heartbeat failed: {str(e)}")
+
+    async def submit(self, payload: dict, context: dict = None, cleanup=None) -> dict:
+        """Queue a job; `cleanup()` runs once it has finished (or failed)."""
+        if self._queue is None:
+            raise RuntimeError("Job manager is not started")
+        if self._queue.qsize() >= self.max_pending:
+            raise JobQueueFull(f"{self._queue.qsize()} jobs already waiting")
+        now = time.time()
+        job = {"id": uuid.uuid4().hex, "status": "queued", "created": now, "updated": now,
+               "result": None, "error": None, **payload}
+        await self._call(self.store.prune, now - self.retention)
+        await self._call(self.store.create, job, self.owner)
+        await self.emit(job["id"], {"stage": "queued"})
+        self._queue.put_nowait((job, context or {}, cleanup))
+        return job
+
+    def get(self, job_id: str):
+        """Job by id; a blocking store read, for use off the event loop."""
+        return self.store.get(job_id)
+
+    def emit(self, job_id: str, event: dict):
+        """
+        Record a progress event and wake the job's subscribers once it is stored.
+
+        Must be called on the event loop. Returns a future that callers may
+        await; handlers can also fire and forget, since the store thread
+        keeps events in order.
+        """
+        event = dict(event, time=time.time())
+        future = self._call(self.store.add_event, job_id, event)
+
+        def done(f):
+            if f.cancelled():
+                return
+            if f.exception() is not None:
+                logger.error(f"Recording an event of job {job_id} failed: {str(f.exception())}")
+            self._notify(job_id)
+
+        future.add_done_callback(done)
+        return future
+
+    def subscribe(self, job_id: str):
+        """Register an event stream on a job; pair with unsubscribe when it ends."""
+        entry = self._changed.setdefault(job_id, [asyncio.Event(), 0])
+        entry[1] += 1
+
+    def unsubscribe(self, job_id: str):
+        """End an event stream on a job; the job's change event goes with its last stream."""
+        entry = self._changed.get(job_id)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._changed[job_id]
+
+    async def wait_for_events(self, job_id: str, after: int, timeout: float = 15.0) -> list:
+        """
+        Events after seq `after`, waiting up to `timeout` seconds for new ones.
+
+        Callers subscribe to the job first; events of jobs run by another
+        process are only seen when the wait times out.
+        """
+        entry = self._changed.get(job_id)
+        if entry is not None:
+            # Cleared before reading, so an event stored meanwhile still wakes the wait
+            entry[0].clear()
+        events = await self._call(self.store.events, job_id, after)
+        if events:
+            return events
+        if entry is None:
+            await asyncio.sleep(timeout)
+        else:
+            try:
+                await asyncio.wait_for(entry[0].wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await self._call(self.store.events, job_id, after)
+
+    async def _worker(self):
+        while True:
+            job, context, cleanup = await self._queue.get()
+            job_id = job["id"]
+            try:
+                await self._call(self.store.update, job_id, status="running", updated=time.time())
+                await self.emit(job_id, {"stage": "started"})
+                result = await self.handler(job, context, lambda event: self.emit(job_id, event))
+                await self._call(self.store.update, job_id, status="done", result=result, updated=time.time())
+                await self.emit(job_id, {"stage": "done", "status": "done"})
+            except asyncio.CancelledError:
+                # The final event ends the job's event streams before the server goes away
+                await asyncio.shield(self._fail(job_id, "Server shutting down"))
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                await self._fail(job_id, str(e))
+            finally:
+                self._cleanup(job_id, cleanup)
+                self._queue.task_done()
+
+    async def _fail(self, job_id: str, error: str):
+        await self._call(self.store.update, job_id, status="failed", error=error, updated=time.time())
+        await self.emit(job_id, {"stage": "failed", "status": "failed", "error": error})
+
+    @staticmethod
+    def _cleanup(job_id, cleanup):
+        if cleanup is None:
+            return
+        try:
+            cleanup()
+        except Exception as e:
+            logger.warning(f"Job {job_id} cleanup failed: {str(e)}")
+
+
+JOB_MANAGER = JobManager()
@@ -0,0 +1,237 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage durations of the current request, reported in its Server-Timing header
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+# Set inside pool jobs: metrics are recorded here and replayed by the parent
+_deferred = contextvars.ContextVar("deferred_metrics", default=None)
+
+REGISTRY = {}
+
+
+def _label_key(labelnames: tuple, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: tuple, key: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # Unlabeled counters are exported as 0 before their first increment
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def inc(self, amount: float = 1, **labels):
+        deferred = _deferred.get()
+        if deferred is not None:
+            deferred.append(("inc", self.name, labels, amount))
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def observe(self, value: float, **labels):
+        deferred = _deferred.get()
+        if deferred is not None:
+            deferred.append(("observe", self.name, labels, value))
+            return
+        self._observe(_label_key(self.labelnames, labels), value)
+
+    def _observe(self, key: tuple, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += n
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("blood_report_stage_seconds", "Time spent in each processing stage.", ("stage",))
+REQUEST_SECONDS = Histogram("blood_report_request_seconds", "HTTP request latency by route.",
+                            ("method", "route", "status"))
+PAGES = Counter("blood_report_pages_total", "Pages processed, by how their text was obtained.", ("source",))
+OCR_FALLBACKS = Counter("blood_report_ocr_fallbacks_total", "PDFs without a text layer that fell back to OCR.")
+RISK_PREDICTIONS = Counter("blood_report_risk_predictions_total", "Risk predictions by path taken.", ("path",))
+OCR_CACHE_LOOKUPS = Counter("blood_report_ocr_cache_lookups_total", "OCR cache lookups by result.", ("result",))
+EARLY_EXITS = Counter("blood_report_early_exits_total",
+                      "Documents read only partly because every requested parameter was found.", ("source",))
+PAGES_SKIPPED = Counter("blood_report_pages_skipped_total", "Pages not read thanks to early exit.", ("source",))
+ADMISSIONS = Counter("blood_report_admissions_total",
+                     "OCR admission decisions: admitted, queued, rejected or timeout.", ("result",))
+
+
+def record_span(stage: str, seconds: float):
+    """Observe a stage duration and add it to the current request's Server-Timing."""
+    deferred = _deferred.get()
+    if deferred is not None:
+        deferred.append(("span", stage, None, seconds))
+        return
+    STAGE_SECONDS._observe((stage,), seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """Decorator timing every call of a function as `stage`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_span(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def collect(fn, *args):
+    """
+    Run `fn(*args)` in a pool worker, recording its metrics instead of applying them.
+
+    Worker processes have their own registry, so spans and counter updates
+    made during the call are returned with the result, as
+    (result, records), for `merge` to apply in the serving process.
+    """
+    records = []
+    token = _deferred.set(records)
+    try:
+        return fn(*args), records
+    finally:
+        _deferred.reset(token)
+
+
+def merge(records: list):
+    """Apply metrics recorded by `collect` to this process and the current request."""
+    for kind, name, labels, value in records:
+        if kind == "span":
+            record_span(name, value)
+        elif kind == "inc":
+            REGISTRY[name].inc(value, **labels)
+        else:
+            REGISTRY[name].observe(value, **labels)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in REGISTRY.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(spans: list) -> str:
+    """Server-Timing header value; repeated stages (e.g. per page) are summed."""
+    totals = {}
+    for stage, seconds in spans:
+        total, count = totals.get(stage, (0.0, 0))
+        totals[stage] = (total + seconds, count + 1)
+    parts = []
+    for stage, (total, count) in totals.items():
+        desc = f';desc="{count}x"' if count > 1 else ""
+        parts.append(f"{stage};dur={total * 1000:.2f}{desc}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request by route and adding a Server-Timing header.
+
+    Stage spans recorded while the request is handled (including those
+    merged back from OCR workers) are listed in the header, followed by the
+    total time until the response started.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                value = server_timing([*spans, ("total", time.perf_counter() - start)])
+                message = dict(message, headers=[*message.get("headers", []),
+                                                 (b"server-timing", value.encode("latin-1"))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _request_spans.reset(token)
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                    route=getattr(route, "path", "unmatched"), status=status)
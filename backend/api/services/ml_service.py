@@ -1,58 +1,289 @@
-import joblib
 from pathlib import Path
 import json
+import numpy as np
 from .disease_service import predict_diseases
+from .hot_reload import WatchedFile
+from .capabilities import lazy_import
+from .forest import CompactForest
+from . import metrics
 
 MODEL_PATH = Path(__file__).parent / "predict_model.pkl"
+# Array export of the same model (see forest.export_forest), preferred when present
+FOREST_DIR = Path(__file__).parent / "predict_model"
 RANGES_PATH = Path(__file__).parent.parent / "utils" / "normal_ranges.json"
 
+FEATURES = ["Hemoglobin","WBC","Platelets","Creatinine","SGPT","SGOT","Bilirubin"]
+# Mid-range row used to warm up a freshly loaded model
+WARMUP_ROW = [14.0, 7000, 250000, 0.9, 25, 25, 0.6]
+
+def _load_and_warm(path: Path):
+    """Unpickle the model and run one prediction so the first request is not slow."""
+    # joblib/scikit-learn are only imported once there is a model to load
+    model = lazy_import("joblib").load(path)
+    model.predict([WARMUP_ROW])
+    if hasattr(model, "predict_proba"):
+        model.predict_proba([WARMUP_ROW])
+    return model
+
+def _load_forest(meta_path: Path):
+    """Memory-map the exported forest arrays; no unpickling or scikit-learn needed."""
+    forest = CompactForest.load(meta_path.parent)
+    if forest.features != FEATURES:
+        raise ValueError(f"Model features {forest.features} do not match {FEATURES}")
+    forest.predict_with_proba([WARMUP_ROW])
+    return forest
+
+# Process-wide model registries: loaded once at startup, reused by every request
+# and swapped atomically when the model changes on disk. The compact array
+# export is served when present; the pickle is only a fallback.
+MODEL_REGISTRY = WatchedFile(FOREST_DIR / "meta.json", _load_forest, name="risk-model")
+PICKLE_MODEL_REGISTRY = WatchedFile(MODEL_PATH, _load_and_warm, name="risk-model-pickle")
+
 def load_model():
-    if MODEL_PATH.exists():
-        try:
-            return joblib.load(MODEL_PATH)
-        except Exception:
-            return None
-    return None
-
-def compare_with_ranges(values: dict):
-    with open(RANGES_PATH) as f:
-        ranges = json.load(f)
+    model = MODEL_REGISTRY.get()
+    if model is None:
+        model = PICKLE_MODEL_REGISTRY.get()
+    return model
+
+def model_info() -> dict:
+    """Version and load statistics of the currently served model."""
+    if MODEL_REGISTRY.get() is not None:
+        info = MODEL_REGISTRY.info()
+        info["format"] = "compact-forest"
+    else:
+        info = PICKLE_MODEL_REGISTRY.info()
+        info["format"] = "pickle"
+    info.pop("sha256", None)
+    return info
+
+# Demographic buckets of the compiled range table: sex x (adult, child)
+SEXES = (None, "male", "female")
+CHILD_AGE = 18
+STATUS_LABELS = np.array(["Low", "Normal", "High", "Unknown"])
+
+def sex_index(sex) -> int:
+    """Map a free-form sex value ("M", "female", ...) to its bucket offset."""
+    if not sex:
+        return 0
+    s = str(sex).strip().lower()
+    if s in ("m", "male"):
+        return 1
+    if s in ("f", "female"):
+        return 2
+    return 0
+
+def bucket_index(sex=None, age=None) -> int:
+    """Row of the range table to use for a patient."""
+    child = age is not None and age < CHILD_AGE
+    return sex_index(sex) + (len(SEXES) if child else 0)
+
+class RangeTable:
+    """
+    normal_ranges.json compiled into parameter-indexed low/high arrays.
+
+    Rows are demographic buckets (see `bucket_index`), columns are parameters.
+    Each parameter may define "any", "male", "female" and "child" ranges; a
+    bucket without its own range falls back to "any", then to "male".
+    """
+
+    def __init__(self, ranges: dict):
+        # As loaded, for /catalog
+        self.spec = ranges
+        self.params = list(ranges)
+        self.index = {p: i for i, p in enumerate(self.params)}
+        self.units = [ranges[p].get("unit", "") for p in self.params]
+        n_buckets = 2 * len(SEXES)
+        self.low = np.full((n_buckets, len(self.params)), np.nan)
+        self.high = np.full((n_buckets, len(self.params)), np.nan)
+        # Original JSON lists, so responses keep the file's number formatting
+        self.range_lists = [[None] * len(self.params) for _ in range(n_buckets)]
+        for j, p in enumerate(self.params):
+            spec = ranges[p]
+            default = spec.get("any", spec.get("male"))
+            for i, sex in enumerate(SEXES):
+                adult = spec.get(sex, default) if sex else default
+                for b, r in ((i, adult), (i + len(SEXES), spec.get("child", adult))):
+                    if r is None:
+                        continue
+                    self.low[b, j], self.high[b, j] = r[0], r[1]
+                    self.range_lists[b][j] = r
+
+    def classify(self, X, buckets=0):
+        """
+        Classify a (n_reports, n_params) matrix against the table in one pass.
+
+        `buckets` is a bucket row or an array of one row per report. Returns
+        int codes indexing STATUS_LABELS: 0 Low, 1 Normal, 2 High, 3 missing.
+        """
+        X = np.asarray(X, dtype=float)
+        low = self.low[buckets]
+        high = self.high[buckets]
+        if low.ndim == 1:
+            low, high = low[None, :], high[None, :]
+        codes = np.ones(X.shape, dtype=np.int8)
+        codes[X < low] = 0
+        codes[X > high] = 2
+        codes[np.isnan(X) | np.isnan(low)] = 3
+        return codes
+
+def _compile_ranges(path: Path):
+    with open(path) as f:
+        return RangeTable(json.load(f))
+
+RANGES = WatchedFile(RANGES_PATH, _compile_ranges, name="normal-ranges")
+
+@metrics.timed("compare")
+def compare_with_ranges(values: dict, sex=None, age=None, compact: bool = False):
+    """
+    Status of each value against its normal range for the patient's sex and age.
+
+    With `compact`, each parameter maps to its status string only; the
+    ranges and units are served once by /catalog.
+    """
+    table = RANGES.get()
+    bucket = bucket_index(sex, age)
+    known = [k for k in values if k in table.index]
+    cols = [table.index[k] for k in known]
+    row = np.full(len(table.params), np.nan)
+    row[cols] = [values[k] for k in known]
+    codes = table.classify(row[None, :], bucket)[0]
+
+    if compact:
+        return {k: str(STATUS_LABELS[codes[table.index[k]]]) if k in table.index else "Unknown" for k in values}
     result = {}
-    for k,v in values.items():
-        if k not in ranges:
+    for k, v in values.items():
+        j = table.index.get(k)
+        if j is None or codes[j] == 3:
             result[k] = {"value": v, "status": "Unknown"}
             continue
-        r = ranges[k].get("any", ranges[k].get("male"))
-        low, high = r[0], r[1]
-        status = "Normal"
-        if v < low: 
-            status = "Low"
-        elif v > high: 
-            status = "High"
         result[k] = {
             "value": v, 
-            "status": status, 
-            "normal_range": r, 
-            "unit": ranges[k].get("unit","")
+            "status": str(STATUS_LABELS[codes[j]]), 
+            "normal_range": table.range_lists[bucket][j], 
+            "unit": table.units[j]
         }
     return result
 
+@metrics.timed("compare")
+def compare_batch(X, columns: list, reports: list, buckets=0, compact: bool = False):
+    """
+    compare_with_ranges for many reports: one classification over the whole matrix.
+
+    X holds the values of `columns` (NaN for missing); `reports` are the
+    original per-report dicts, `buckets` one range-table row per report.
+    """
+    table = RANGES.get()
+    X = np.asarray(X, dtype=float)
+    aligned = np.full((X.shape[0], len(table.params)), np.nan)
+    for j, p in enumerate(table.params):
+        if p in columns:
+            aligned[:, j] = X[:, columns.index(p)]
+    buckets = np.broadcast_to(np.asarray(buckets, dtype=np.intp), (X.shape[0],))
+    codes = table.classify(aligned, buckets)
+
+    if compact:
+        labels = STATUS_LABELS[codes].tolist()
+        return [
+            {k: labels[i][table.index[k]] if k in table.index else "Unknown" for k in values}
+            for i, values in enumerate(reports)
+        ]
+    results = []
+    for i, values in enumerate(reports):
+        b = buckets[i]
+        result = {}
+        for k, v in values.items():
+            j = table.index.get(k)
+            if j is None or codes[i, j] == 3:
+                result[k] = {"value": v, "status": "Unknown"}
+                continue
+            result[k] = {
+                "value": v,
+                "status": str(STATUS_LABELS[codes[i, j]]),
+                "normal_range": table.range_lists[b][j],
+                "unit": table.units[j]
+            }
+        results.append(result)
+    return results
+
+@metrics.timed("predict_risk")
+def predict_risk_batch(X):
+    """
+    predict_risk for a (n_reports, len(FEATURES)) matrix, NaN for missing values.
+
+    Complete rows go through a single model.predict_proba call; the rest (or
+    all rows when no model is loaded) use the vectorized rule-based fallback.
+    """
+    X = np.asarray(X, dtype=float)
+    results = rule_based_batch(X)
+    model = load_model()
+    complete = ~np.isnan(X).any(axis=1)
+    if model is None or not complete.any():
+        metrics.RISK_PREDICTIONS.inc(len(X), path="rules")
+        return results
+    rows = np.flatnonzero(complete)
+    try:
+        if hasattr(model, "predict_with_proba"):
+            preds, probs = model.predict_with_proba(X[rows])
+        elif hasattr(model, "predict_proba"):
+            proba = model.predict_proba(X[rows])
+            preds = model.classes_[proba.argmax(axis=1)]
+            probs = proba.max(axis=1)
+        else:
+            preds = model.predict(X[rows])
+            probs = [None] * len(rows)
+    except Exception:
+        metrics.RISK_PREDICTIONS.inc(len(X), path="rules")
+        return results
+    metrics.RISK_PREDICTIONS.inc(len(rows), path="model")
+    if len(rows) < len(X):
+        metrics.RISK_PREDICTIONS.inc(len(X) - len(rows), path="rules")
+    for i, pred, prob in zip(rows, preds, probs):
+        risks = [str(pred)] if pred else []
+        overall_risk = "High" if prob and prob > 0.7 else "Medium"
+        results[i] = {"risks": risks, "overall_risk": overall_risk}
+    return results
+
+def rule_based_batch(X):
+    """Vectorized rule_based over a (n_reports, len(FEATURES)) matrix."""
+    X = np.asarray(X, dtype=float)
+    col = {f: X[:, j] for j, f in enumerate(FEATURES)}
+    with np.errstate(invalid="ignore"):
+        flags = np.column_stack([
+            col["Hemoglobin"] < 11,
+            col["Creatinine"] > 1.3,
+            (col["SGPT"] > 56) | (col["SGOT"] > 40),
+        ])
+    names = ("Anemia_Risk", "Kidney_Risk", "Liver_Risk")
+    overall = np.array(["Low", "Medium", "High", "High"])[flags.sum(axis=1)]
+    return [
+        {"risks": [n for n, f in zip(names, row) if f], "overall_risk": str(o)}
+        for row, o in zip(flags.tolist(), overall)
+    ]
+
+@metrics.timed("predict_risk")
 def predict_risk(values: dict):
     model = load_model()
-    features = ["Hemoglobin","WBC","Platelets","Creatinine","SGPT","SGOT","Bilirubin"]
-    X = [values.get(f, None) for f in features]
+    X = [values.get(f, None) for f in FEATURES]
     if model is None or any(x is None for x in X):
+        metrics.RISK_PREDICTIONS.inc(path="rules")
         return rule_based(values)
     try:
-        pred = model.predict([X])[0]
-        prob = None
-        if hasattr(model, "predict_proba"):
-            prob = max(model.predict_proba([X])[0])
+        if hasattr(model, "predict_with_proba"):
+            # Compact forest: class and probability from a single traversal
+            preds, probs = model.predict_with_proba([X])
+            pred, prob = preds[0], probs[0]
+        else:
+            pred = model.predict([X])[0]
+            prob = None
+            if hasattr(model, "predict_proba"):
+                prob = max(model.predict_proba([X])[0])
         # Return risks as list of strings and overall risk as string
         risks = [str(pred)] if pred else []
         overall_risk = "High" if prob and prob > 0.7 else "Medium" if prob else "Medium"
+        metrics.RISK_PREDICTIONS.inc(path="model")
         return {"risks": risks, "overall_risk": overall_risk}
     except Exception:
+        metrics.RISK_PREDICTIONS.inc(path="rules")
         return rule_based(values)
 
 def rule_based(values: dict):
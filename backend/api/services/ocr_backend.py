@@ -0,0 +1,285 @@
+import logging
+import os
+import queue
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from . import metrics
+from .capabilities import lazy_import, TESSERACT_CMD
+
+logger = logging.getLogger(__name__)
+
+# "pytesseract" (default) spawns one process per image, so the pages of a
+# PDF are OCR'd in parallel; "batch" sends several images to one tesseract
+# process, which saves start-up cost under load but runs a batch's pages one
+# after another (including pages of the same PDF). Batches are formed within
+# one process, so "batch" needs OCR_EXECUTOR=thread to batch images of
+# concurrent requests (see check_executor); "fake" runs no OCR at all
+# (see FakeOCRBackend), for load tests on machines without Tesseract
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "pytesseract")
+# How long the first image of a batch waits for others to join, and the batch size cap
+OCR_BATCH_WINDOW = float(os.environ.get("OCR_BATCH_WINDOW_MS", "15")) / 1000
+OCR_BATCH_MAX = int(os.environ.get("OCR_BATCH_MAX", "4"))
+# Tesseract processes running batches at the same time (per process)
+OCR_BATCH_WORKERS = int(os.environ.get("OCR_BATCH_WORKERS", os.cpu_count() or 1))
+TESSERACT_TIMEOUT = float(os.environ.get("TESSERACT_TIMEOUT", "120"))
+# Tesseract ends every page of its text output with this character
+PAGE_SEPARATOR = "\f"
+# Fake backend: time taken per image, and whether it sleeps ("sleep") or
+# keeps a core busy ("cpu") for that long, as Tesseract does
+OCR_FAKE_LATENCY = float(os.environ.get("OCR_FAKE_LATENCY_MS", "200")) / 1000
+OCR_FAKE_MODE = os.environ.get("OCR_FAKE_MODE", "sleep")
+# Text returned for every image (the values of utils/sample_reports/sample1.txt)
+FAKE_TEXT = ("Hemoglobin: 9.8 g/dL\nWBC Count: 7800\nPlatelets: 220000\nCreatinine: 1.5\n"
+             "SGPT: 65\nSGOT: 58\nBilirubin: 1.1\n")
+
+BATCH_SIZE = metrics.Histogram("blood_report_ocr_batch_size", "Images per tesseract invocation, per image OCR'd.",
+                               ("backend",), buckets=(1, 2, 4, 8, 16, 32))
+
+_pytesseract = None
+
+
+class TesseractNotFound(RuntimeError):
+    """Raised when the tesseract binary cannot be run."""
+
+
+def get_pytesseract():
+    """pytesseract, imported and pointed at the Tesseract binary on first use."""
+    global _pytesseract
+    if _pytesseract is None:
+        module = lazy_import("pytesseract")
+        module.pytesseract.tesseract_cmd = TESSERACT_CMD
+        _pytesseract = module
+    return _pytesseract
+
+
+class PytesseractBackend:
+    """One `tesseract` process (and language model load) per image, via pytesseract."""
+
+    name = "pytesseract"
+    needs_tesseract = True
+    needs_images = True
+
+    def __init__(self, config: str):
+        self.config = config
+
+    def ocr(self, img, timeout: float = TESSERACT_TIMEOUT) -> str:
+        pytesseract = get_pytesseract()
+        try:
+            text = pytesseract.image_to_string(img, config=self.config, timeout=timeout)
+        except pytesseract.TesseractNotFoundError as e:
+            raise TesseractNotFound(str(e))
+        BATCH_SIZE.observe(1, backend=self.name)
+        return text
+
+    def ocr_many(self, images: list) -> list:
+        return [self.ocr(img) for img in images]
+
+
+class BatchTesseractBackend:
+    """
+    Many images per `tesseract` invocation, so process start-up and model load are paid once.
+
+    Tesseract accepts a text file listing image paths and writes every
+    page's text to stdout, each followed by a form feed; the output is split
+    back per image. `ocr()` calls from concurrent threads (the pages of a
+    PDF, or concurrent requests in thread mode) are micro-batched: a
+    dispatcher thread waits up to `window` seconds after the first image for
+    up to `max_batch` images, then hands the batch to one of `workers`
+    threads. Bigger batches save start-up cost but run their pages one after
+    another, so `max_batch` trades per-request latency for throughput.
+
+    The queue and dispatcher belong to one process. With the process OCR
+    pool every request runs in its own worker, so only pages of the same
+    PDF could share a batch; check_executor refuses that combination.
+    Batches that fail for any reason other than a missing binary are redone
+    image by image through `fallback`, within one TESSERACT_TIMEOUT for the
+    whole batch rather than one per image.
+    """
+
+    name = "batch"
+    needs_tesseract = True
+    needs_images = True
+
+    def __init__(self, config: str, cmd: str = TESSERACT_CMD, window: float = OCR_BATCH_WINDOW,
+                 max_batch: int = OCR_BATCH_MAX, workers: int = OCR_BATCH_WORKERS):
+        self.config = config
+        self.cmd = cmd
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.workers = max(1, workers)
+        self.fallback = PytesseractBackend(config)
+        self._queue = queue.Queue()
+        self._executor = None
+        self._dispatcher = None
+        self._lock = threading.Lock()
+
+    def ocr(self, img) -> str:
+        self._ensure_started()
+        future = Future()
+        self._queue.put((img, future))
+        text, batch_size = future.result()
+        # Observed here, in the caller's context, so worker-process metrics reach the parent
+        BATCH_SIZE.observe(batch_size, backend=self.name)
+        return text
+
+    def ocr_many(self, images: list) -> list:
+        texts = []
+        for start in range(0, len(images), self.max_batch):
+            batch = images[start:start + self.max_batch]
+            texts.extend(self._run_batch(batch))
+            for _ in batch:
+                BATCH_SIZE.observe(len(batch), backend=self.name)
+        return texts
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._dispatcher is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tesseract")
+                self._dispatcher = threading.Thread(target=self._dispatch, name="ocr-batcher", daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._complete, batch)
+
+    def _complete(self, batch: list):
+        try:
+            texts = self._run_batch([img for img, _ in batch])
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), text in zip(batch, texts):
+            future.set_result((text, len(batch)))
+
+    def _run_batch(self, images: list) -> list:
+        try:
+            return self._run_tesseract(images)
+        except TesseractNotFound:
+            raise
+        except Exception as e:
+            logger.warning(f"Batch OCR of {len(images)} images failed ({str(e)}); retrying one by one")
+            return self._run_fallback(images)
+
+    def _run_fallback(self, images: list) -> list:
+        deadline = time.monotonic() + TESSERACT_TIMEOUT
+        texts = []
+        for img in images:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"OCR of {len(images)} images one by one timed out after {len(texts)}")
+            texts.append(self.fallback.ocr(img, timeout=remaining))
+        return texts
+
+    def _run_tesseract(self, images: list) -> list:
+        with tempfile.TemporaryDirectory(prefix="ocr-batch-") as tmp:
+            paths = []
+            for i, img in enumerate(images):
+                path = os.path.join(tmp, f"{i:04d}.png")
+                img.save(path)
+                paths.append(path)
+            list_path = os.path.join(tmp, "images.txt")
+            with open(list_path, "w") as f:
+                f.write("\n".join(paths) + "\n")
+            cmd = [self.cmd, list_path, "stdout", *shlex.split(self.config)]
+            try:
+                out = subprocess.run(cmd, capture_output=True, timeout=TESSERACT_TIMEOUT, check=True)
+            except FileNotFoundError as e:
+                raise TesseractNotFound(str(e))
+        pages = out.stdout.decode("utf-8", errors="replace").split(PAGE_SEPARATOR)
+        # The last page's separator leaves an empty tail
+        if len(pages) == len(images) + 1 and not pages[-1].strip():
+            pages.pop()
+        if len(pages) != len(images):
+            raise RuntimeError(f"tesseract returned {len(pages)} pages for {len(images)} images")
+        return pages
+
+
+class FakeOCRBackend:
+    """
+    Stand-in for Tesseract that takes `latency` seconds per image and returns FAKE_TEXT.
+
+    For load-testing the server's concurrency on machines without Tesseract
+    or poppler: neither is checked for, and scanned PDF pages are not
+    rasterized (`img` is None for them). Uploaded images are still decoded
+    and preprocessed as usual. With mode "cpu" each call spins for
+    `latency` instead of sleeping, so OCR competes for cores like the real
+    thing.
+    """
+
+    name = "fake"
+    needs_tesseract = False
+    needs_images = False
+
+    def __init__(self, config: str, latency: float = OCR_FAKE_LATENCY, mode: str = OCR_FAKE_MODE):
+        if mode not in ("sleep", "cpu"):
+            raise ValueError(f"Unknown OCR_FAKE_MODE {mode!r}; choose 'sleep' or 'cpu'")
+        self.config = config
+        self.latency = max(0.0, latency)
+        self.mode = mode
+
+    def ocr(self, img) -> str:
+        if self.mode == "cpu":
+            deadline = time.perf_counter() + self.latency
+            while time.perf_counter() < deadline:
+                pass
+        else:
+            time.sleep(self.latency)
+        BATCH_SIZE.observe(1, backend=self.name)
+        return FAKE_TEXT
+
+    def ocr_many(self, images: list) -> list:
+        return [self.ocr(img) for img in images]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def make_backend(kind: str, config: str):
+    if kind == "batch":
+        return BatchTesseractBackend(config)
+    if kind == "pytesseract":
+        return PytesseractBackend(config)
+    if kind == "fake":
+        return FakeOCRBackend(config)
+    raise ValueError(f"Unknown OCR_BACKEND {kind!r}; choose 'batch', 'pytesseract' or 'fake'")
+
+
+def check_executor(kind: str, executor: str):
+    """
+    Refuse OCR_BACKEND=batch with an OCR executor of worker processes.
+
+    Each worker process would batch only its own request's images, so
+    requests would never share a tesseract run and every batch would cost
+    a PDF its page parallelism for nothing.
+
+    Raises:
+        ValueError: for "batch" with the "process" executor.
+    """
+    if kind == "batch" and executor == "process":
+        raise ValueError("OCR_BACKEND=batch only batches images within one process; "
+                         "use it with OCR_EXECUTOR=thread (or --executor thread), or use OCR_BACKEND=pytesseract")
+
+
+def get_backend(config: str):
+    """Per-process OCR backend selected by OCR_BACKEND."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = make_backend(OCR_BACKEND, config)
+    return _backend
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from .storage import data_path, ensure_private_file
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_MEMORY_ENTRIES = int(os.environ.get("OCR_CACHE_MEMORY_ENTRIES", "256"))
+# On-disk tier shared by all workers on the host (created 0600); set to "" to disable it
+OCR_CACHE_PATH = os.environ.get("OCR_CACHE_PATH", data_path("ocr_cache.sqlite3"))
+OCR_CACHE_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+OCR_CACHE_TTL = float(os.environ.get("OCR_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def config_fingerprint(config: dict) -> str:
+    """Short stable hash of the OCR settings that influence the output text."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class OCRCache:
+    """
+    Two-tier cache of OCR results keyed by content hash + OCR config.
+
+    The memory tier is a per-process LRU; the disk tier is a size-bounded
+    SQLite file with TTL expiry and least-recently-used eviction. A disk hit
+    is promoted into memory.
+    """
+
+    def __init__(self, memory_entries: int = OCR_CACHE_MEMORY_ENTRIES, path: str = OCR_CACHE_PATH,
+                 max_bytes: int = OCR_CACHE_MAX_BYTES, ttl: float = OCR_CACHE_TTL):
+        self.memory_entries = memory_entries
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "errors": 0}
+
+    @staticmethod
+    def make_key(digest: str, config: dict) -> str:
+        """Cache key for content with sha256 `digest` processed with `config`."""
+        return f"{digest}:{config_fingerprint(config)}"
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return value
+            value = self._disk_get(key)
+            if value is not None:
+                self._memory_put(key, value)
+                self._counters["disk_hits"] += 1
+                return value
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key: str, value: dict):
+        with self._lock:
+            self._memory_put(key, value)
+            self._disk_put(key, value)
+            self._counters["stores"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            if db is not None:
+                with db:
+                    db.execute("DELETE FROM ocr_cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else None
+            db = self._connect()
+            if db is not None:
+                count, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()
+                stats.update({"disk_entries": count, "disk_bytes": size, "disk_max_bytes": self.max_bytes})
+            return stats
+
+    def _memory_put(self, key, value):
+        if self.memory_entries <= 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _connect(self):
+        if not self.path:
+            return None
+        if self._db is None:
+            try:
+                ensure_private_file(self.path)
+                db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS ocr_cache_accessed ON ocr_cache (accessed)")
+                self._db = db
+            except (sqlite3.Error, OSError) as e:
+                logger.error(f"OCR cache disabled, could not open {self.path}: {str(e)}")
+                self._counters["errors"] += 1
+                self.path = ""
+                return None
+        return self._db
+
+    def _disk_get(self, key):
+        db = self._connect()
+        if db is None:
+            return None
+        try:
+            row = db.execute("SELECT value, created FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > self.ttl:
+                with db:
+                    db.execute("DELETE FROM ocr_cache WHERE key = ?", (key,))
+                self._counters["evictions"] += 1
+                return None
+            with db:
+                db.execute("UPDATE ocr_cache SET accessed = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.error(f"OCR cache read failed: {str(e)}")
+            self._counters["errors"] += 1
+            return None
+
+    def _disk_put(self, key, value):
+        db = self._connect()
+        if db is None:
+            return
+        data = json.dumps(value)
+        now = time.time()
+        try:
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO ocr_cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, data, len(data), now, now),
+                )
+                evicted = db.execute("DELETE FROM ocr_cache WHERE created < ?", (now - self.ttl,)).rowcount
+                # Keep the most recently used entries that fit in max_bytes, drop the rest
+                evicted += db.execute(
+                    "DELETE FROM ocr_cache WHERE key IN ("
+                    "SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS running "
+                    "FROM ocr_cache) WHERE running > ?)",
+                    (self.max_bytes,),
+                ).rowcount
+            self._counters["evictions"] += evicted
+        except sqlite3.Error as e:
+            logger.error(f"OCR cache write failed: {str(e)}")
+            self._counters["errors"] += 1
+
+
+OCR_CACHE = OCRCache()
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# "process" runs OCR in worker processes; "thread" keeps it in this process
+# (for platforms without multiprocessing, e.g. serverless) but still off the event loop
+OCR_EXECUTOR = os.environ.get("OCR_EXECUTOR", "process")
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 1))
+# Jobs allowed to wait for a free worker before new ones are rejected
+OCR_MAX_QUEUE = int(os.environ.get("OCR_MAX_QUEUE", "16"))
+OCR_JOB_TIMEOUT = float(os.environ.get("OCR_JOB_TIMEOUT", "120"))
+# Replace a worker process after this many jobs to cap memory growth
+OCR_MAX_TASKS_PER_CHILD = int(os.environ.get("OCR_MAX_TASKS_PER_CHILD", "50"))
+# Niceness added to worker processes (and the Tesseract they run), so the
+# API process keeps answering cheap requests like /analyze while OCR saturates the CPU
+OCR_WORKER_NICE = int(os.environ.get("OCR_WORKER_NICE", "5"))
+
+
+class OCRQueueFull(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class OCRTimeout(Exception):
+    """Raised when an OCR job does not finish within the job timeout."""
+
+
+def _init_worker(nice: int = 0):
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+    # Pay the PIL/pytesseract imports and the capability probe once per
+    # worker, not on its first job
+    from . import ocr_backend, ocr_service
+    ocr_service.get_pil_image()
+    ocr_backend.get_pytesseract()
+    ocr_service.capabilities.probe()
+
+
+class QueueProgress:
+    """
+    Picklable progress callback: puts each event dict on a queue.
+
+    Works across the process boundary when the queue is a Manager queue, so
+    OCR running in a worker process can report per-page progress to the parent.
+    """
+
+    def __init__(self, q):
+        self.q = q
+
+    def __call__(self, **event):
+        try:
+            self.q.put_nowait(event)
+        except Exception:
+            pass
+
+
+class OCRPool:
+    """
+    Bounded executor for CPU-heavy OCR jobs.
+
+    At most `workers + max_queue` jobs are admitted at once; beyond that `run`
+    fails fast with OCRQueueFull. A job still counts against that bound until
+    its worker is actually done with it, even after its caller timed out.
+    """
+
+    def __init__(self, kind: str = OCR_EXECUTOR, workers: int = OCR_WORKERS, max_queue: int = OCR_MAX_QUEUE,
+                 timeout: float = OCR_JOB_TIMEOUT, max_tasks_per_child: int = OCR_MAX_TASKS_PER_CHILD):
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self._executor = None
+        self._manager = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            if self.kind == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+            else:
+                kwargs = {}
+                # Worker recycling needs Python 3.11; older versions keep their workers
+                if sys.version_info >= (3, 11):
+                    kwargs["max_tasks_per_child"] = self.max_tasks_per_child
+                elif self.max_tasks_per_child:
+                    logger.info("OCR_MAX_TASKS_PER_CHILD needs Python 3.11; OCR workers will not be recycled")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(OCR_WORKER_NICE,),
+                    **kwargs,
+                )
+        logger.info(f"OCR pool started: {self.workers} {self.kind} workers, queue {self.max_queue}")
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting work, drop queued jobs and (optionally) wait for running ones."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            manager, self._manager = self._manager, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            logger.info("OCR pool shut down")
+        if manager is not None:
+            manager.shutdown()
+
+    def progress_queue(self):
+        """A queue that jobs on this pool can report progress through (see QueueProgress)."""
+        if self.kind == "thread":
+            return queue.Queue()
+        with self._lock:
+            if self._manager is None:
+                self._manager = multiprocessing.get_context("spawn").Manager()
+            return self._manager.Queue()
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the pool and return its result."""
+        if self._executor is None:
+            self.start()
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise OCRQueueFull(f"OCR queue full ({self._in_flight} jobs in flight)")
+            self._in_flight += 1
+        try:
+            cf = self._executor.submit(fn, *args)
+        except Exception:
+            self._job_done(None)
+            raise
+        cf.add_done_callback(self._job_done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(cf), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # Drops the job if it has not started; a running job finishes in the background
+            cf.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise OCRTimeout(f"OCR did not finish within {self.timeout:.0f} s")
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for later jobs
+            logger.error("OCR worker process died, restarting the pool")
+            self.shutdown(wait=False)
+            raise
+
+    def _job_done(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executor": self.kind,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "running": self._executor is not None,
+            }
+
+
+OCR_POOL = OCRPool()
@@ -1,55 +1,349 @@
-from PIL import Image
+import contextvars
 import io
-import pytesseract
+from contextlib import closing
 import os
 import logging
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import capabilities, metrics
+from .capabilities import lazy_import
+from .ocr_backend import TesseractNotFound, get_backend
+from .ocr_pool import OCR_EXECUTOR, OCR_WORKERS
 
 logger = logging.getLogger(__name__)
 
-# Configure Tesseract path for Windows
-TESSERACT_PATH = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-if os.path.exists(TESSERACT_PATH):
-    pytesseract.pytesseract.pytesseract_cmd = TESSERACT_PATH
+# PIL and pytesseract (which pulls in pandas) are imported on first OCR use,
+# so processes that only serve /analyze never load them
+def get_pil_image():
+    return lazy_import("PIL.Image")
+
+# Header of a PDF page that failed to OCR; the other pages are still returned
+PAGE_ERROR_HEADER = "--- Page {} (Error) ---"
+PAGE_ERROR_RE = re.compile(r"^--- Page \d+ \(Error\) ---$", re.MULTILINE)
+
+TESSERACT_MISSING_MESSAGE = "Error: Tesseract OCR is not installed. Please install it from: https://github.com/UB-Mannheim/tesseract/wiki or run: winget install UB-Mannheim.TesseractOCR"
 
 # Optimize Tesseract config for faster processing
 TESSERACT_CONFIG = r'--oem 1 --psm 6'
 
-def check_tesseract_installed():
-    """Check if Tesseract is installed and accessible."""
+# Images wider than this are downsized before OCR
+OCR_MAX_WIDTH = int(os.environ.get("OCR_MAX_WIDTH", "1024"))
+# Uploaded images that would decode to more pixels than this are refused
+# before decoding (JPEGs count at the reduced size they are decoded at)
+OCR_MAX_PIXELS = int(os.environ.get("OCR_MAX_PIXELS", str(50_000_000)))
+# Scanned PDFs: pages rasterized and OCR'd, and the DPI used (lower DPI for speed)
+OCR_MAX_PDF_PAGES = int(os.environ.get("OCR_MAX_PDF_PAGES", "3"))
+PDF_DPI = int(os.environ.get("OCR_PDF_DPI", "150"))
+
+def page_workers_for(pool_workers: int, executor: str) -> int:
+    """
+    Page threads per process: OCR_PAGE_WORKERS, or a share of the cores.
+
+    Every worker process has its own page pool, so with `pool_workers`
+    processes up to pool_workers x page workers tesseract/pdftoppm runs can
+    be active at once; the default keeps that product within cpu_count.
+    Thread workers all share this process's one pool, which gets every core.
+    """
+    if os.environ.get("OCR_PAGE_WORKERS"):
+        return max(1, int(os.environ["OCR_PAGE_WORKERS"]))
+    cores = os.cpu_count() or 1
+    if executor == "thread":
+        return cores
+    return max(1, cores // max(1, pool_workers))
+
+# Pages processed concurrently in this process; pdftoppm and tesseract are
+# subprocesses, so threads run them truly in parallel
+OCR_PAGE_WORKERS = page_workers_for(OCR_WORKERS, OCR_EXECUTOR)
+# Parallelism comes from running pages side by side, not from tesseract's own
+# OpenMP threads, which would oversubscribe the cores
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+_page_executor = None
+_page_executor_lock = threading.Lock()
+
+def get_page_executor():
+    """Per-process thread pool shared by all page-level OCR work."""
+    global _page_executor
+    with _page_executor_lock:
+        if _page_executor is None:
+            _page_executor = ThreadPoolExecutor(max_workers=OCR_PAGE_WORKERS, thread_name_prefix="ocr-page")
+    return _page_executor
+
+def report_progress(progress, **event):
+    """Send a progress event to an optional callback; never lets it break OCR."""
+    if progress is None:
+        return
     try:
-        pytesseract.get_tesseract_version()
-        return True
-    except pytesseract.TesseractNotFoundError:
-        return False
+        progress(**event)
+    except Exception as e:
+        logger.warning(f"Progress callback failed: {str(e)}")
+
+def check_tesseract_installed():
+    """Check if Tesseract is installed and accessible (probed once per process); true for backends without it."""
+    return not get_backend(TESSERACT_CONFIG).needs_tesseract or capabilities.has("tesseract")
+
+def ocr_image(img) -> str:
+    """Run Tesseract on a PIL image through the OCR_BACKEND backend."""
+    # Includes time spent waiting for a batch to fill
+    with metrics.span("tesseract"):
+        return get_backend(TESSERACT_CONFIG).ocr(img)
+
+def ocr_config() -> dict:
+    """OCR settings that change the extracted text (part of the OCR cache key)."""
+    config = {
+        "tesseract_config": TESSERACT_CONFIG,
+        "max_width": OCR_MAX_WIDTH,
+        "pdf_dpi": PDF_DPI,
+        "max_pdf_pages": OCR_MAX_PDF_PAGES,
+        "preprocess": {"preset": OCR_PREPROCESS, **get_preset()},
+    }
+    if not get_backend(TESSERACT_CONFIG).needs_images:
+        # Canned text from the fake backend must never be served as real OCR
+        config["backend"] = get_backend(TESSERACT_CONFIG).name
+    return config
+
+# Image preparation before Tesseract, per preset:
+#   mode      "RGB" (as before), "L" (8-bit gray) or "1" (Otsu-thresholded black/white)
+#   resample  filter used to downsize: "lanczos" (sharpest, slowest), "bilinear" or "box"
+#   autocrop  cut blank margins (scale is still set by the full page width)
+#   deskew    straighten pages scanned at up to DESKEW_MAX_ANGLE degrees
+PREPROCESS_PRESETS = {
+    "none": {"mode": "RGB", "resample": "lanczos", "autocrop": False, "deskew": False},
+    "gray": {"mode": "L", "resample": "bilinear", "autocrop": True, "deskew": False},
+    "binary": {"mode": "1", "resample": "bilinear", "autocrop": True, "deskew": False},
+    "binary_deskew": {"mode": "1", "resample": "bilinear", "autocrop": True, "deskew": True},
+    "fast": {"mode": "1", "resample": "box", "autocrop": True, "deskew": False},
+}
+# "none" keeps the original image handling; the others trade accuracy for
+# speed and should be chosen per deployment from the ocr_preset benchmarks
+OCR_PREPROCESS = os.environ.get("OCR_PREPROCESS", "none")
+# Pixels darker than this count as content when looking for blank margins
+AUTOCROP_LEVEL = 200
+# Blank border kept around the content, as a fraction of the page width
+AUTOCROP_PAD = 0.02
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_STEP = 0.25
+
+def get_preset(name=None) -> dict:
+    name = name or OCR_PREPROCESS
+    if name not in PREPROCESS_PRESETS:
+        raise ValueError(f"Unknown OCR_PREPROCESS preset {name!r}; choose from {', '.join(PREPROCESS_PRESETS)}")
+    return PREPROCESS_PRESETS[name]
+
+def _resample_filter(name: str):
+    Resampling = get_pil_image().Resampling
+    return {"lanczos": Resampling.LANCZOS, "bilinear": Resampling.BILINEAR, "box": Resampling.BOX}[name]
+
+def content_bbox(gray, level: int = AUTOCROP_LEVEL):
+    """Bounding box of the pixels darker than `level` in an "L" image, or None if blank."""
+    mask = gray.point([255 if p < level else 0 for p in range(256)])
+    return mask.getbbox()
+
+def otsu_threshold(gray) -> int:
+    """Gray level best separating text from background (Otsu's method on the histogram)."""
+    hist = gray.histogram()[:256]
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    sum_bg = weight_bg = 0
+    best, best_var = 127, -1.0
+    for t in range(256):
+        weight_bg += hist[t]
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * hist[t]
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        var = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if var > best_var:
+            best, best_var = t, var
+    return best
+
+def estimate_skew(gray, max_angle: float = DESKEW_MAX_ANGLE, step: float = DESKEW_STEP) -> float:
+    """
+    Rotation (degrees) that best straightens the text lines of an "L" image.
+
+    Tries every angle in +-max_angle on a small thresholded copy and keeps
+    the one whose row profile is sharpest (text lines and gaps separate best).
+    """
+    import numpy as np
+    Image = get_pil_image()
+    small = gray.copy()
+    small.thumbnail((600, 600), Image.Resampling.BILINEAR)
+    ink = small.point([255 if p < AUTOCROP_LEVEL else 0 for p in range(256)])
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        rows = np.asarray(ink.rotate(float(angle), resample=Image.Resampling.NEAREST), dtype=np.float32).sum(axis=1)
+        score = float(np.square(np.diff(rows)).sum())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def _crop_to_content(gray, pad: int):
+    bbox = content_bbox(gray)
+    if bbox is None:
+        return gray
+    left, top, right, bottom = bbox
+    return gray.crop((max(0, left - pad), max(0, top - pad),
+                      min(gray.width, right + pad), min(gray.height, bottom + pad)))
+
+def preprocess_image(img, preset=None, max_width=None):
+    """
+    Prepare an image for Tesseract according to an OCR_PREPROCESS preset.
+
+    Working in one channel from the start makes the crop, deskew and resize
+    steps cheaper, and a 1-bit page is what Tesseract would binarize to
+    internally anyway.
+    """
+    options = get_preset(preset)
+    max_width = max_width or OCR_MAX_WIDTH
+    if options["mode"] == "RGB":
+        return optimize_image(img.convert("RGB"), max_width)
+
+    Image = get_pil_image()
+    gray = img.convert("L")
+    # Downscale relative to the full page, so cropping margins keeps the text size
+    scale = min(1.0, max_width / gray.width)
+    pad = int(gray.width * AUTOCROP_PAD)
+    if options["autocrop"]:
+        gray = _crop_to_content(gray, pad)
+    if options["deskew"]:
+        # Estimated on the content only, where the text lines are
+        angle = estimate_skew(gray)
+        if abs(angle) >= DESKEW_STEP:
+            gray = gray.rotate(angle, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+            if options["autocrop"]:
+                gray = _crop_to_content(gray, pad)
+    if scale < 1.0:
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, _resample_filter(options["resample"]), reducing_gap=3.0)
+    if options["mode"] == "1":
+        threshold = otsu_threshold(gray)
+        return gray.point([255 if p > threshold else 0 for p in range(256)], mode="1")
+    return gray
+
+class ImageTooLarge(ValueError):
+    """Raised when an image would decode to more than OCR_MAX_PIXELS pixels."""
+
+def open_image(stream, preset=None, max_width=None):
+    """
+    Open an image for OCR, set up to decode no bigger than OCR needs.
+
+    JPEGs are decoded straight at the smallest 1/2, 1/4 or 1/8 scale that
+    is still at least `max_width` wide (in gray for the gray presets), so a
+    phone photo never exists at full resolution. Only the header is read
+    here; the pixel budget is checked against the size that will be decoded.
+
+    Raises:
+        ImageTooLarge: over OCR_MAX_PIXELS.
+    """
+    max_width = max_width or OCR_MAX_WIDTH
+    img = get_pil_image().open(stream)
+    if img.width > max_width:
+        mode = "RGB" if get_preset(preset)["mode"] == "RGB" else "L"
+        img.draft(mode, (max_width, max(1, img.height * max_width // img.width)))
+    if img.width * img.height > OCR_MAX_PIXELS:
+        img.close()
+        raise ImageTooLarge(f"Image is {img.width}x{img.height} pixels; "
+                            f"the limit is {OCR_MAX_PIXELS / 1e6:g} megapixels")
+    return img
+
+def decode_image(img, max_width=None):
+    """
+    Decode an image from open_image, shrunk by a whole factor while still at least `max_width` wide.
+
+    Formats without reduced decoding (PNG, TIFF, ...) are box-reduced right
+    after decoding, before any mode conversion copies them at full size.
+    """
+    max_width = max_width or OCR_MAX_WIDTH
+    img.load()
+    factor = img.width // max_width
+    if factor >= 2 and img.mode in ("L", "LA", "RGB", "RGBA"):
+        img = img.reduce(factor)
+    return img
+
+def check_image_size(source):
+    """
+    Refuse an image upload over OCR_MAX_PIXELS from its header alone, before it is queued for OCR.
+
+    PDFs and files PIL cannot identify pass (image_to_text reports on those).
 
-def optimize_image(img, max_width=1024):
+    Raises:
+        ImageTooLarge: over the limit.
+    """
+    Image = get_pil_image()
+    with open_source(source) as f:
+        if f.read(4) == b"%PDF":
+            return
+        f.seek(0)
+        try:
+            open_image(f).close()
+        except Image.DecompressionBombError as e:
+            raise ImageTooLarge(str(e))
+        except (IOError, Image.UnidentifiedImageError):
+            return
+
+def optimize_image(img, max_width=None):
     """Optimize image size for faster OCR processing."""
+    max_width = max_width or OCR_MAX_WIDTH
     # Resize if too large
     if img.width > max_width:
         ratio = max_width / img.width
         new_height = int(img.height * ratio)
-        img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+        img = img.resize((max_width, new_height), get_pil_image().Resampling.LANCZOS)
     return img
 
-def extract_text_from_pdf_pypdf2(pdf_bytes: bytes):
-    """Extract text directly from PDF using PyPDF2."""
+def is_path(source) -> bool:
+    """True if an OCR source is a file path rather than in-memory bytes."""
+    return isinstance(source, (str, os.PathLike))
+
+def open_source(source):
+    """Binary file object over an OCR source (bytes or file path)."""
+    return open(source, "rb") if is_path(source) else io.BytesIO(source)
+
+def _early_exit(source: str, page_num: int, pages: int):
+    """Record that reading stopped after `page_num` of `pages` because `until` was satisfied."""
+    if page_num >= pages:
+        return
+    logger.info(f"All requested parameters found on page {page_num} of {pages}; skipping the rest")
+    metrics.EARLY_EXITS.inc(source=source)
+    metrics.PAGES_SKIPPED.inc(pages - page_num, source=source)
+
+def extract_text_from_pdf_pypdf2(pdf_source, progress=None, until=None):
+    """
+    Extract text directly from PDF (bytes or file path) using PyPDF2.
+
+    Pages are parsed one at a time; if `until(page_text)` returns True the
+    remaining pages are never parsed.
+    """
     try:
         from PyPDF2 import PdfReader
-        pdf_file = io.BytesIO(pdf_bytes)
-        reader = PdfReader(pdf_file)
-        text = []
-        
-        # Extract text from all pages (max 10 pages to avoid timeout)
-        num_pages = min(len(reader.pages), 10)
-        for page_num in range(num_pages):
-            try:
-                page = reader.pages[page_num]
-                page_text = page.extract_text()
-                if page_text.strip():
-                    text.append(f"--- Page {page_num + 1} ---\n{page_text}")
-            except Exception as e:
-                logger.error(f"Error extracting text from page {page_num + 1}: {str(e)}")
-        
+        with metrics.span("pdf_text"):
+            # A path lets PyPDF2 seek in the file instead of holding a copy in memory
+            reader = PdfReader(pdf_source if is_path(pdf_source) else io.BytesIO(pdf_source))
+            text = []
+
+            # Extract text from all pages (max 10 pages to avoid timeout)
+            num_pages = min(len(reader.pages), 10)
+            for page_num in range(num_pages):
+                try:
+                    page = reader.pages[page_num]
+                    page_text = page.extract_text()
+                    report_progress(progress, stage="pdf_text", page=page_num + 1, pages=num_pages)
+                    if page_text.strip():
+                        text.append(f"--- Page {page_num + 1} ---\n{page_text}")
+                        if until is not None and until(page_text):
+                            _early_exit("pdf_text", page_num + 1, num_pages)
+                            break
+                except Exception as e:
+                    logger.error(f"Error extracting text from page {page_num + 1}: {str(e)}")
+
+        if text:
+            metrics.PAGES.inc(len(text), source="pdf_text")
         return "\n\n".join(text) if text else None
     except ImportError:
         logger.warning("PyPDF2 not installed")
@@ -58,88 +352,185 @@ def extract_text_from_pdf_pypdf2(pdf_bytes: bytes):
         logger.error(f"Error extracting PDF text: {str(e)}")
         return None
 
-def convert_pdf_to_images(pdf_bytes: bytes):
-    """Convert PDF pages to images using pdf2image."""
+def count_pdf_pages(pdf_path: str):
+    """Number of pages in a PDF according to poppler, or None if it cannot be read."""
+    if not get_backend(TESSERACT_CONFIG).needs_images:
+        # Nothing will be rasterized, so do without poppler
+        try:
+            from PyPDF2 import PdfReader
+            return len(PdfReader(pdf_path).pages)
+        except Exception as e:
+            logger.error(f"Error reading PDF info: {str(e)}")
+            return None
     try:
-        from pdf2image import convert_from_bytes
-        images = convert_from_bytes(pdf_bytes, first_page=1, last_page=3, dpi=150)  # Convert first 3 pages max, lower DPI for speed
-        return images
+        from pdf2image import pdfinfo_from_path
+        return int(pdfinfo_from_path(pdf_path)["Pages"])
     except ImportError:
         logger.warning("pdf2image library not installed")
         return None
     except Exception as e:
-        logger.error(f"Error converting PDF: {str(e)}")
+        logger.error(f"Error reading PDF info: {str(e)}")
         return None
 
-def image_to_text(image_bytes: bytes) -> str:
+def ocr_pdf_page(pdf_path: str, page_num: int) -> str:
+    """Rasterize a single PDF page and OCR it."""
+    if not get_backend(TESSERACT_CONFIG).needs_images:
+        text = ocr_image(None)
+        metrics.PAGES.inc(source="ocr")
+        return text
+    from pdf2image import convert_from_path
+    with metrics.span("rasterize"):
+        images = convert_from_path(pdf_path, first_page=page_num, last_page=page_num, dpi=PDF_DPI)
+        if not images:
+            return ""
+        img = preprocess_image(images[0])
+    logger.info(f"Processing PDF page {page_num} with OCR, size: {img.size}")
+    text = ocr_image(img)
+    metrics.PAGES.inc(source="ocr")
+    return text
+
+def iter_ocr_pdf_pages(pdf_path: str, page_count: int, max_pages: int = OCR_MAX_PDF_PAGES,
+                       first_alone: bool = False):
+    """
+    OCR the first `max_pages` pages of a scanned PDF in parallel.
+
+    Every page is rasterized and OCR'd as its own task on the page pool, so
+    rasterizing one page overlaps with OCR of the others. Yields
+    (page_num, text, error) in page order as soon as each page is ready;
+    pages not yet started are cancelled if the caller stops early.
+    With `first_alone`, the other pages are only started once page 1 has
+    been consumed, for callers likely to stop after it.
+    """
+    pages = range(1, min(page_count, max_pages) + 1)
+    executor = get_page_executor()
+
+    def submit(n):
+        # Each page task gets a copy of the caller's context, so its metrics
+        # spans are recorded for the request being served
+        return executor.submit(contextvars.copy_context().run, ocr_pdf_page, pdf_path, n)
+
+    futures = [submit(n) for n in (pages[:1] if first_alone else pages)]
+    try:
+        for i, page_num in enumerate(pages):
+            if i == len(futures):
+                futures += [submit(n) for n in pages[i:]]
+            try:
+                yield page_num, futures[i].result(), None
+            except Exception as e:
+                yield page_num, None, e
+    finally:
+        for future in futures:
+            future.cancel()
+
+def ocr_scanned_pdf(pdf_source, progress=None, until=None) -> str:
+    """
+    OCR an image-only PDF (bytes or file path) page by page.
+
+    With `until`, page 1 is OCR'd on its own and the rest are skipped if
+    `until(page_text)` returns True for it (and so on for later pages).
+    """
+    if is_path(pdf_source):
+        pdf_path, tmp_path = os.fspath(pdf_source), None
+    else:
+        # Written to disk once so each page task rasterizes from the same file
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(pdf_source)
+            pdf_path = tmp_path = tmp.name
+    try:
+        page_count = count_pdf_pages(pdf_path)
+        if page_count is None:
+            return "Error: Could not process PDF. pdf2image requires poppler to be installed. Please install poppler from https://github.com/oschwartz10612/poppler-windows/releases/"
+        if page_count == 0:
+            return "Error: Could not extract pages from PDF"
+
+        all_text = []
+        pages = min(page_count, OCR_MAX_PDF_PAGES)
+        page_iter = iter_ocr_pdf_pages(pdf_path, page_count, first_alone=until is not None)
+        # closing() cancels the pages not yet started as soon as we stop early
+        with closing(page_iter):
+            for page_num, ocr_text, err in page_iter:
+                report_progress(progress, stage="ocr_page", page=page_num, pages=pages, ok=err is None)
+                if err is not None:
+                    logger.error(f"Error processing PDF page {page_num}: {str(err)}")
+                    all_text.append(f"{PAGE_ERROR_HEADER.format(page_num)}\nFailed to process page: {str(err)}")
+                elif ocr_text.strip():
+                    all_text.append(f"--- Page {page_num} ---\n{ocr_text}")
+                    if until is not None and until(ocr_text):
+                        _early_exit("ocr", page_num, pages)
+                        break
+
+        return "\n\n".join(all_text) if all_text else "No text detected in PDF"
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
+
+def is_complete(text: str) -> bool:
+    """False when image_to_text failed, or a PDF page failed to OCR (page timeouts, crashes, ...)."""
+    return not text.startswith("Error") and not PAGE_ERROR_RE.search(text)
+
+def image_to_text(source, progress=None, until=None) -> str:
+    """
+    Extract text from an uploaded image or PDF.
+
+    `source` is the file content as bytes, or the path of a file on disk;
+    a path keeps the upload out of memory and is cheap to send to OCR workers.
+    `progress`, if given, is called with keyword event fields as pages finish.
+    `until`, if given, is called with each page's text as it is read and
+    stops reading further PDF pages once it returns True (see
+    extract_service.StreamingExtractor).
+    """
     try:
-        if not image_bytes or len(image_bytes) == 0:
+        size = os.path.getsize(source) if is_path(source) else len(source or b"")
+        if size == 0:
             return "Error: Empty file"
         
-        # Check if Tesseract is installed
-        if not check_tesseract_installed():
-            return "Error: Tesseract OCR is not installed. Please install it from: https://github.com/UB-Mannheim/tesseract/wiki or run: winget install UB-Mannheim.TesseractOCR"
-        
         # Check if it's a PDF file
-        is_pdf = image_bytes[:4] == b'%PDF'
+        with open_source(source) as f:
+            is_pdf = f.read(4) == b'%PDF'
         
         if is_pdf:
             logger.info("Processing PDF file")
             
             # Try PyPDF2 first (direct text extraction, faster)
-            text = extract_text_from_pdf_pypdf2(image_bytes)
+            text = extract_text_from_pdf_pypdf2(source, progress, until)
             if text:
                 logger.info(f"Extracted text from PDF using PyPDF2: {len(text)} characters")
                 return text
             
-            # Fallback: Try converting PDF to images and use OCR
+            # Fallback: rasterize the pages and OCR them in parallel.
+            # Only OCR needs Tesseract; text PDFs work without it
+            if not check_tesseract_installed():
+                return TESSERACT_MISSING_MESSAGE
             logger.info("PyPDF2 extraction returned no text, attempting image conversion")
-            images = convert_pdf_to_images(image_bytes)
-            
-            if images is None:
-                return "Error: Could not process PDF. pdf2image requires poppler to be installed. Please install poppler from https://github.com/oschwartz10612/poppler-windows/releases/"
-            
-            if not images:
-                return "Error: Could not extract pages from PDF"
-            
-            # Process all extracted images with OCR
-            all_text = []
-            for page_num, img in enumerate(images, 1):
-                try:
-                    img = img.convert("RGB")
-                    img = optimize_image(img)
-                    logger.info(f"Processing PDF page {page_num} with OCR, size: {img.size}")
-                    ocr_text = pytesseract.image_to_string(img, config=TESSERACT_CONFIG)
-                    if ocr_text.strip():
-                        all_text.append(f"--- Page {page_num} ---\n{ocr_text}")
-                except Exception as e:
-                    logger.error(f"Error processing PDF page {page_num}: {str(e)}")
-                    all_text.append(f"--- Page {page_num} (Error) ---\nFailed to process page: {str(e)}")
-            
-            return "\n\n".join(all_text) if all_text else "No text detected in PDF"
+            metrics.OCR_FALLBACKS.inc()
+            return ocr_scanned_pdf(source, progress, until)
         
         else:
             # Process as regular image
+            if not check_tesseract_installed():
+                return TESSERACT_MISSING_MESSAGE
             logger.info("Processing image file")
-            byte_stream = io.BytesIO(image_bytes)
+            Image = get_pil_image()
             try:
-                img = Image.open(byte_stream)
-                img.verify()  # Verify it's a valid image
-                
-                # Re-open since verify() closes the file
-                byte_stream.seek(0)
-                img = Image.open(byte_stream).convert("RGB")
-                
-                # Optimize image for faster processing
-                img = optimize_image(img)
+                with metrics.span("decode"), open_source(source) as byte_stream:
+                    # Decoded once, at reduced size where the format allows;
+                    # invalid or truncated files fail here
+                    img = decode_image(open_image(byte_stream))
+
+                    # Shrink, crop and binarize per the OCR_PREPROCESS preset
+                    img = preprocess_image(img)
+            except (ImageTooLarge, Image.DecompressionBombError) as e:
+                return f"Error: {str(e)}"
             except (IOError, Image.UnidentifiedImageError) as img_err:
                 return f"Error: Invalid image format - {str(img_err)}"
             
             logger.info(f"Processing image of size {img.size}")
-            text = pytesseract.image_to_string(img, config=TESSERACT_CONFIG)
+            text = ocr_image(img)
+            metrics.PAGES.inc(source="ocr")
+            report_progress(progress, stage="ocr_image", page=1, pages=1)
             return text if text.strip() else "No text detected in image"
     
-    except pytesseract.TesseractNotFoundError:
+    except TesseractNotFound:
         return "Error: Tesseract is not installed or not in PATH. Install from: https://github.com/UB-Mannheim/tesseract/wiki"
     except Exception as e:
         logger.error(f"Error processing file: {str(e)}")
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import queue
+from starlette.concurrency import run_in_threadpool
+from . import ocr_service, extract_service, ml_service, metrics
+from .admission import ADMISSION, PRIORITY_INTERACTIVE, estimate_cost
+from .ocr_cache import OCR_CACHE
+from .ocr_pool import OCR_POOL, QueueProgress
+
+logger = logging.getLogger(__name__)
+
+# How often OCR progress events are forwarded while a job is running
+PROGRESS_POLL_INTERVAL = 0.25
+
+
+class ParamsUnavailable(Exception):
+    """Raised when normal_ranges.json is not loaded, so parameter names cannot be checked."""
+
+
+def parse_params(value: str = None):
+    """
+    Parameters a caller needs, from a comma separated query value.
+
+    Naming parameters opts in to early exit: a multi-page PDF stops being
+    read once all of them are found. None (not given) and "all" read the
+    whole document. Returns a sorted list, or None to read every page.
+
+    Raises:
+        ValueError: for names that are not known parameters.
+        ParamsUnavailable: if the known parameters cannot be loaded.
+    """
+    if value is None or value.strip().lower() == "all":
+        return None
+    ranges = ml_service.RANGES.get()
+    if ranges is None:
+        raise ParamsUnavailable("Parameter list unavailable: normal ranges are not loaded")
+    known = ranges.params
+    params = sorted({p.strip() for p in value.split(",") if p.strip()})
+    unknown = [p for p in params if p not in known]
+    if unknown or not params:
+        raise ValueError(f"Unknown parameter(s) {', '.join(unknown) or repr(value)}; "
+                         f"choose from {', '.join(known)} or 'all'")
+    return params
+
+
+async def process_report(path: str, digest: str, on_progress=None, params=None, priority: int = PRIORITY_INTERACTIVE):
+    """
+    OCR an uploaded file on the OCR pool and extract its parameter values.
+
+    Results are looked up in and stored to the OCR cache by content digest;
+    only complete ones (no error, no failed page) are stored.
+    `on_progress`, if given, is called in the event loop with each progress
+    event dict from the OCR worker (stage, page, pages, ...).
+    `params` (see parse_params) lets a multi-page PDF stop being read once
+    all of them have been found; None reads every page.
+    Cache misses go through admission control at `priority` (see
+    admission.AdmissionController), weighted by the file's estimated cost.
+
+    Raises:
+        Overloaded: if an interactive request cannot get OCR capacity in time.
+        ImageTooLarge: for images over OCR_MAX_PIXELS.
+
+    Returns:
+        ({"text": ..., "values": ...}, "hit" or "miss")
+    """
+    # Early exit changes how much text is read, so the parameter set is part of the key
+    cache_key = OCR_CACHE.make_key(digest, {**ocr_service.ocr_config(), "params": params})
+    until = extract_service.StreamingExtractor(params) if params else None
+    with metrics.span("ocr_cache"):
+        cached = await run_in_threadpool(OCR_CACHE.get, cache_key)
+    metrics.OCR_CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+    if cached is not None:
+        logger.info(f"OCR cache hit for {digest[:12]}")
+        return cached, "hit"
+
+    # Oversized images are refused from their header, not after waiting for a worker
+    await run_in_threadpool(ocr_service.check_image_size, path)
+    cost = await run_in_threadpool(estimate_cost, path)
+    # "ocr" includes waiting for a pool worker; the worker's own stages
+    # (pdf_text, rasterize, tesseract, ...) are merged in from its records
+    async with ADMISSION.slot(cost, priority):
+        with metrics.span("ocr"):
+            if on_progress is None:
+                text, records = await OCR_POOL.run(metrics.collect, ocr_service.image_to_text, path, None, until)
+            else:
+                text, records = await _run_with_progress(path, on_progress, until)
+    metrics.merge(records)
+    logger.info(f"OCR extraction complete, text length: {len(text)}")
+    values = extract_service.extract_key_values(text)
+    logger.info(f"Extracted {len(values)} parameters")
+    result = {"text": text, "values": values}
+    # Failures may be transient (timeouts, missing binaries), so only complete results are kept
+    if ocr_service.is_complete(text):
+        await run_in_threadpool(OCR_CACHE.put, cache_key, result)
+    else:
+        logger.info(f"OCR result for {digest[:12]} is incomplete; not cached")
+    return result, "miss"
+
+
+async def _run_with_progress(path: str, on_progress, until=None):
+    q = OCR_POOL.progress_queue()
+    task = asyncio.ensure_future(OCR_POOL.run(metrics.collect, ocr_service.image_to_text, path,
+                                              QueueProgress(q), until))
+
+    def drain():
+        # Manager queues are proxies to another process, so read them off the loop
+        events = []
+        while True:
+            try:
+                events.append(q.get_nowait())
+            except (queue.Empty, EOFError, OSError):
+                return events
+
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=PROGRESS_POLL_INTERVAL)
+            for event in await run_in_threadpool(drain):
+                on_progress(event)
+    finally:
+        if not task.done():
+            task.cancel()
+    for event in await run_in_threadpool(drain):
+        on_progress(event)
+    return task.result()
@@ -0,0 +1,34 @@
+import os
+
+# Private directory for the app's SQLite files (OCR cache, jobs, history);
+# created 0700. Not the shared temp dir: other local users must not read
+# patient data or plant entries in it
+APP_DATA_DIR = os.environ.get("APP_DATA_DIR") or os.path.join(
+    os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share"),
+    "blood-report-analyzer",
+)
+
+
+def data_path(name: str) -> str:
+    """Default location of the data file `name`, inside APP_DATA_DIR."""
+    return os.path.join(APP_DATA_DIR, name)
+
+
+def ensure_private_file(path: str):
+    """
+    Create `path` readable by this user only (0600), and its directory (0700), if missing.
+
+    Called before SQLite opens a database, which would otherwise create it
+    with umask permissions; SQLite gives its -wal and -shm files the
+    database file's mode. Existing files are left as they are, and so are
+    in-memory databases (":memory:").
+
+    Raises:
+        OSError: if the directory or file cannot be created.
+    """
+    if path == ":memory:":
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+    os.close(fd)
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Same limit the Streamlit frontend enforces
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Where uploads are spooled while they are processed (system temp dir by default)
+UPLOAD_TMP_DIR = os.environ.get("UPLOAD_TMP_DIR") or None
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+
+
+def spool_upload(src, suffix: str = "", max_bytes: int = MAX_UPLOAD_BYTES, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """
+    Copy a file object to a named temp file in fixed-size chunks.
+
+    Hashes the content on the way, so memory use is one chunk regardless of
+    the upload size. The caller owns (and must delete) the returned path.
+
+    Returns:
+        (path, size in bytes, sha256 hex digest)
+    """
+    h = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=UPLOAD_TMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+                h.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, size, h.hexdigest()
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware rejecting oversized request bodies with 413 before they are parsed.
+
+    Requests announcing a larger Content-Length are refused without reading
+    the body; chunked bodies are counted as they stream in and cut off as
+    soon as they cross the limit.
+    """
+
+    def __init__(self, app, paths, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.paths = tuple(paths)
+        # Multipart framing adds a little on top of the file itself
+        self.max_bytes = max_bytes + 64 * 1024
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            logger.warning(f"Rejecting {scope['path']}: Content-Length {int(content_length)} over limit")
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def counting_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge(f"Request body over {self.max_bytes} bytes")
+            return message
+
+        async def limited_send(message):
+            nonlocal response_started
+            if exceeded:
+                # The app turned the aborted body read into its own error
+                # response; answer with 413 instead
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, limited_send)
+        except UploadTooLarge:
+            if not response_started:
+                await self._reject(send)
+        if exceeded:
+            logger.warning(f"Rejected {scope['path']}: body over limit")
+
+    async def _reject(self, send):
+        body = b'{"detail":"File exceeds the upload size limit"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
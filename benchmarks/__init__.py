@@ -0,0 +1 @@
+"""Offline microbenchmarks for the analysis pipeline; run with `python -m benchmarks`."""
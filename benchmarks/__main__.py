@@ -0,0 +1,91 @@
+"""
+Run the pipeline benchmarks.
+
+    python -m benchmarks                              # run and print a table
+    python -m benchmarks --stage extract,compare      # only some stages
+    python -m benchmarks --save benchmarks/baselines/main.json
+    python -m benchmarks --compare benchmarks/baselines/main.json
+
+--compare exits with status 1 when any case's p50 latency is more than
+--threshold (default 15%) slower than the baseline.
+"""
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+from .suite import cases, environment, run_case
+
+
+RESULT_FIELDS = {"name", "stage", "unit", "units_per_call", "iters", "mean_ms", "p50_ms", "p95_ms",
+                 "p99_ms", "min_ms", "max_ms", "units_per_s"}
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """Rows of (name, baseline p50, current p50, ratio, status) for cases in both runs."""
+    previous = {r["name"]: r for r in baseline["results"] if "skipped" not in r}
+    rows = []
+    for r in results:
+        old = previous.get(r["name"])
+        if old is None or "skipped" in r:
+            continue
+        ratio = r["p50_ms"] / old["p50_ms"] if old["p50_ms"] > 0 else float("inf")
+        status = "REGRESSION" if ratio > 1 + threshold else "faster" if ratio < 1 - threshold else "ok"
+        rows.append((r["name"], old["p50_ms"], r["p50_ms"], ratio, status))
+    return rows
+
+
+def _print_row(r: dict):
+    if "skipped" in r:
+        print(f"{r['name']:<34} skipped: {r['skipped']}", flush=True)
+        return
+    throughput = f"{r['units_per_s']:,.1f} {r['unit']}/s"
+    extra = "  ".join(f"{k}={r[k]}" for k in r if k not in RESULT_FIELDS)
+    print(f"{r['name']:<34} {r['iters']:>7} {r['p50_ms']:>10.4f} {r['p95_ms']:>10.4f} "
+          f"{r['p99_ms']:>10.4f} {throughput:>24}  {extra}".rstrip(), flush=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark the analysis pipeline")
+    parser.add_argument("--stage", help="comma separated stages to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="skip the largest inputs")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds to spend per case")
+    parser.add_argument("--save", type=Path, help="write results to this JSON baseline file")
+    parser.add_argument("--compare", type=Path, help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="p50 slowdown flagged as a regression")
+    args = parser.parse_args(argv)
+
+    # The services log every call at INFO
+    logging.basicConfig(level=logging.WARNING)
+    stages = set(args.stage.split(",")) if args.stage else None
+    selected = [c for c in cases(args.quick) if stages is None or c.stage in stages]
+    if not selected:
+        parser.error(f"no cases for stage(s) {args.stage}")
+
+    print(f"{'case':<34} {'iters':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'throughput':>24}")
+    results = []
+    for case in selected:
+        results.append(run_case(case, args.min_time))
+        _print_row(results[-1])
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps({"environment": environment(), "results": results}, indent=2))
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        env = baseline.get("environment", {})
+        print(f"\nAgainst {args.compare} (commit {env.get('commit')}, {env.get('time')}):")
+        rows = compare(results, baseline, args.threshold)
+        for name, old, new, ratio, status in rows:
+            print(f"{name:<34} {old:>10.4f} -> {new:>10.4f} ms  {ratio:>6.2f}x  {status}")
+        regressions = [row for row in rows if row[4] == "REGRESSION"]
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Benchmark inputs built from the repo itself: no real patient data.
+
+Text reports are utils/sample_reports/sample1.txt padded to a target size
+and sample2.txt, the same values as a numbered results table;
+images and PDFs are rendered locally with PIL (image PDFs) or written by
+hand (a text PDF PyPDF2 can read).
+"""
+import io
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+SAMPLE_REPORT = ROOT / "utils" / "sample_reports" / "sample1.txt"
+# The same values laid out as a numbered, indented results table
+TABLE_REPORT = ROOT / "utils" / "sample_reports" / "sample2.txt"
+
+# Lines found around the values in real reports; they match no parameter
+FILLER_LINES = [
+    "Patient Name: Test Patient",
+    "Sample Collected: 01/01/2024 08:30",
+    "Referred By: Dr. Example",
+    "Remarks: Fasting sample",
+    "Method: Automated analyzer",
+    "Reference interval as per lab standards",
+]
+
+
+def sample_text() -> str:
+    return SAMPLE_REPORT.read_text()
+
+
+def table_text() -> str:
+    return TABLE_REPORT.read_text()
+
+
+def report_text(size: int = 0) -> str:
+    """sample1.txt followed by filler lines until the text is at least `size` characters."""
+    text = sample_text()
+    if len(text) >= size:
+        return text
+    lines = [text.rstrip("\n")]
+    length = len(text)
+    i = 0
+    while length < size:
+        line = f"{FILLER_LINES[i % len(FILLER_LINES)]} ({i})"
+        lines.append(line)
+        length += len(line) + 1
+        i += 1
+    return "\n".join(lines) + "\n"
+
+
+def render_report_image(text: str = None, width: int = 1240, font_size: int = None, skew: float = 0.0,
+                        paper: int = 255):
+    """
+    Black-on-`paper` PIL image of `text`, one line per text line, like a scanned A4 page.
+
+    The font scales with the width (about 11pt at any DPI); `skew` rotates
+    the page by that many degrees, as a crooked scan would be.
+    """
+    from PIL import Image, ImageDraw, ImageFont
+    text = text if text is not None else sample_text()
+    font_size = font_size or width // 44
+    lines = text.splitlines() or [""]
+    line_height = int(font_size * 1.6)
+    margin = width // 12
+    height = max(int(width * 1.414), 2 * margin + line_height * len(lines))
+    img = Image.new("RGB", (width, height), (paper, paper, paper))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=font_size)
+    for i, line in enumerate(lines):
+        draw.text((margin, margin + i * line_height), line, fill="black", font=font)
+    if skew:
+        img = img.rotate(skew, resample=Image.Resampling.BICUBIC, fillcolor=(paper, paper, paper))
+    return img
+
+
+def image_bytes(img, fmt: str = "PNG") -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def image_pdf(images: list, resolution: float = 150.0) -> bytes:
+    """A scanned-style PDF: one image per page, no text layer."""
+    buf = io.BytesIO()
+    first, rest = images[0], images[1:]
+    first.save(buf, format="PDF", save_all=True, append_images=rest, resolution=resolution)
+    return buf.getvalue()
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def text_pdf(text: str = None, pages: int = 1) -> bytes:
+    """A minimal PDF with `text` as real text (Helvetica) on each of `pages` pages."""
+    text = text if text is not None else sample_text()
+    lines = text.splitlines()
+    stream = "BT /F1 12 Tf 72 770 Td 16 TL\n" + "".join(f"({_pdf_escape(l)}) '\n" for l in lines) + "ET"
+    stream = stream.encode("latin-1", "replace")
+
+    # Object numbers: 1 catalog, 2 page tree, 3 font, then a page and its content stream per page
+    page_ids = [4 + 2 * i for i in range(pages)]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % p for p in page_ids)
+           + b"] /Count %d >>" % pages,
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for page_id in page_ids:
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (page_id + 1))
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = {}
+    for num in sorted(objects):
+        offsets[num] = out.tell()
+        out.write(b"%d 0 obj\n" % num + objects[num] + b"\nendobj\n")
+    xref = out.tell()
+    count = max(objects) + 1
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % count)
+    for num in range(1, count):
+        out.write(b"%010d 00000 n \n" % offsets[num])
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref))
+    return out.getvalue()
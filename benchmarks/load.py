@@ -0,0 +1,300 @@
+"""
+Load test the API end to end: concurrent uploads and /analyze calls.
+
+    python -m benchmarks.load                                  # in-process app, fake OCR, 10 s
+    python -m benchmarks.load --concurrency 32 --mix image=2,scanned_pdf=1,analyze=8
+    python -m benchmarks.load --rate 20 --duration 30          # open loop: 20 requests/s whatever the latency
+    python -m benchmarks.load --ocr real                       # real Tesseract/poppler (must be installed)
+    python -m benchmarks.load --url http://127.0.0.1:8000      # a running server
+
+Request kinds are image uploads, text PDFs (read by PyPDF2), scanned PDFs
+(rasterized and OCR'd) and /analyze calls, drawn at random in proportion
+to --mix. Every upload is made unique so it misses the OCR cache, unless
+--cache-hits is given. Prints throughput, goodput (2xx per second), error
+and shed (429/503) rates, and p50/p95/p99 latency of successful requests
+per kind.
+
+In-process runs serve backend.api.main:app through httpx's ASGI
+transport, with OCR on the app's real worker pool. --ocr fake (the
+default) selects OCR_BACKEND=fake: each image or page takes
+--ocr-latency ms and returns canned text, so neither Tesseract nor
+poppler is needed. Server settings (OCR_WORKERS, ADMISSION_CAPACITY, ...)
+are read from the environment as usual. Against --url, start the server
+with OCR_BACKEND=fake yourself if wanted.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from . import fixtures
+
+KINDS = ("image", "text_pdf", "scanned_pdf", "analyze")
+DEFAULT_MIX = "image=3,text_pdf=2,scanned_pdf=1,analyze=4"
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(value: str) -> dict:
+    """{"image": 3, ...} from "image=3,analyze=1"; raises ValueError for unknown kinds or bad weights."""
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError(f"unknown request kind {kind!r}; choose from {', '.join(KINDS)}")
+        mix[kind] = float(weight) if weight else 1.0
+        if mix[kind] < 0:
+            raise ValueError(f"negative weight for {kind}")
+    if not any(mix.values()):
+        raise ValueError("the mix has no positive weight")
+    return mix
+
+
+def build_payloads(pages: int) -> dict:
+    """Request bodies per kind: (filename, bytes, content type) for uploads, a values dict for /analyze."""
+    img = fixtures.render_report_image(width=1240)
+    return {
+        "image": ("report.png", fixtures.image_bytes(img), "image/png"),
+        "text_pdf": ("report.pdf", fixtures.text_pdf(pages=pages), "application/pdf"),
+        "scanned_pdf": ("scan.pdf", fixtures.image_pdf([img] * pages), "application/pdf"),
+        "analyze": {"Hemoglobin": 9.8, "WBC": 7800, "Platelets": 220000, "Creatinine": 1.5, "SGPT": 65,
+                    "SGOT": 58, "Bilirubin": 1.1},
+    }
+
+
+def unique(data: bytes, kind: str, n: int) -> bytes:
+    """A copy of an upload with different bytes (so a different digest) but the same content."""
+    if kind == "image":
+        # Decoders stop at the PNG IEND chunk
+        return data + b"load-%d" % n
+    # A comment after %%EOF
+    return data + b"%% load %d\n" % n
+
+
+def percentile(sorted_values: list, p: float):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+class LoadTest:
+    """Sends requests of the kinds in `mix` and records (kind, status, start, latency) for each."""
+
+    def __init__(self, client, mix: dict, payloads: dict, cache_hits: bool = False):
+        self.client = client
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.payloads = payloads
+        self.cache_hits = cache_hits
+        self.records = []
+        self._sent = 0
+        self._rng = random.Random(0)
+
+    async def request(self, kind: str):
+        self._sent += 1
+        start = time.perf_counter()
+        try:
+            if kind == "analyze":
+                r = await self.client.post("/analyze", json=self.payloads["analyze"])
+            else:
+                name, data, mime = self.payloads[kind]
+                if not self.cache_hits:
+                    data = unique(data, kind, self._sent)
+                r = await self.client.post("/upload-report", files={"file": (name, data, mime)})
+            status = r.status_code
+        except Exception as e:
+            status = type(e).__name__
+        self.records.append((kind, status, start, time.perf_counter() - start))
+
+    def next_kind(self) -> str:
+        return self._rng.choices(self.kinds, self.weights)[0]
+
+    async def closed_loop(self, concurrency: int, deadline: float):
+        """`concurrency` clients, each sending its next request as soon as the last one is answered."""
+        async def client():
+            while time.perf_counter() < deadline:
+                await self.request(self.next_kind())
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    async def open_loop(self, rate: float, deadline: float, max_outstanding: int):
+        """Poisson arrivals at `rate` per second, regardless of how fast the server answers."""
+        tasks = set()
+        dropped = 0
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(self._rng.expovariate(rate))
+            if len(tasks) >= max_outstanding:
+                # The client itself is the bottleneck; count it rather than queue without bound
+                dropped += 1
+                continue
+            task = asyncio.ensure_future(self.request(self.next_kind()))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        return dropped
+
+
+def summarize(records: list, since: float, seconds: float) -> dict:
+    """Per-kind and overall figures for requests started at or after `since` (after warm-up)."""
+    rows = {}
+    measured = [r for r in records if r[2] >= since]
+    for kind in [k for k in KINDS if any(r[0] == k for r in measured)] + ["all"]:
+        rs = [r for r in measured if kind == "all" or r[0] == kind]
+        ok = sorted(r[3] for r in rs if isinstance(r[1], int) and 200 <= r[1] < 300)
+        shed = sum(1 for r in rs if r[1] in (429, 503))
+        statuses = {}
+        for r in rs:
+            statuses[str(r[1])] = statuses.get(str(r[1]), 0) + 1
+        rows[kind] = {
+            "requests": len(rs),
+            "ok": len(ok),
+            "shed": shed,
+            "errors": len(rs) - len(ok) - shed,
+            "error_rate": round((len(rs) - len(ok)) / len(rs), 4) if rs else 0.0,
+            "throughput": round(len(rs) / seconds, 2),
+            "goodput": round(len(ok) / seconds, 2),
+            **{f"p{p}_ms": round(percentile(ok, p) * 1000, 1) if ok else None for p in PERCENTILES},
+            "statuses": statuses,
+        }
+    return rows
+
+
+def print_table(rows: dict):
+    print(f"{'kind':<12} {'requests':>8} {'ok':>6} {'shed':>6} {'errors':>6} {'req/s':>8} {'ok/s':>8} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, r in rows.items():
+        latencies = " ".join(f"{r[f'p{p}_ms']:>9}" if r[f"p{p}_ms"] is not None else f"{'-':>9}"
+                             for p in PERCENTILES)
+        print(f"{kind:<12} {r['requests']:>8} {r['ok']:>6} {r['shed']:>6} {r['errors']:>6} "
+              f"{r['throughput']:>8} {r['goodput']:>8} {latencies}")
+    unexpected = {s: n for s, n in rows["all"]["statuses"].items() if not s.startswith("2")}
+    if unexpected:
+        print(f"non-2xx: {', '.join(f'{s} x{n}' for s, n in sorted(unexpected.items()))}")
+
+
+async def server_stats(client) -> dict:
+    """Admission, OCR pool and capability state reported by the server, where available."""
+    stats = {}
+    for name, path in (("admission", "/admission"), ("ocr_pool", "/ocr-pool"), ("health", "/health")):
+        try:
+            r = await client.get(path)
+            if r.status_code == 200:
+                stats[name] = r.json()
+        except Exception:
+            pass
+    return stats
+
+
+async def drive(args, client, mix: dict, payloads: dict) -> dict:
+    test = LoadTest(client, mix, payloads, args.cache_hits)
+    start = time.perf_counter()
+    deadline = start + args.warmup + args.duration
+    dropped = 0
+    if args.rate:
+        dropped = await test.open_loop(args.rate, deadline, args.concurrency)
+    else:
+        await test.closed_loop(args.concurrency, deadline)
+    # In-flight requests finish after the deadline; throughput is over the time actually taken
+    elapsed = time.perf_counter() - start - args.warmup
+    rows = summarize(test.records, start + args.warmup, max(elapsed, 1e-9))
+    return {"rows": rows, "seconds": round(elapsed, 2), "dropped": dropped, "server": await server_stats(client)}
+
+
+def _configure_in_process(args, cache_dir: str):
+    # Read by the services at import time, and inherited by the OCR worker processes
+    if args.ocr == "fake":
+        os.environ["OCR_BACKEND"] = "fake"
+        os.environ["OCR_FAKE_LATENCY_MS"] = str(args.ocr_latency)
+        os.environ["OCR_FAKE_MODE"] = args.ocr_mode
+    # A fresh OCR cache per run, so runs neither hit nor pollute the real one
+    os.environ["OCR_CACHE_PATH"] = os.path.join(cache_dir, "ocr_cache.sqlite3")
+
+
+async def run_in_process(args, mix: dict, payloads: dict) -> dict:
+    import httpx
+    from backend.api.main import app
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=args.timeout) as client:
+            return await drive(args, client, mix, payloads)
+
+
+async def run_remote(args, mix: dict, payloads: dict) -> dict:
+    import httpx
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        return await drive(args, client, mix, payloads)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load", description="Load test the API")
+    parser.add_argument("--url", help="base URL of a running server (default: serve the app in-process)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="concurrent clients (with --rate: most requests outstanding at once)")
+    parser.add_argument("--rate", type=float, help="open loop: requests per second, Poisson arrivals")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of load before measuring starts")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"request kinds and weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--pages", type=int, default=2, help="pages per PDF")
+    parser.add_argument("--cache-hits", action="store_true", help="send identical uploads (OCR cache hits)")
+    parser.add_argument("--ocr", choices=("fake", "real"), default="fake", help="in-process OCR backend")
+    parser.add_argument("--ocr-latency", type=float, default=200, help="fake OCR ms per image or page")
+    parser.add_argument("--ocr-mode", choices=("sleep", "cpu"), default="sleep",
+                        help="fake OCR sleeps, or keeps a core busy like Tesseract")
+    parser.add_argument("--timeout", type=float, default=60, help="client timeout per request (the frontend's)")
+    parser.add_argument("--save", type=Path, help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        parser.error("the load test needs httpx: pip install httpx")
+
+    # The services log every request at INFO
+    logging.basicConfig(level=logging.WARNING)
+    payloads = build_payloads(args.pages)
+    if args.url:
+        target = args.url
+        result = asyncio.run(run_remote(args, mix, payloads))
+    else:
+        with tempfile.TemporaryDirectory(prefix="load-test-") as cache_dir:
+            _configure_in_process(args, cache_dir)
+            if args.ocr == "real":
+                from backend.api.services import capabilities
+                needed = ["tesseract"] + (["poppler"] if mix.get("scanned_pdf") else [])
+                missing = [name for name in needed if not capabilities.has(name)]
+                if missing:
+                    parser.error(f"--ocr real needs {' and '.join(missing)}; use --ocr fake on this machine")
+            target = f"in-process, {args.ocr} OCR"
+            result = asyncio.run(run_in_process(args, mix, payloads))
+
+    load = f"{args.rate} req/s open loop" if args.rate else f"{args.concurrency} clients"
+    print(f"{target}: {load}, {result['seconds']} s measured after {args.warmup} s warm-up\n")
+    print_table(result["rows"])
+    if result["dropped"]:
+        print(f"{result['dropped']} arrivals dropped: more than --concurrency requests outstanding")
+    admission = result["server"].get("admission")
+    if admission:
+        print(f"server admission: {admission['admitted']} admitted, {admission['queued']} queued, "
+              f"{admission['rejected']} rejected, {admission['timed_out']} timed out")
+    if args.save:
+        from .suite import environment
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps({"environment": environment(), "target": target, "args": vars(args),
+                                         **result}, indent=2, default=str))
+        print(f"\nSaved results to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+"""
+Benchmark cases for every stage of the analysis pipeline, and the timing harness.
+
+Each case times one call of a pipeline function on a fixture and reports
+the latency distribution plus throughput in the case's unit (reports,
+bytes, pages, ...). Cases needing Tesseract or poppler are skipped when
+the tool is missing.
+"""
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+from . import fixtures
+
+# Mirrors ocr_service.PREPROCESS_PRESETS without importing the service at load time
+PREPROCESS_PRESETS = ("none", "gray", "binary", "binary_deskew", "fast")
+
+
+@dataclass
+class Case:
+    name: str
+    stage: str
+    # Returns the zero-argument callable to time; runs once, untimed
+    setup: Callable
+    unit: str = "calls"
+    units_per_call: float = 1
+    requires: tuple = ()
+    # Slow cases (OCR) are run fewer times
+    min_iters: int = 20
+    cleanup: list = field(default_factory=list)
+    # Case-specific facts reported next to the timings (output size, hit rate, ...)
+    extra: dict = field(default_factory=dict)
+
+
+def measure(fn, min_time: float = 1.0, min_iters: int = 20, max_iters: int = 100_000, warmup: int = 3) -> list:
+    """Per-call durations in seconds: at least `min_iters` calls and `min_time` seconds."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < max_iters and (len(times) < min_iters or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times: list, units_per_call: float = 1) -> dict:
+    times = sorted(times)
+    n = len(times)
+
+    def pct(p):
+        return times[min(n - 1, int(p / 100 * n))] * 1000
+
+    mean = statistics.fmean(times)
+    return {
+        "iters": n,
+        "mean_ms": round(mean * 1000, 4),
+        "p50_ms": round(pct(50), 4),
+        "p95_ms": round(pct(95), 4),
+        "p99_ms": round(pct(99), 4),
+        "min_ms": round(times[0] * 1000, 4),
+        "max_ms": round(times[-1] * 1000, 4),
+        "units_per_s": round(units_per_call / mean, 2) if mean > 0 else None,
+    }
+
+
+def _write_temp(data: bytes, suffix: str, case: Case) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    case.cleanup.append(path)
+    return path
+
+
+# --- pipeline stages -------------------------------------------------------
+
+def _extract_case(size: int, label: str) -> Case:
+    def setup():
+        from backend.api.services.extract_service import extract_key_values
+        text = fixtures.report_text(size)
+        case.units_per_call = len(text.encode())
+        return lambda: extract_key_values(text)
+    case = Case(f"extract_key_values[{label}]", "extract", setup, unit="bytes")
+    return case
+
+
+def _extract_table_case() -> Case:
+    def setup():
+        from backend.api.services.extract_service import extract_key_values
+        text = fixtures.table_text()
+        expected = _values()
+        found = extract_key_values(text)
+        hits = sum(1 for k, v in expected.items() if found.get(k) == v)
+        case.extra = {"hit_rate": round(hits / len(expected), 3)}
+        case.units_per_call = len(text.encode())
+        return lambda: extract_key_values(text)
+    case = Case("extract_key_values[table]", "extract", setup, unit="bytes")
+    return case
+
+
+def _values():
+    from backend.api.services.extract_service import extract_key_values
+    return extract_key_values(fixtures.sample_text())
+
+
+def _compare_setup(sex=None, age=None, compact=False):
+    def setup():
+        from backend.api.services.ml_service import compare_with_ranges
+        values = _values()
+        return lambda: compare_with_ranges(values, sex=sex, age=age, compact=compact)
+    return setup
+
+
+def _predict_risk_case() -> Case:
+    def setup():
+        from backend.api.services import ml_service
+        # Results are only comparable between runs on the same path
+        path = ml_service.model_info()["format"] if ml_service.load_model() is not None else "rules"
+        case.name = f"predict_risk[{path}]"
+        values = _values()
+        return lambda: ml_service.predict_risk(values)
+    case = Case("predict_risk", "predict_risk", setup)
+    return case
+
+
+def _predict_diseases_setup(compact=False):
+    def setup():
+        from backend.api.services.disease_service import predict_diseases
+        values = _values()
+        return lambda: predict_diseases(values, compact=compact)
+    return setup
+
+
+def _encode_case(media_type: str, compact: bool) -> Case:
+    """Serializing one /analyze response; reports the body size."""
+    def setup():
+        from backend.api.services import analysis_service, encoding
+        result = analysis_service.analyze(_values(), compact=compact)
+        encode = encoding.ENCODERS[media_type]
+        case.extra = {"bytes": len(encode(result))}
+        return lambda: encode(result)
+    fmt = media_type.rsplit("/", 1)[-1]
+    case = Case(f"encode[{fmt},{'compact' if compact else 'full'}]", "encode", setup,
+                requires=("msgpack",) if fmt == "msgpack" else ())
+    return case
+
+
+def _batch_case(n: int) -> Case:
+    def setup():
+        import numpy as np
+        from backend.api.services.batch_service import analyze_batch
+        base = _values()
+        rng = np.random.default_rng(0)
+        # Vary values around the sample so rows take different branches
+        reports = [{k: round(v * scale, 2) for k, v in base.items()} for scale in rng.uniform(0.5, 1.5, n)]
+        return lambda: sum(1 for _ in analyze_batch(reports=reports))
+    return Case(f"analyze_batch[{n}]", "analyze_batch", setup, unit="reports", units_per_call=n, min_iters=5)
+
+
+def _history_case(reports: int) -> Case:
+    """Trend query for a patient with `reports` stored reports; should not grow with history."""
+    def setup():
+        from datetime import date
+        from backend.api.services.history_service import PatientHistory
+        history = PatientHistory(":memory:")
+        base = _values()
+        start = date(2000, 1, 1).toordinal()
+        for i in range(reports):
+            values = {k: v * (1 + i % 5 / 100) for k, v in base.items()}
+            history.add_report("bench", date.fromordinal(start + 7 * i), values)
+        return lambda: history.trends("bench")
+    return Case(f"history_trends[{reports}]", "history", setup, min_iters=50)
+
+
+def _pdf_text_case(pages: int, early_exit: bool = False) -> Case:
+    def setup():
+        from backend.api.services.extract_service import StreamingExtractor
+        from backend.api.services.ml_service import RANGES
+        from backend.api.services.ocr_service import image_to_text
+        path = _write_temp(fixtures.text_pdf(pages=pages), ".pdf", case)
+        if not early_exit:
+            return lambda: image_to_text(path)
+        # Every page repeats the full sample, so reading stops after page 1
+        params = RANGES.get().params
+        return lambda: image_to_text(path, None, StreamingExtractor(params))
+    label = f"{pages}p,early" if early_exit else f"{pages}p"
+    case = Case(f"pdf_text[{label}]", "pdf_text", setup, unit="pages", units_per_call=pages)
+    return case
+
+
+def _preprocess_case(width: int) -> Case:
+    def setup():
+        import io
+        from backend.api.services.ocr_service import get_pil_image, optimize_image
+        data = fixtures.image_bytes(fixtures.render_report_image(width=width))
+        Image = get_pil_image()
+        return lambda: optimize_image(Image.open(io.BytesIO(data)).convert("RGB"))
+    return Case(f"decode_optimize[{width}px]", "preprocess", setup, unit="images")
+
+
+def _decode_case(fmt: str, megapixels: int) -> Case:
+    """The image upload path of image_to_text, on a 4:3 "phone photo" of the sample report."""
+    def setup():
+        import io
+        from backend.api.services.ocr_service import decode_image, open_image, preprocess_image
+        width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+        img = fixtures.render_report_image(width=width).crop((0, 0, width, width * 3 // 4))
+        data = fixtures.image_bytes(img, fmt.upper())
+        decoded = decode_image(open_image(io.BytesIO(data)))
+        case.extra = {"pixels_in": img.width * img.height, "pixels_decoded": decoded.width * decoded.height}
+        return lambda: preprocess_image(decode_image(open_image(io.BytesIO(data))))
+    case = Case(f"decode[{fmt},{megapixels}MP]", "preprocess", setup, unit="images", min_iters=3)
+    return case
+
+
+def _ocr_image_case(width: int) -> Case:
+    def setup():
+        from backend.api.services.ocr_service import image_to_text
+        path = _write_temp(fixtures.image_bytes(fixtures.render_report_image(width=width)), ".png", case)
+        return lambda: image_to_text(path)
+    case = Case(f"ocr_image[{width}px]", "ocr_image", setup, unit="images",
+                requires=("tesseract",), min_iters=3)
+    return case
+
+
+def _ocr_pdf_case(pages: int) -> Case:
+    def setup():
+        from backend.api.services.ocr_service import image_to_text
+        images = [fixtures.render_report_image() for _ in range(pages)]
+        path = _write_temp(fixtures.image_pdf(images), ".pdf", case)
+        return lambda: image_to_text(path)
+    case = Case(f"ocr_pdf[{pages}p]", "ocr_pdf", setup, unit="pages", units_per_call=pages,
+                requires=("tesseract", "poppler"), min_iters=3)
+    return case
+
+
+def _scan(width: int = 2480):
+    """A 300 DPI A4 "scan" of the sample report: gray paper, slightly crooked."""
+    return fixtures.render_report_image(width=width, skew=1.5, paper=235)
+
+
+def _preset_case(preset: str) -> Case:
+    def setup():
+        from backend.api.services.ocr_service import preprocess_image
+        img = _scan()
+        out = preprocess_image(img, preset)
+        case.extra = {"mode": out.mode, "pixels_in": img.width * img.height, "pixels_out": out.width * out.height}
+        return lambda: preprocess_image(img, preset)
+    case = Case(f"preprocess[{preset}]", "preprocess", setup, unit="pages", min_iters=5)
+    return case
+
+
+def _ocr_preset_case(preset: str) -> Case:
+    def setup():
+        from backend.api.services.extract_service import extract_key_values
+        from backend.api.services.ocr_service import ocr_image, preprocess_image
+        img = _scan()
+        expected = _values()
+        found = extract_key_values(ocr_image(preprocess_image(img, preset)))
+        hits = sum(1 for k, v in expected.items() if found.get(k) == v)
+        case.extra = {"hit_rate": round(hits / len(expected), 3)}
+        return lambda: ocr_image(preprocess_image(img, preset))
+    case = Case(f"ocr_preset[{preset}]", "ocr_preset", setup, unit="pages",
+                requires=("tesseract",), min_iters=3)
+    return case
+
+
+def _ocr_backend_case(kind: str, images: int = 4) -> Case:
+    def setup():
+        from backend.api.services.ocr_backend import make_backend
+        from backend.api.services.ocr_service import TESSERACT_CONFIG, preprocess_image
+        backend = make_backend(kind, TESSERACT_CONFIG)
+        pages = [preprocess_image(_scan()) for _ in range(images)]
+        return lambda: backend.ocr_many(pages)
+    return Case(f"ocr_backend[{kind},{images}img]", "ocr_backend", setup, unit="images",
+                units_per_call=images, requires=("tesseract",), min_iters=3)
+
+
+def cases(quick: bool = False) -> list:
+    """All benchmark cases; `quick` drops the largest inputs."""
+    extract_sizes = [(0, "sample"), (10_000, "10KB"), (100_000, "100KB")]
+    if not quick:
+        extract_sizes.append((1_000_000, "1MB"))
+    return [
+        *[_extract_case(size, label) for size, label in extract_sizes],
+        _extract_table_case(),
+        Case("compare_with_ranges", "compare", _compare_setup()),
+        Case("compare_with_ranges[female,age]", "compare", _compare_setup(sex="female", age=40)),
+        _predict_risk_case(),
+        Case("compare_with_ranges[compact]", "compare", _compare_setup(compact=True)),
+        Case("predict_diseases", "predict_diseases", _predict_diseases_setup()),
+        Case("predict_diseases[compact]", "predict_diseases", _predict_diseases_setup(compact=True)),
+        *[_encode_case(m, compact) for m in ("application/json", "application/msgpack") for compact in (False, True)],
+        _batch_case(100),
+        *([] if quick else [_batch_case(5000)]),
+        _history_case(10),
+        _history_case(1000),
+        _pdf_text_case(1),
+        _pdf_text_case(3),
+        _pdf_text_case(10),
+        _pdf_text_case(10, early_exit=True),
+        _preprocess_case(1240),
+        *([] if quick else [_preprocess_case(2480)]),
+        _decode_case("jpeg", 12),
+        *([] if quick else [_decode_case("jpeg", 48)]),
+        _decode_case("png", 12),
+        *[_preset_case(p) for p in PREPROCESS_PRESETS],
+        _ocr_image_case(1240),
+        *[_ocr_preset_case(p) for p in PREPROCESS_PRESETS],
+        _ocr_backend_case("pytesseract"),
+        _ocr_backend_case("batch"),
+        _ocr_pdf_case(1),
+        *([] if quick else [_ocr_pdf_case(3)]),
+    ]
+
+
+def run_case(case: Case, min_time: float = 1.0) -> dict:
+    from backend.api.services import capabilities
+    missing = [r for r in case.requires if not capabilities.has(r)]
+    if missing:
+        return {"name": case.name, "stage": case.stage, "skipped": f"{', '.join(missing)} not available"}
+    try:
+        fn = case.setup()
+        times = measure(fn, min_time=min_time, min_iters=case.min_iters)
+    finally:
+        for path in case.cleanup:
+            os.unlink(path)
+        case.cleanup.clear()
+    return {"name": case.name, "stage": case.stage, "unit": case.unit,
+            "units_per_call": case.units_per_call, **summarize(times, case.units_per_call), **case.extra}
+
+
+def environment() -> dict:
+    """Where a result was measured; baselines are only comparable on the same machine."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=fixtures.ROOT, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
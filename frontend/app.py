@@ -1,7 +1,10 @@
 import streamlit as st
 import requests, json
+from requests.adapters import HTTPAdapter
 from PIL import Image
+import hashlib
 import io
+import re
 
 st.set_page_config(page_title="Blood Report Analyzer", layout="wide")
 st.title("AI Blood Report Analyzer — Advanced ML Version")
@@ -12,120 +15,198 @@ try:
 except:
     API_URL = "http://127.0.0.1:8000"
 
+# Longest side of the upload preview, in pixels
+PREVIEW_SIZE = 800
+# Seconds cached OCR results and analyses are reused; analyses expire sooner
+# so a model, range or rule reload on the backend shows up within minutes
+OCR_CACHE_TTL = 3600
+ANALYZE_CACHE_TTL = 300
+# Header the backend puts on a PDF page that failed to OCR (ocr_service.PAGE_ERROR_RE)
+PAGE_ERROR_RE = re.compile(r"^--- Page \d+ \(Error\) ---$", re.MULTILINE)
+
+
+class BackendError(Exception):
+    """Non-200 answer from the backend; raised so failures are never cached."""
+
+
+@st.cache_resource
+def get_session():
+    """One pooled HTTP session per server process, reused across reruns and users."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def file_digest(uploaded) -> str:
+    """sha256 of an upload, computed once per uploaded file and kept in session state."""
+    digests = st.session_state.setdefault("file_digests", {})
+    file_id = getattr(uploaded, "file_id", None) or (uploaded.name, uploaded.size)
+    if file_id not in digests:
+        digests[file_id] = hashlib.sha256(uploaded.getvalue()).hexdigest()
+    return digests[file_id]
+
+
+# Keyed by content hash only: the leading underscore keeps Streamlit from hashing the bytes
+@st.cache_data(show_spinner=False, max_entries=32, ttl=OCR_CACHE_TTL)
+def run_ocr(digest: str, name: str, mime: str, _data: bytes) -> dict:
+    """
+    OCR + extraction of one file; rerunning the script with the same file costs nothing.
+
+    Only complete results are cached, as on the backend: OCR errors and
+    PDFs with failed pages raise BackendError, so the next run retries.
+    """
+    r = get_session().post(f"{API_URL}/upload-report", files={"file": (name, _data, mime)}, timeout=60)
+    if r.status_code == 503 and "Retry-After" in r.headers:
+        # Shed by the backend's admission control: nothing was processed
+        raise BackendError(f"The server is busy with other reports, please try again in {r.headers['Retry-After']} s")
+    if r.status_code != 200:
+        raise BackendError("Backend error: " + str(r.status_code))
+    data = r.json()
+    text = data.get("text", "")
+    if text.startswith("Error"):
+        raise BackendError(text)
+    if PAGE_ERROR_RE.search(text):
+        raise BackendError("Some pages of the report could not be read, please try again")
+    return data
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def make_preview(digest: str, _data: bytes):
+    """Downscaled preview as JPEG bytes, decoded once per file; None for non-images (PDFs)."""
+    try:
+        img = Image.open(io.BytesIO(_data))
+        # JPEGs are decoded straight at a fraction of their size
+        img.draft("RGB", (PREVIEW_SIZE, PREVIEW_SIZE))
+        img.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+        buf = io.BytesIO()
+        img.convert("RGB").save(buf, format="JPEG", quality=85)
+        return buf.getvalue()
+    except Exception:
+        return None
+
+
+@st.cache_data(show_spinner=False, max_entries=256, ttl=ANALYZE_CACHE_TTL)
+def run_analyze(payload_json: str) -> dict:
+    r = get_session().post(f"{API_URL}/analyze", data=payload_json,
+                           headers={"Content-Type": "application/json"}, timeout=30)
+    if r.status_code != 200:
+        raise BackendError("Backend error: " + str(r.status_code))
+    return r.json()
+
+
 st.sidebar.header("Upload")
 uploaded = st.sidebar.file_uploader("Upload blood report (image/pdf page)", type=['png','jpg','jpeg','pdf'])
 if uploaded:
-    bytes_data = uploaded.read()
-    
     # Validate file size
-    if len(bytes_data) == 0:
+    if uploaded.size == 0:
         st.error("Error: Uploaded file is empty")
-    elif len(bytes_data) > 50 * 1024 * 1024:  # 50MB limit
+    elif uploaded.size > 50 * 1024 * 1024:  # 50MB limit
         st.error("Error: File size exceeds 50MB limit")
     else:
-        try:
-            img = Image.open(io.BytesIO(bytes_data))
-            st.image(img, caption="Uploaded report preview", use_column_width=True)
-        except Exception:
+        bytes_data = uploaded.getvalue()
+        digest = file_digest(uploaded)
+        preview = make_preview(digest, bytes_data)
+        if preview is not None:
+            st.image(preview, caption="Uploaded report preview", use_column_width=True)
+        else:
             st.warning("Preview not available for this file type.")
         
         with st.spinner("Sending to OCR..."):
-            files = {"file": (uploaded.name, bytes_data, uploaded.type)}
             try:
-                r = requests.post(f"{API_URL}/upload-report", files=files, timeout=60)
-                if r.status_code==200:
-                    data = r.json()
-                    st.subheader("OCR Extracted Text")
-                    st.text_area("Raw OCR", data.get("text",""), height=200)
-                    values = data.get("values",{})
-                    st.subheader("Detected Parameters (editable)")
-                    edited = {}
-                    cols = st.columns(3)
-                    i=0
-                    for k,v in values.items():
-                        with cols[i%3]:
-                            edited[k] = st.text_input(k, value=str(v))
-                        i+=1
-                    if st.button("Analyze"):
-                        payload = {}
-                        for k,val in edited.items():
-                            try:
-                                payload[k] = float(val)
-                            except:
-                                pass
-                        r2 = requests.post(f"{API_URL}/analyze", json=payload, timeout=30)
-                        res = r2.json()
-                        st.subheader("Parameter Comparison")
-                        # Display comparison results in a formatted table
-                        comparison = res.get("comparison", {})
-                        if comparison:
-                            comp_data = []
-                            for param, info in comparison.items():
-                                comp_data.append({
-                                    "Parameter": param,
-                                    "Value": info.get("value"),
-                                    "Unit": info.get("unit", ""),
-                                    "Status": info.get("status"),
-                                    "Normal Range": f"{info.get('normal_range', ['N/A', 'N/A'])[0]}-{info.get('normal_range', ['N/A', 'N/A'])[1]}"
-                                })
-                            import pandas as pd
-                            st.dataframe(pd.DataFrame(comp_data), use_container_width=True)
-                        st.subheader("Prediction & Risk Assessment")
-                        prediction = res.get("prediction", {})
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.write("**Identified Risks:**")
-                            risks = prediction.get("risks", [])
-                            if risks:
-                                for risk in risks:
-                                    st.write(f"• {risk}")
-                            else:
-                                st.write("No risks identified")
-                        with col2:
-                            overall_risk = prediction.get("overall_risk", "Unknown")
-                            risk_color = "🟢" if overall_risk == "Low" else "🟡" if overall_risk == "Medium" else "🔴"
-                            st.metric("Overall Risk Level", f"{risk_color} {overall_risk}")
-                        
-                        # Display Disease Predictions
-                        st.subheader("🏥 Possible Diseases")
-                        diseases_result = res.get("diseases", {})
-                        summary = diseases_result.get("summary", "")
-                        
-                        if summary:
-                            st.info(summary)
-                        
-                        possible_diseases = diseases_result.get("possible_diseases", {})
-                        
-                        if possible_diseases:
-                            for disease_name, disease_data in possible_diseases.items():
-                                with st.expander(f"{disease_name} - {disease_data.get('risk_level', 'Unknown')} ({disease_data.get('confidence', 0)}% confidence)"):
-                                    col1, col2 = st.columns([1, 1])
-                                    
-                                    with col1:
-                                        st.write(f"**Description:** {disease_data.get('description', 'N/A')}")
-                                        st.write(f"**Recommendation:** {disease_data.get('recommendation', 'N/A')}")
-                                    
-                                    with col2:
-                                        confidence = disease_data.get('confidence', 0)
-                                        st.progress(int(confidence) / 100)
-                                        st.metric("Confidence", f"{confidence}%")
-                                    
-                                    st.write("**Matched Indicators:**")
-                                    indicators = disease_data.get('matched_indicators', [])
-                                    if indicators:
-                                        for ind in indicators:
-                                            st.write(f"• {ind['parameter']}: {ind['value']} (threshold: {ind['condition']})")
-                                    else:
-                                        st.write("No specific indicators matched")
-                                    
-                                    st.write("**Associated Symptoms:**")
-                                    symptoms = disease_data.get('symptoms', [])
-                                    if symptoms:
-                                        st.write(", ".join(symptoms))
+                data = run_ocr(digest, uploaded.name, uploaded.type, bytes_data)
+                st.subheader("OCR Extracted Text")
+                st.text_area("Raw OCR", data.get("text",""), height=200)
+                values = data.get("values",{})
+                st.subheader("Detected Parameters (editable)")
+                edited = {}
+                cols = st.columns(3)
+                i=0
+                for k,v in values.items():
+                    with cols[i%3]:
+                        # Keyed per file so a new upload starts from its own values
+                        edited[k] = st.text_input(k, value=str(v), key=f"{digest[:16]}:{k}")
+                    i+=1
+                if st.button("Analyze"):
+                    payload = {}
+                    for k,val in edited.items():
+                        try:
+                            payload[k] = float(val)
+                        except:
+                            pass
+                    res = run_analyze(json.dumps(payload, sort_keys=True))
+                    st.subheader("Parameter Comparison")
+                    # Display comparison results in a formatted table
+                    comparison = res.get("comparison", {})
+                    if comparison:
+                        comp_data = []
+                        for param, info in comparison.items():
+                            comp_data.append({
+                                "Parameter": param,
+                                "Value": info.get("value"),
+                                "Unit": info.get("unit", ""),
+                                "Status": info.get("status"),
+                                "Normal Range": f"{info.get('normal_range', ['N/A', 'N/A'])[0]}-{info.get('normal_range', ['N/A', 'N/A'])[1]}"
+                            })
+                        import pandas as pd
+                        st.dataframe(pd.DataFrame(comp_data), use_container_width=True)
+                    st.subheader("Prediction & Risk Assessment")
+                    prediction = res.get("prediction", {})
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.write("**Identified Risks:**")
+                        risks = prediction.get("risks", [])
+                        if risks:
+                            for risk in risks:
+                                st.write(f"• {risk}")
                         else:
-                            st.success("✅ No significant diseases detected. Regular monitoring recommended.")
-                else:
-                    st.error("Backend error: "+str(r.status_code))
+                            st.write("No risks identified")
+                    with col2:
+                        overall_risk = prediction.get("overall_risk", "Unknown")
+                        risk_color = "🟢" if overall_risk == "Low" else "🟡" if overall_risk == "Medium" else "🔴"
+                        st.metric("Overall Risk Level", f"{risk_color} {overall_risk}")
+                    
+                    # Display Disease Predictions
+                    st.subheader("🏥 Possible Diseases")
+                    diseases_result = res.get("diseases", {})
+                    summary = diseases_result.get("summary", "")
+                    
+                    if summary:
+                        st.info(summary)
+                    
+                    possible_diseases = diseases_result.get("possible_diseases", {})
+                    
+                    if possible_diseases:
+                        for disease_name, disease_data in possible_diseases.items():
+                            with st.expander(f"{disease_name} - {disease_data.get('risk_level', 'Unknown')} ({disease_data.get('confidence', 0)}% confidence)"):
+                                col1, col2 = st.columns([1, 1])
+                                
+                                with col1:
+                                    st.write(f"**Description:** {disease_data.get('description', 'N/A')}")
+                                    st.write(f"**Recommendation:** {disease_data.get('recommendation', 'N/A')}")
+                                
+                                with col2:
+                                    confidence = disease_data.get('confidence', 0)
+                                    st.progress(int(confidence) / 100)
+                                    st.metric("Confidence", f"{confidence}%")
+                                
+                                st.write("**Matched Indicators:**")
+                                indicators = disease_data.get('matched_indicators', [])
+                                if indicators:
+                                    for ind in indicators:
+                                        st.write(f"• {ind['parameter']}: {ind['value']} (threshold: {ind['condition']})")
+                                else:
+                                    st.write("No specific indicators matched")
+                                
+                                st.write("**Associated Symptoms:**")
+                                symptoms = disease_data.get('symptoms', [])
+                                if symptoms:
+                                    st.write(", ".join(symptoms))
+                    else:
+                        st.success("✅ No significant diseases detected. Regular monitoring recommended.")
+            except BackendError as e:
+                st.error(str(e))
             except Exception as e:
                 st.error("Request failed: "+str(e))
 
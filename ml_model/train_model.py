@@ -1,41 +1,247 @@
-import pandas as pd, random, joblib
+"""
+Generate the synthetic training set and train the risk model.
+
+    python ml_model/train_model.py                      # 900 rows, train, export
+    python ml_model/train_model.py --rows 5000000       # bigger dataset
+    python ml_model/train_model.py --sweep --trees 25,50,100,200 --depths 8,12,none
+
+Rows are drawn with a seeded NumPy generator, a whole class at a time, and
+written column by column (one .npy per column, or Parquet when pyarrow is
+installed). --sweep trains a grid of forest sizes/depths and reports
+accuracy, model size and single-row/batch inference latency of the compact
+forest the API serves, instead of saving a model.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
 from pathlib import Path
+import numpy as np
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from backend.api.services.forest import CompactForest, export_forest
+
 OUT = Path(__file__).parent / "data"
-OUT.mkdir(parents=True, exist_ok=True)
-csv_path = OUT / "synthetic_data.csv"
-headers = ["Hemoglobin","WBC","Platelets","Creatinine","SGPT","SGOT","Bilirubin","Label"]
-
-def gen_row(normal=True):
-    if normal:
-        return [round(random.uniform(13,15),1), int(random.uniform(4500,8000)), int(random.uniform(200000,350000)), round(random.uniform(0.7,1.1),2), int(random.uniform(15,35)), int(random.uniform(15,35)), round(random.uniform(0.3,0.9),1), "Normal"]
-    case = random.choice(["Anemia","Kidney","Liver"])
-    if case=="Anemia":
-        return [round(random.uniform(6,10.5),1), int(random.uniform(4500,9000)), int(random.uniform(150000,300000)), round(random.uniform(0.7,1.2),2), int(random.uniform(15,40)), int(random.uniform(15,40)), round(random.uniform(0.3,1.0),1), "Anemia_Risk"]
-    if case=="Kidney":
-        return [round(random.uniform(11.5,14.5),1), int(random.uniform(4500,9000)), int(random.uniform(150000,300000)), round(random.uniform(1.4,3.5),2), int(random.uniform(15,40)), int(random.uniform(15,40)), round(random.uniform(0.3,1.5),1), "Kidney_Risk"]
-    return [round(random.uniform(11.5,14.5),1), int(random.uniform(4500,9000)), int(random.uniform(150000,300000)), round(random.uniform(0.7,1.2),2), int(random.uniform(80,200)), int(random.uniform(80,200)), round(random.uniform(0.3,3.0),1), "Liver_Risk"]
-
-rows=[]
-for _ in range(600):
-    rows.append(gen_row(normal=True))
-for _ in range(300):
-    rows.append(gen_row(normal=False))
-
-df = pd.DataFrame(rows, columns=headers)
-df.to_csv(csv_path, index=False)
-print("Saved synthetic dataset to", csv_path)
-
-try:
+MODEL_OUT = Path(__file__).parent.parent / "backend" / "api" / "services" / "predict_model.pkl"
+FEATURES = ["Hemoglobin","WBC","Platelets","Creatinine","SGPT","SGOT","Bilirubin"]
+CLASSES = ["Normal", "Anemia_Risk", "Kidney_Risk", "Liver_Risk"]
+# Share of each class: two thirds normal, the rest split evenly between the risks
+CLASS_WEIGHTS = [6 / 9, 1 / 9, 1 / 9, 1 / 9]
+# Per class, per feature (low, high) of the uniform draw
+CLASS_RANGES = {
+    "Normal":      [(13, 15), (4500, 8000), (200000, 350000), (0.7, 1.1), (15, 35), (15, 35), (0.3, 0.9)],
+    "Anemia_Risk": [(6, 10.5), (4500, 9000), (150000, 300000), (0.7, 1.2), (15, 40), (15, 40), (0.3, 1.0)],
+    "Kidney_Risk": [(11.5, 14.5), (4500, 9000), (150000, 300000), (1.4, 3.5), (15, 40), (15, 40), (0.3, 1.5)],
+    "Liver_Risk":  [(11.5, 14.5), (4500, 9000), (150000, 300000), (0.7, 1.2), (80, 200), (80, 200), (0.3, 3.0)],
+}
+# Decimal places kept per feature; None truncates to an integer
+DECIMALS = [1, None, None, 2, None, None, 1]
+CHUNK_ROWS = 1_000_000
+
+
+def generate(n_rows: int, rng):
+    """
+    Draw `n_rows` labeled rows.
+
+    Returns:
+        (X float64 array of shape (n_rows, len(FEATURES)), y int8 class codes)
+    """
+    y = rng.choice(len(CLASSES), size=n_rows, p=CLASS_WEIGHTS).astype(np.int8)
+    bounds = np.array([CLASS_RANGES[c] for c in CLASSES])  # (classes, features, 2)
+    low = bounds[y, :, 0]
+    high = bounds[y, :, 1]
+    X = low + rng.random((n_rows, len(FEATURES))) * (high - low)
+    for j, decimals in enumerate(DECIMALS):
+        X[:, j] = np.trunc(X[:, j]) if decimals is None else np.round(X[:, j], decimals)
+    return X, y
+
+
+def _parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def write_dataset(out_dir: Path, n_rows: int, seed: int, fmt: str = "auto", chunk_rows: int = CHUNK_ROWS) -> Path:
+    """
+    Generate `n_rows` rows in chunks and write them column by column.
+
+    "npy" writes one memory-mappable file per column plus meta.json;
+    "parquet" writes synthetic_data.parquet (needs pyarrow); "auto" picks
+    Parquet when pyarrow is installed. Output depends only on the seed,
+    row count and chunk size.
+    """
+    if fmt == "auto":
+        fmt = "parquet" if _parquet_available() else "npy"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        path = out_dir / "synthetic_data.parquet"
+        writer = None
+        try:
+            for start in range(0, n_rows, chunk_rows):
+                X, y = generate(min(chunk_rows, n_rows - start), rng)
+                columns = {f: X[:, j] for j, f in enumerate(FEATURES)}
+                columns["Label"] = pa.DictionaryArray.from_arrays(y, CLASSES)
+                table = pa.table(columns)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        return path
+
+    path = out_dir / "synthetic"
+    path.mkdir(parents=True, exist_ok=True)
+    columns = {f: np.lib.format.open_memmap(path / f"{f}.npy", mode="w+", dtype=np.float64, shape=(n_rows,))
+               for f in FEATURES}
+    labels = np.lib.format.open_memmap(path / "Label.npy", mode="w+", dtype=np.int8, shape=(n_rows,))
+    for start in range(0, n_rows, chunk_rows):
+        stop = min(start + chunk_rows, n_rows)
+        X, y = generate(stop - start, rng)
+        for j, f in enumerate(FEATURES):
+            columns[f][start:stop] = X[:, j]
+        labels[start:stop] = y
+    for column in [*columns.values(), labels]:
+        column.flush()
+    meta = {"rows": n_rows, "seed": seed, "chunk_rows": chunk_rows, "features": FEATURES, "classes": CLASSES}
+    (path / "meta.json").write_text(json.dumps(meta, indent=2))
+    return path
+
+
+def load_dataset(path: Path):
+    """(X, y) from a dataset written by `write_dataset`; y holds class names."""
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        X = np.column_stack([table.column(f).to_numpy() for f in FEATURES])
+        return X, np.asarray(table.column("Label").to_pylist())
+    meta = json.loads((path / "meta.json").read_text())
+    X = np.column_stack([np.load(path / f"{f}.npy", mmap_mode="r") for f in meta["features"]])
+    return X, np.asarray(meta["classes"])[np.load(path / "Label.npy")]
+
+
+def train(X, y, n_estimators: int = 200, max_depth=None, n_jobs: int = -1, seed: int = 42):
     from sklearn.ensemble import RandomForestClassifier
+    clf = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, n_jobs=n_jobs, random_state=seed)
+    return clf.fit(X, y)
+
+
+def measure_latency(forest: CompactForest, X, single_rows: int = 500, batch_size: int = 2048) -> dict:
+    """Single-row p50/p99 and batch throughput of the compact forest, on rows of X."""
+    times = []
+    for row in X[:single_rows]:
+        start = time.perf_counter()
+        forest.predict_with_proba(row)
+        times.append(time.perf_counter() - start)
+    batch = X[:batch_size]
+    start = time.perf_counter()
+    forest.predict_with_proba(batch)
+    batch_s = time.perf_counter() - start
+    return {
+        "single_p50_ms": round(float(np.percentile(times, 50)) * 1000, 3),
+        "single_p99_ms": round(float(np.percentile(times, 99)) * 1000, 3),
+        "batch_rows": len(batch),
+        "batch_ms": round(batch_s * 1000, 2),
+        "batch_rows_per_s": round(len(batch) / batch_s),
+    }
+
+
+def sweep(X_train, X_test, y_train, y_test, trees: list, depths: list, n_jobs: int = -1, seed: int = 42) -> list:
+    """Train every (trees, depth) combination and measure accuracy, size and latency."""
+    results = []
+    for n_estimators in trees:
+        for max_depth in depths:
+            start = time.perf_counter()
+            clf = train(X_train, y_train, n_estimators, max_depth, n_jobs, seed)
+            train_s = time.perf_counter() - start
+            with tempfile.TemporaryDirectory() as tmp:
+                meta = export_forest(clf, tmp, FEATURES)
+                size = sum(p.stat().st_size for p in Path(tmp).rglob("*.npy"))
+                forest = CompactForest.load(tmp, mmap=False)
+            accuracy = float((forest.predict(X_test) == y_test).mean())
+            results.append({
+                "trees": n_estimators,
+                "max_depth": max_depth,
+                "actual_depth": meta["max_depth"],
+                "nodes": meta["n_nodes"],
+                "size_kb": round(size / 1024, 1),
+                "accuracy": round(accuracy, 4),
+                "train_s": round(train_s, 2),
+                **measure_latency(forest, X_test),
+            })
+            print(_format_row(results[-1]), flush=True)
+    return results
+
+
+SWEEP_COLUMNS = ["trees", "max_depth", "actual_depth", "nodes", "size_kb", "accuracy",
+                 "train_s", "single_p50_ms", "single_p99_ms", "batch_rows_per_s"]
+
+
+def _format_row(row: dict) -> str:
+    return "  ".join(f"{str(row[c]):>{len(c)}}" for c in SWEEP_COLUMNS)
+
+
+def _int_list(text: str) -> list:
+    return [int(x) for x in text.split(",")]
+
+
+def _depth_list(text: str) -> list:
+    return [None if x.strip().lower() in ("none", "") else int(x) for x in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic data and train the risk model")
+    parser.add_argument("--rows", type=int, default=900, help="rows to generate")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--format", choices=["auto", "npy", "parquet"], default="auto")
+    parser.add_argument("--data", type=Path, help="train on an existing dataset instead of generating one")
+    parser.add_argument("--trees", default="200", help="forest size(s), comma separated for --sweep")
+    parser.add_argument("--depths", default="none", help="max depth(s), comma separated for --sweep; 'none' = unlimited")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="training processes (-1 = all cores)")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--sweep", action="store_true", help="report accuracy/size/latency per forest instead of saving")
+    parser.add_argument("--report", type=Path, help="write sweep results to this JSON file")
+    args = parser.parse_args(argv)
+
+    data_path = args.data
+    if data_path is None:
+        start = time.perf_counter()
+        data_path = write_dataset(OUT, args.rows, args.seed, args.format)
+        print(f"Saved {args.rows} synthetic rows to {data_path} in {time.perf_counter() - start:.2f}s")
+    X, y = load_dataset(data_path)
+
     from sklearn.model_selection import train_test_split
-    X = df.drop("Label", axis=1)
-    y = df["Label"]
-    X_train,X_test,y_train,y_test = train_test_split(X,y,test_size=0.2, random_state=42)
-    clf = RandomForestClassifier(n_estimators=200, random_state=42)
-    clf.fit(X_train, y_train)
-    model_out = Path(__file__).parent.parent / "backend" / "api" / "services" / "predict_model.pkl"
-    model_out.parent.mkdir(parents=True, exist_ok=True)
-    joblib.dump(clf, model_out)
-    print("Model trained and saved to", model_out)
-except Exception as e:
-    print("Training failed:", e)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size, random_state=args.seed)
+    trees, depths = _int_list(args.trees), _depth_list(args.depths)
+
+    if args.sweep:
+        print("  ".join(SWEEP_COLUMNS))
+        results = sweep(X_train, X_test, y_train, y_test, trees, depths, args.n_jobs, args.seed)
+        if args.report:
+            args.report.write_text(json.dumps({"rows": len(X), "seed": args.seed, "results": results}, indent=2))
+            print("Wrote sweep report to", args.report)
+        return
+
+    import joblib
+    start = time.perf_counter()
+    clf = train(X_train, y_train, trees[0], depths[0], args.n_jobs, args.seed)
+    print(f"Trained {trees[0]} trees in {time.perf_counter() - start:.2f}s, "
+          f"test accuracy {clf.score(X_test, y_test):.4f}")
+    MODEL_OUT.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(clf, MODEL_OUT)
+    print("Model trained and saved to", MODEL_OUT)
+    # Flat array export served by the API without unpickling or scikit-learn
+    forest_out = MODEL_OUT.parent / "predict_model"
+    meta = export_forest(clf, forest_out, FEATURES)
+    print(f"Exported {meta['n_trees']} trees ({meta['n_nodes']} nodes) to", forest_out)
+
+
+if __name__ == "__main__":
+    main()